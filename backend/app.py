@@ -1,60 +1,198 @@
-from flask import Flask, request, jsonify
+from flask import Flask, g, request, jsonify, Response, stream_with_context
 from flask_cors import CORS
-from event_planner import ( plan_trip, build_weather_overlay_by_place,
-                           optimize_itinerary, build_crime_overlay_by_place
+from event_planner import ( plan_trip, build_overlays,
+                           optimize_itinerary, stream_overlays, refresh_overlays,
+                           plan_batch, batch_event, BATCH_MAX_TRIPS, BATCH_MAX_CONCURRENCY
                         )
 import json
 from stream_tts import tts_app
+from jobs import JobQueue, QueueFull, job_priority
+from trip_store import TripStore
+import metrics
 
 
 import pdb
-import os
 
 app = Flask(__name__)
 CORS(app)
 
 app.register_blueprint(tts_app, url_prefix='/tts')
 
-DATA_DIR = 'public'
-os.makedirs(DATA_DIR, exist_ok=True)
+JOBS = JobQueue()
+TRIPS = TripStore()
 
-@app.route('/api/itinerary', methods=['POST'])
-def create_itinerary():
-    data = request.json
+@app.before_request
+def _start_trace():
+    g.trace_token = metrics.start_trace()
+
+@app.after_request
+def _timing_header(response):
+    """Server-Timing breakdown (per-stage ms, upstream calls, cache hits, LLM tokens) when asked for."""
+    trace = metrics.end_trace(g.pop('trace_token', None))
+    if trace is not None and metrics.wants_timing(request.headers):
+        response.headers['Server-Timing'] = metrics.server_timing(trace)
+    return response
 
-    # Also save latest
-    with open(os.path.join(DATA_DIR, 'last_itinerary.json'), 'w') as f:
-        json.dump(data, f)
+@app.route('/metrics', methods=['GET'])
+def prometheus_metrics():
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
 
+def _itinerary_pipeline(data, trip_id):
     base_plan = plan_trip(json.dumps(data))
-    weather_overlay = build_weather_overlay_by_place(json.dumps(data), base_plan)
-    crime_overlay = build_crime_overlay_by_place(json.dumps(data), base_plan)
+    # Both overlays start as soon as the base plan exists
+    weather_overlay, crime_overlay = build_overlays(json.dumps(data), base_plan)
 
-    return {"base_plan": base_plan.model_dump(),
-            "weather_overlay": weather_overlay,
-            "crime_overlay": crime_overlay}, 200
+    result = {"base_plan": base_plan.model_dump(mode="json"),
+              "weather_overlay": weather_overlay,
+              "crime_overlay": crime_overlay}
+    TRIPS.put(trip_id, data, **result)
+    return {"trip_id": trip_id, **result}
+
+@app.route('/api/itinerary', methods=['POST'])
+def create_itinerary():
+    """
+    Inline by default. With ?async=1 (or `Prefer: respond-async`) the pipeline is queued
+    and 202 {"job_id", "trip_id", "status_url"} comes back at once; poll GET /api/jobs/<job_id>.
+    Fairness and the per-client job cap are keyed on the peer address. Clients listed in
+    JOB_HIGH_PRIORITY_CLIENTS run "high"; anyone may pass ?priority=low to yield.
+    The reply's trip_id is what /api/replan loads the trip by.
+    """
+    data = request.json
+    trip_id = TRIPS.new_id()
+
+    if request.args.get('async') in ('1', 'true') or 'respond-async' in request.headers.get('Prefer', ''):
+        client = request.remote_addr or 'anonymous'
+        try:
+            job_id = JOBS.submit(_itinerary_pipeline, data, trip_id, client=client,
+                                 priority=job_priority(client, request.args.get('priority')))
+        except QueueFull as e:
+            return jsonify({'error': str(e)}), 429
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        status_url = f"/api/jobs/{job_id}"
+        return jsonify({"job_id": job_id, "trip_id": trip_id, "status_url": status_url}), 202, {"Location": status_url}
+
+    return _itinerary_pipeline(data, trip_id), 200
+
+@app.route('/api/jobs/<job_id>', methods=['GET'])
+def job_status(job_id):
+    """{"status": "queued" (with "position") | "running" | "done" (with "result") | "error"}"""
+    record = JOBS.status(job_id)
+    if record is None:
+        return jsonify({'error': 'unknown or expired job'}), 404
+    return jsonify(record), 200
+
+@app.route('/api/itinerary/stream', methods=['POST'])
+def stream_itinerary():
+    """
+    NDJSON variant of /api/itinerary. One JSON object per line:
+      {"event": "plan", "trip_id": "...", "base_plan": {...}}
+      {"event": "legWeather" | "legCrime", "index": i, "record": {...}}   (as each leg resolves)
+      {"event": "summary", "weather_overlay": {...}, "crime_overlay": {...}}
+    """
+    data = request.json
+    trip_id = TRIPS.new_id()
+
+    def events():
+        try:
+            base_plan = plan_trip(json.dumps(data))
+        except Exception as e:
+            yield json.dumps({"event": "error", "error": str(e)}) + "\n"
+            return
+        plan = base_plan.model_dump(mode="json")
+        TRIPS.put(trip_id, data, base_plan=plan)
+        yield json.dumps({"event": "plan", "trip_id": trip_id, "base_plan": plan}) + "\n"
+
+        for kind, index, record in stream_overlays(json.dumps(data), base_plan):
+            if kind == "summary":
+                TRIPS.put(trip_id, data, base_plan=plan, **record)
+                yield json.dumps({"event": "summary", **record}) + "\n"
+            else:
+                yield json.dumps({"event": kind, "index": index, "record": record}) + "\n"
+
+    return Response(stream_with_context(events()), mimetype='application/x-ndjson',
+                    headers={'X-Accel-Buffering': 'no', 'Cache-Control': 'no-cache'})
+
+def _batch_trips(data):
+    """Trip list from a batch body ({"trips": [...]} or a bare list); (trips, error reply)."""
+    trips = data.get('trips') if isinstance(data, dict) else data
+    if not isinstance(trips, list) or not trips:
+        return None, (jsonify({'error': 'expected a non-empty list of trips'}), 400)
+    if len(trips) > BATCH_MAX_TRIPS:
+        return None, (jsonify({'error': f'at most {BATCH_MAX_TRIPS} trips per batch'}), 413)
+    return trips, None
+
+@app.route('/api/itinerary/batch', methods=['POST'])
+def batch_itinerary():
+    """
+    Plan many trips in one request; body {"trips": [TripRequest, ...]} (or a bare list).
+    NDJSON, one object per line, `index` being the trip's position in the list:
+      {"event": "invalid", "index": i, "error": "..."}
+      {"event": "plan", "index": i, "trip_id": "...", "base_plan": {...}}
+      {"event": "overlays", "index": i, "trip_id": "...", "weather_overlay": {...}, "crime_overlay": {...}}
+      {"event": "error", "index": i, "error": "..."}
+      {"event": "summary", "trips": n, "planned": ..., "llm_calls": ..., "unique_places": ..., ...}
+    ?overlays=0 skips the overlays; ?max_concurrency=n lowers the number of Gemini calls in flight.
+    Every planned trip is stored, so its trip_id works with /api/replan.
+    """
+    trips, error = _batch_trips(request.get_json(silent=True))
+    if error:
+        return error
+    max_concurrency = max(1, min(request.args.get('max_concurrency', BATCH_MAX_CONCURRENCY, type=int),
+                                 BATCH_MAX_CONCURRENCY))
+    overlays = request.args.get('overlays', '1').lower() not in ('0', 'false', 'no')
+
+    def events():
+        trip_ids = {}
+        try:
+            for kind, index, payload in plan_batch(trips, max_concurrency=max_concurrency, overlays=overlays):
+                if kind == 'plan':
+                    trip_ids[index] = TRIPS.new_id()
+                    TRIPS.put(trip_ids[index], trips[index], **payload)
+                elif kind == 'overlays':
+                    TRIPS.update(trip_ids[index], **payload)
+                yield json.dumps(batch_event(kind, index, payload, trip_id=trip_ids.get(index))) + "\n"
+        except Exception as e:
+            yield json.dumps({"event": "error", "error": str(e)}) + "\n"
+
+    return Response(stream_with_context(events()), mimetype='application/x-ndjson',
+                    headers={'X-Accel-Buffering': 'no', 'Cache-Control': 'no-cache'})
 
 @app.route('/api/replan', methods=['POST'])
 def replan_itinerary():
     data = request.json
 
     try:
-        with open(os.path.join(DATA_DIR, 'last_itinerary.json'), 'r') as f:
-            sample = json.load(f)
-
-        # Expecting data = {"signal": {...}, "itinerary": {...}}
+        # Expecting data = {"trip_id": "...", "signal": {...}, "itinerary": {...}};
+        # trip_id may also come inside itinerary (the /api/itinerary reply sent back as-is)
         signal = data.get('signal', {})
-        itinerary = data.get('itinerary', {})
-
-        print('Sample:', sample)
+        itinerary = data.get('itinerary') or {}
+        trip_id = data.get('trip_id') or itinerary.get('trip_id')
+        stored = TRIPS.get(trip_id)
+        if stored is None:
+            return jsonify({'error': 'unknown or expired trip_id'}), 404
+        sample = stored['trip']
 
         optimized = optimize_itinerary(
             json.dumps(sample),
-            json.dumps(itinerary.get('base_plan', {})),
+            json.dumps(itinerary.get('base_plan') or stored.get('base_plan') or {}),
             json.dumps(signal)
         )
 
-        return jsonify({"base_plan": optimized.optimized.model_dump()}), 200
+        # Only legs that were added, moved or replaced get fresh overlay lookups
+        weather_overlay, crime_overlay, reuse = refresh_overlays(
+            json.dumps(sample),
+            optimized.optimized,
+            itinerary.get('weather_overlay') or stored.get('weather_overlay'),
+            itinerary.get('crime_overlay') or stored.get('crime_overlay'),
+            optimized.changes,
+        )
+
+        result = {"base_plan": optimized.optimized.model_dump(mode="json"),
+                  "weather_overlay": weather_overlay,
+                  "crime_overlay": crime_overlay}
+        TRIPS.put(trip_id, sample, **result)
+        return jsonify({"trip_id": trip_id, **result, "overlay_reuse": reuse}), 200
     except Exception as e:
         return jsonify({'error': str(e)}), 404
 
@@ -0,0 +1,218 @@
+# asgi_app.py
+"""
+Async serving mode for the itinerary API (Quart, the asyncio port of Flask).
+
+Same routes and payloads as app.py for /api/itinerary, /api/itinerary/batch,
+/api/replan and /tts/stream-itinerary, but a request waiting on Gemini or ElevenLabs is a suspended
+coroutine rather than a blocked worker thread, so one process can keep hundreds
+of plans in flight:
+  - Gemini calls use `ainvoke` (aplan_trip / aoptimize_itinerary), or
+    `abatch_as_completed` for batches (aplan_batch);
+  - overlay stages run on the existing bounded pools and are awaited;
+  - the live TTS segment streams through an httpx.AsyncClient (upstream.py).
+
+Run:
+    hypercorn asgi_app:app --bind 0.0.0.0:5000
+    # or: uvicorn asgi_app:app --port 5000
+"""
+import json
+import asyncio
+
+from quart import Quart, Blueprint, g, request, jsonify, Response, send_file, url_for
+from quart_cors import cors
+
+from event_planner import (
+    aplan_trip, abuild_overlays, aoptimize_itinerary, arefresh_overlays, warm_up,
+    aplan_batch, batch_event, BATCH_MAX_TRIPS, BATCH_MAX_CONCURRENCY,
+)
+from upstream import UPSTREAMS
+import metrics
+from trip_store import TripStore
+from stream_tts import (
+    AUDIO_CACHE, TTSError, generate_itinerary_segments, itinerary_key, segment_key,
+    synthesize_segments, aread_segment, arequest_tts, arelay,
+)
+
+app = cors(Quart(__name__))
+
+TRIPS = TripStore()
+
+
+@app.before_request
+async def _start_trace():
+    g.trace_token = metrics.start_trace()
+
+
+@app.after_request
+async def _timing_header(response):
+    trace = metrics.end_trace(g.pop("trace_token", None))
+    if trace is not None and metrics.wants_timing(request.headers):
+        response.headers["Server-Timing"] = metrics.server_timing(trace)
+    return response
+
+
+@app.route('/metrics', methods=['GET'])
+async def prometheus_metrics():
+    return Response(metrics.render(), mimetype="text/plain; version=0.0.4")
+
+
+@app.before_serving
+async def _warm_up():
+    # Runs in each worker process, so the Gemini client is never shared across a fork
+    await asyncio.to_thread(warm_up)
+
+
+@app.after_serving
+async def _close_upstreams():
+    for upstream in UPSTREAMS.values():
+        await upstream.aclose()
+
+
+@app.route('/api/itinerary', methods=['POST'])
+async def create_itinerary():
+    data = await request.get_json()
+    trip_id = TRIPS.new_id()
+
+    base_plan = await aplan_trip(json.dumps(data))
+    weather_overlay, crime_overlay = await abuild_overlays(json.dumps(data), base_plan)
+
+    result = {"base_plan": base_plan.model_dump(mode="json"),
+              "weather_overlay": weather_overlay,
+              "crime_overlay": crime_overlay}
+    TRIPS.put(trip_id, data, **result)
+    return {"trip_id": trip_id, **result}, 200
+
+
+@app.route('/api/itinerary/batch', methods=['POST'])
+async def batch_itinerary():
+    """Same body, query options and NDJSON events as app.py; Gemini calls use abatch_as_completed."""
+    data = await request.get_json(silent=True)
+    trips = data.get("trips") if isinstance(data, dict) else data
+    if not isinstance(trips, list) or not trips:
+        return jsonify({"error": "expected a non-empty list of trips"}), 400
+    if len(trips) > BATCH_MAX_TRIPS:
+        return jsonify({"error": f"at most {BATCH_MAX_TRIPS} trips per batch"}), 413
+    max_concurrency = max(1, min(request.args.get("max_concurrency", BATCH_MAX_CONCURRENCY, type=int),
+                                 BATCH_MAX_CONCURRENCY))
+    overlays = request.args.get("overlays", "1").lower() not in ("0", "false", "no")
+
+    async def events():
+        trip_ids = {}
+        try:
+            async for kind, index, payload in aplan_batch(trips, max_concurrency=max_concurrency, overlays=overlays):
+                if kind == "plan":
+                    trip_ids[index] = TRIPS.new_id()
+                    TRIPS.put(trip_ids[index], trips[index], **payload)
+                elif kind == "overlays":
+                    TRIPS.update(trip_ids[index], **payload)
+                yield (json.dumps(batch_event(kind, index, payload, trip_id=trip_ids.get(index))) + "\n").encode()
+        except Exception as e:
+            yield (json.dumps({"event": "error", "error": str(e)}) + "\n").encode()
+
+    return Response(events(), mimetype="application/x-ndjson",
+                    headers={"X-Accel-Buffering": "no", "Cache-Control": "no-cache"})
+
+
+@app.route('/api/replan', methods=['POST'])
+async def replan_itinerary():
+    data = await request.get_json()
+
+    try:
+        signal = data.get('signal', {})
+        itinerary = data.get('itinerary') or {}
+        trip_id = data.get('trip_id') or itinerary.get('trip_id')
+        stored = TRIPS.get(trip_id)
+        if stored is None:
+            return jsonify({'error': 'unknown or expired trip_id'}), 404
+        sample = stored['trip']
+
+        optimized = await aoptimize_itinerary(
+            json.dumps(sample),
+            json.dumps(itinerary.get('base_plan') or stored.get('base_plan') or {}),
+            json.dumps(signal)
+        )
+        weather_overlay, crime_overlay, reuse = await arefresh_overlays(
+            json.dumps(sample),
+            optimized.optimized,
+            itinerary.get('weather_overlay') or stored.get('weather_overlay'),
+            itinerary.get('crime_overlay') or stored.get('crime_overlay'),
+            optimized.changes,
+        )
+
+        result = {"base_plan": optimized.optimized.model_dump(mode="json"),
+                  "weather_overlay": weather_overlay,
+                  "crime_overlay": crime_overlay}
+        TRIPS.put(trip_id, sample, **result)
+        return jsonify({"trip_id": trip_id, **result, "overlay_reuse": reuse}), 200
+    except Exception as e:
+        return jsonify({'error': str(e)}), 404
+
+
+# ===== TTS (mirrors stream_tts.py) =====
+tts_app = Blueprint("tts", __name__)
+
+@tts_app.route("/stream-itinerary", methods=["POST"])
+async def stream_itinerary_tts():
+    data = await request.get_json()
+    base_plan = data.get("base_plan")
+    if not base_plan:
+        return jsonify({"error": "base_plan missing"}), 400
+
+    segments = generate_itinerary_segments(base_plan)
+    key = itinerary_key(segments)
+    cached = AUDIO_CACHE.lookup(key)
+    if cached:
+        metrics.count("tts.cache_hits")
+        resp = await send_file(cached, mimetype="audio/mpeg", conditional=True)
+        resp.headers["X-TTS-Cache"] = "HIT"
+        resp.headers["X-TTS-Audio-URL"] = url_for("tts.cached_audio", key=key)
+        return resp
+
+    seg_keys = [segment_key(t) for t in segments]
+    missing = [i for i, k in enumerate(seg_keys) if not AUDIO_CACHE.lookup(k)]
+    metrics.count("tts.cache_misses")
+    metrics.count("tts.segments_synthesized", len(missing))
+
+    # First segment streams live over the async client; the rest go to the shared
+    # synthesis pool (same global TTS_MAX_PARALLEL cap as the sync app) and are awaited.
+    first_live = None
+    if missing and missing[0] == 0:
+        try:
+            first_live = await arequest_tts(segments[0])
+        except TTSError as e:
+            return jsonify({"error": str(e)}), 500
+    pending = {i: asyncio.wrap_future(f)
+               for i, f in synthesize_segments(seg_keys, segments, [i for i in missing if i != 0]).items()}
+
+    async def stitched():
+        with metrics.span("tts.stream"):
+            for i, seg_key in enumerate(seg_keys):
+                if i == 0 and first_live is not None:
+                    async for chunk in AUDIO_CACHE.atee(seg_key, arelay(first_live)):
+                        yield chunk
+                    continue
+                path = await pending[i] if i in pending else AUDIO_CACHE.path(seg_key)
+                async for chunk in aread_segment(path, strip_tag=i > 0):
+                    yield chunk
+
+    return Response(
+        AUDIO_CACHE.atee(key, stitched()),
+        mimetype="audio/mpeg",
+        headers={"Content-Disposition": 'inline; filename="itinerary.mp3"',
+                 "X-Accel-Buffering": "no",
+                 "X-TTS-Cache": "MISS",
+                 "X-TTS-Segments-Synthesized": str(len(missing)),
+                 "X-TTS-Audio-URL": url_for("tts.cached_audio", key=key)},
+    )
+
+@tts_app.route("/audio/<key>.mp3", methods=["GET"])
+async def cached_audio(key):
+    """Cached audio by content key; GET/HEAD with Range so <audio> elements can seek."""
+    if len(key) != 64 or any(c not in "0123456789abcdef" for c in key):
+        return jsonify({"error": "bad audio key"}), 400
+    path = AUDIO_CACHE.lookup(key)
+    if not path:
+        return jsonify({"error": "audio not cached"}), 404
+    return await send_file(path, mimetype="audio/mpeg", conditional=True)
+
+app.register_blueprint(tts_app, url_prefix='/tts')
@@ -0,0 +1,152 @@
+# audio_cache.py
+"""
+Content-addressed on-disk cache for synthesized audio.
+
+Files live at <dir>/<key[:2]>/<key>.mp3 where key is a SHA-256 over everything
+that affects the audio (script text, voice, model, voice settings). A file's mtime
+doubles as its LRU timestamp: hits touch it, and eviction removes the oldest files
+once the directory grows past its byte budget. The directory is walked once, on
+first use; after that an in-memory LRU index with a running byte total is updated
+on every hit, commit and delete. Each process keeps its own index; files another
+worker wrote join it when this process first looks them up.
+
+Misses are written with `tee`, which passes chunks through to the listener while
+copying them into a temp file; the file only becomes visible once the full stream
+has been received.
+"""
+import os, json, hashlib, threading
+from collections import OrderedDict
+from typing import AsyncIterable, AsyncIterator, Iterable, Iterator, Optional
+
+TTS_CACHE_DIR    = os.getenv("TTS_CACHE_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "tts_cache"))
+TTS_CACHE_MAX_MB = float(os.getenv("TTS_CACHE_MAX_MB", "200"))
+
+
+def audio_key(**parts) -> str:
+    """Stable hash of the synthesis inputs (text, voice id, model id, voice settings...)."""
+    blob = json.dumps(parts, sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+    return hashlib.sha256(blob.encode("utf-8")).hexdigest()
+
+
+class AudioCache:
+    def __init__(self, root: str = TTS_CACHE_DIR, max_bytes: int = int(TTS_CACHE_MAX_MB * 1024 * 1024)):
+        self.root = root
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._index: Optional["OrderedDict[str, int]"] = None   # path -> bytes, least recently used first
+        self._bytes = 0
+
+    def path(self, key: str) -> str:
+        return os.path.join(self.root, key[:2], f"{key}.mp3")
+
+    def lookup(self, key: str) -> Optional[str]:
+        """Path of a cached file (and mark it recently used), or None."""
+        path = self.path(key)
+        try:
+            os.utime(path)
+        except OSError:
+            return None
+        with self._lock:
+            if self._index is not None:
+                if path in self._index:
+                    self._index.move_to_end(path)
+                else:  # written by another worker process
+                    try:
+                        self._track(path, os.path.getsize(path))
+                    except OSError:
+                        pass
+        return path
+
+    def _scan(self) -> None:
+        """Build the LRU index from the directory (mtime order); caller holds the lock."""
+        files = []
+        for dirpath, _, names in os.walk(self.root):
+            for name in names:
+                if not name.endswith(".mp3"):
+                    continue
+                full = os.path.join(dirpath, name)
+                try:
+                    st = os.stat(full)
+                except OSError:
+                    continue
+                files.append((st.st_mtime, full, st.st_size))
+        self._index = OrderedDict((full, size) for _, full, size in sorted(files))
+        self._bytes = sum(self._index.values())
+
+    def _track(self, path: str, size: int) -> None:
+        """Count a file as most recently used; caller holds the lock."""
+        self._bytes += size - self._index.pop(path, 0)
+        self._index[path] = size
+
+    def _commit(self, tmp: str, path: str) -> None:
+        size = os.path.getsize(tmp)
+        os.replace(tmp, path)
+        with self._lock:
+            if self._index is None:
+                self._scan()  # first commit: the walk picks up the new file too
+            else:
+                self._track(path, size)
+        self.evict()
+
+    def tee(self, key: str, chunks: Iterable[bytes]) -> Iterator[bytes]:
+        """Yield chunks unchanged while writing them to the cache; commit only on a complete stream."""
+        path = self.path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.part"
+        complete = False
+        try:
+            with open(tmp, "wb") as f:
+                for chunk in chunks:
+                    f.write(chunk)
+                    yield chunk
+            complete = True
+        finally:
+            if complete:
+                self._commit(tmp, path)
+            else:
+                try:
+                    os.remove(tmp)
+                except OSError:
+                    pass
+
+    async def atee(self, key: str, chunks: AsyncIterable[bytes]) -> AsyncIterator[bytes]:
+        """`tee` for async chunk sources (ASGI app)."""
+        path = self.path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f"{path}.{os.getpid()}.{id(chunks)}.part"
+        complete = False
+        try:
+            with open(tmp, "wb") as f:
+                async for chunk in chunks:
+                    f.write(chunk)
+                    yield chunk
+            complete = True
+        finally:
+            if complete:
+                self._commit(tmp, path)
+            else:
+                try:
+                    os.remove(tmp)
+                except OSError:
+                    pass
+
+    def put(self, key: str, data: bytes) -> str:
+        for _ in self.tee(key, [data]):
+            pass
+        return self.path(key)
+
+    def evict(self) -> int:
+        """Drop least recently used files until the cache fits its byte budget."""
+        with self._lock:
+            if self._index is None:
+                self._scan()
+            removed = 0
+            while self._bytes > self.max_bytes and self._index:
+                full, size = self._index.popitem(last=False)
+                self._bytes -= size
+                try:
+                    os.remove(full)
+                    removed += 1
+                except OSError:  # already gone (another worker evicted it)
+                    pass
+            return removed
@@ -0,0 +1,168 @@
+# benchmarks/load_itinerary.py
+"""
+Concurrency load test for POST /api/itinerary: sync Flask app vs async ASGI app.
+
+Against running servers:
+    python benchmarks/load_itinerary.py --url http://127.0.0.1:5000 --concurrency 200 --requests 400
+
+Self-contained comparison (no API keys): boots each app in-process with a stub
+Gemini that takes --llm-delay seconds and the local upstream stubs (stubs.py, answering
+after --latency seconds), then fires the same load at both. The Flask app runs on a fixed pool of --workers threads, like
+`gunicorn --threads 8`; the ASGI app runs on one hypercorn event loop.
+    python benchmarks/load_itinerary.py --serve both --concurrency 200 --requests 400 --llm-delay 2 --latency 0.2
+"""
+import os, sys, json, time, socket, asyncio, argparse, threading, statistics, urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+TRIP = {
+    "startLocation": "Times Square, New York, NY 10036, USA",
+    "endLocation": "",
+    "transportMode": ["subways", "walk"],
+    "startTime": "2025-10-04T08:08",
+    "tripDuration": "6",
+    "wheelchairAccessible": "false",
+    "activityPreferences": "Sightseeing, Parks",
+}
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+# ---- stubs (only for --serve): benchmarks/stubs.py ----
+def _stub_environment(llm_delay: float, latency: float, crime_source: str) -> None:
+    """Point upstreams at local stubs and swap Gemini for a fixed-latency fake; call before importing the apps."""
+    from stubs import stub_environment
+    stub_environment(llm_delay=llm_delay, latency=latency, crime_source=crime_source)
+
+
+def _serve_flask(port: int, workers: int) -> None:
+    """WSGI server with a fixed worker-thread pool (the sync deployment model)."""
+    from wsgiref.simple_server import WSGIServer, WSGIRequestHandler, make_server
+    from app import app
+
+    class QuietHandler(WSGIRequestHandler):
+        def log_message(self, *args):
+            pass
+
+    class PooledWSGIServer(WSGIServer):
+        request_queue_size = 1024
+        pool = ThreadPoolExecutor(max_workers=workers)
+
+        def process_request(self, req, addr):
+            self.pool.submit(self._handle, req, addr)
+
+        def _handle(self, req, addr):
+            try:
+                self.finish_request(req, addr)
+            finally:
+                self.shutdown_request(req)
+
+    server = make_server("127.0.0.1", port, app, server_class=PooledWSGIServer, handler_class=QuietHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+
+def _serve_asgi(port: int) -> None:
+    from hypercorn.config import Config
+    from hypercorn.asyncio import serve
+    from asgi_app import app
+
+    config = Config()
+    config.bind = [f"127.0.0.1:{port}"]
+    config.backlog = 1024
+    config.accesslog = None
+    # A shutdown trigger keeps hypercorn from installing signal handlers (main thread only)
+    never = lambda: asyncio.Event().wait()
+    threading.Thread(target=lambda: asyncio.run(serve(app, config, shutdown_trigger=never)), daemon=True).start()
+
+
+def _wait_ready(url: str, timeout: float = 15) -> None:
+    host, port = url.split("//")[1].split(":")
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            socket.create_connection((host, int(port)), timeout=0.5).close()
+            return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError(f"{url} did not start")
+
+
+# ---- load generator ----
+def run_load(url: str, total: int, concurrency: int, timeout: float) -> dict:
+    in_flight = 0
+    peak = 0
+    lock = threading.Lock()
+    latencies, errors = [], 0
+
+    def one(i):
+        nonlocal in_flight, peak, errors
+        body = json.dumps(dict(TRIP, startLocation=f"{TRIP['startLocation']} #{i}")).encode()
+        req = urllib.request.Request(f"{url}/api/itinerary", data=body,
+                                     headers={"Content-Type": "application/json"})
+        with lock:
+            in_flight += 1
+            peak = max(peak, in_flight)
+        t = time.perf_counter()
+        try:
+            with urllib.request.urlopen(req, timeout=timeout) as r:
+                r.read()
+            latencies.append(time.perf_counter() - t)
+        except Exception:
+            with lock:
+                errors += 1
+        finally:
+            with lock:
+                in_flight -= 1
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(one, range(total)))
+    wall = time.perf_counter() - start
+    lat = sorted(latencies)
+    return {
+        "requests": total,
+        "ok": len(lat),
+        "errors": errors,
+        "wall_s": round(wall, 2),
+        "throughput_rps": round(len(lat) / wall, 1) if wall else None,
+        "p50_s": round(statistics.median(lat), 3) if lat else None,
+        "p95_s": round(lat[int(0.95 * (len(lat) - 1))], 3) if lat else None,
+        "client_peak_in_flight": peak,
+    }
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--url", help="base URL of a running server")
+    ap.add_argument("--serve", choices=["flask", "asgi", "both"], help="boot the app(s) in-process with stubs")
+    ap.add_argument("--requests", type=int, default=400)
+    ap.add_argument("--concurrency", type=int, default=200)
+    ap.add_argument("--workers", type=int, default=8, help="Flask worker threads (--serve)")
+    ap.add_argument("--llm-delay", type=float, default=2.0, help="stub Gemini latency in seconds (--serve)")
+    ap.add_argument("--latency", type=float, default=0.2, help="stub upstream latency in seconds (--serve)")
+    ap.add_argument("--crime-source", choices=["index", "soda"], default="soda",
+                    help="local crime index or stub SODA queries (--serve)")
+    ap.add_argument("--timeout", type=float, default=120)
+    args = ap.parse_args()
+
+    if args.url:
+        targets = {args.url: args.url}
+    elif args.serve:
+        _stub_environment(args.llm_delay, args.latency, args.crime_source)
+        targets = {}
+        for kind in (["flask", "asgi"] if args.serve == "both" else [args.serve]):
+            port = _free_port()
+            _serve_flask(port, args.workers) if kind == "flask" else _serve_asgi(port)
+            targets[kind] = f"http://127.0.0.1:{port}"
+    else:
+        ap.error("pass --url or --serve")
+
+    for name, url in targets.items():
+        _wait_ready(url)
+        print(json.dumps({"target": name, **run_load(url, args.requests, args.concurrency, args.timeout)}))
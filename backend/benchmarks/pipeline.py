@@ -0,0 +1,190 @@
+# benchmarks/pipeline.py
+"""
+Offline end-to-end benchmark: per-stage latency, endpoint throughput and memory.
+
+Every upstream (Gemini, OWM, Nominatim, SODA, ElevenLabs) is a local stub from
+benchmarks/stubs.py, so no API keys or network are needed and runs are repeatable.
+Results are printed as one JSON object per line, suitable for diffing between commits.
+
+  stages     plan_trip, weather / crime overlays, build_overlays, optimize_itinerary
+             and the TTS blueprint, each timed over --iterations runs (p50/p95/p99/max).
+  endpoints  POST /api/itinerary then POST /api/replan (same trip_id) through the Flask
+             app, --requests of each at --concurrency; throughput, percentiles, errors.
+  memory     peak RSS, plus tracemalloc peak per stage with --trace-alloc (slower).
+
+Examples:
+    python benchmarks/pipeline.py
+    python benchmarks/pipeline.py --only endpoints --requests 200 --concurrency 32 --llm-delay 1
+    python benchmarks/pipeline.py --latency 0.1 --jitter 0.05 --error-rate 0.02 --slow soda=0.4 --crime-source soda
+"""
+import os, sys, json, time, argparse, resource, statistics, threading, tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from stubs import StubProfile, UPSTREAM_NAMES, stub_environment, bench_trip
+
+
+def _percentiles(samples: list) -> dict:
+    s = sorted(samples)
+    if not s:
+        return {"n": 0}
+    pick = lambda q: round(s[min(len(s) - 1, int(q * len(s)))] * 1000, 1)
+    return {"n": len(s), "mean_ms": round(statistics.fmean(s) * 1000, 1),
+            "p50_ms": pick(0.50), "p95_ms": pick(0.95), "p99_ms": pick(0.99), "max_ms": round(s[-1] * 1000, 1)}
+
+
+def _max_rss_mb() -> float:
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(rss / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+def _timed(fn, trace_alloc: bool):
+    """(result, seconds, tracemalloc peak bytes or None)."""
+    if trace_alloc:
+        tracemalloc.start()
+    t = time.perf_counter()
+    try:
+        result = fn()
+    finally:
+        elapsed = time.perf_counter() - t
+        peak = tracemalloc.get_traced_memory()[1] if trace_alloc else None
+        if trace_alloc:
+            tracemalloc.stop()
+    return result, elapsed, peak
+
+
+# ---- stages ----
+def run_stages(iterations: int, trace_alloc: bool) -> dict:
+    import event_planner as ep
+    from app import app
+
+    client = app.test_client()
+    samples = {k: [] for k in ("plan_trip", "weather_overlay", "crime_overlay", "build_overlays",
+                               "optimize_itinerary", "tts_stream")}
+    peaks = {k: 0 for k in samples}
+    errors = {k: 0 for k in samples}
+
+    def record(stage, fn):
+        """Time one stage run; failures (e.g. an injected 503 mid TTS stream) are counted, not timed."""
+        try:
+            result, elapsed, peak = _timed(fn, trace_alloc)
+        except Exception:
+            errors[stage] += 1
+            return None
+        samples[stage].append(elapsed)
+        if peak:
+            peaks[stage] = max(peaks[stage], peak)
+        return result
+
+    for i in range(iterations):
+        trip_json = json.dumps(bench_trip(f"Times Square #{i}, New York, NY 10036, USA"))
+        plan = record("plan_trip", lambda: ep.plan_trip(trip_json))
+        record("weather_overlay", lambda: ep.build_weather_overlay_by_place(trip_json, plan))
+        record("crime_overlay", lambda: ep.build_crime_overlay_by_place(trip_json, plan))
+        # Fresh places for the combined run, so it is not served from the caches just warmed
+        plan = ep.plan_trip(trip_json, use_cache=False)
+        weather, _ = record("build_overlays", lambda: ep.build_overlays(trip_json, plan))
+        signal = json.dumps({"weather": weather, "user_notes": ["Prefer more museums"]})
+        record("optimize_itinerary", lambda: ep.optimize_itinerary(trip_json, plan.model_dump_json(), signal))
+
+        def tts():
+            r = client.post("/tts/stream-itinerary", json={"base_plan": plan.model_dump(mode="json")}, buffered=False)
+            n = sum(len(chunk) for chunk in r.response)
+            if r.status_code != 200:
+                raise RuntimeError(f"TTS {r.status_code}")
+            return n
+        record("tts_stream", tts)
+
+    out = {stage: {**_percentiles(s), "errors": errors[stage]} for stage, s in samples.items()}
+    if trace_alloc:
+        for stage, peak in peaks.items():
+            out[stage]["alloc_peak_kb"] = round(peak / 1024, 1)
+    return out
+
+
+# ---- endpoints ----
+def run_endpoints(total: int, concurrency: int) -> dict:
+    from app import app
+
+    lock = threading.Lock()
+    lat = {"itinerary": [], "replan": []}
+    errors = {"itinerary": 0, "replan": 0}
+
+    def call(kind, path, body):
+        t = time.perf_counter()
+        r = app.test_client().post(path, json=body)
+        ok = r.status_code == 200
+        with lock:
+            if ok:
+                lat[kind].append(time.perf_counter() - t)
+            else:
+                errors[kind] += 1
+        return r.get_json() if ok else None
+
+    def one(i):
+        created = call("itinerary", "/api/itinerary", bench_trip(f"Times Square #{i}, New York, NY 10036, USA"))
+        if created:
+            call("replan", "/api/replan", {"trip_id": created["trip_id"],
+                                           "signal": {"user_notes": ["Swap one stop for a museum"]}})
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(one, range(total)))
+    wall = time.perf_counter() - start
+    return {
+        "requests": total,
+        "concurrency": concurrency,
+        "wall_s": round(wall, 2),
+        "throughput_rps": round((len(lat["itinerary"]) + len(lat["replan"])) / wall, 1) if wall else None,
+        **{f"/api/{kind}": {**_percentiles(lat[kind]), "errors": errors[kind]} for kind in lat},
+    }
+
+
+def _parse_overrides(items: list, latency: float, jitter: float, error_rate: float) -> dict:
+    """--slow name=seconds[:error_rate] -> {name: StubProfile}"""
+    overrides = {}
+    for item in items or []:
+        name, _, spec = item.partition("=")
+        if name not in UPSTREAM_NAMES or not spec:
+            raise SystemExit(f"--slow expects one of {UPSTREAM_NAMES}=seconds[:error_rate], got {item!r}")
+        secs, _, err = spec.partition(":")
+        overrides[name] = StubProfile(float(secs), jitter, float(err) if err else error_rate)
+    return overrides
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--only", choices=["stages", "endpoints"], help="run one part only")
+    ap.add_argument("--iterations", type=int, default=20, help="runs per stage")
+    ap.add_argument("--requests", type=int, default=100, help="itinerary+replan pairs for the endpoint run")
+    ap.add_argument("--concurrency", type=int, default=16)
+    ap.add_argument("--llm-delay", type=float, default=0.5, help="stub Gemini latency in seconds")
+    ap.add_argument("--llm-jitter", type=float, default=0.0)
+    ap.add_argument("--latency", type=float, default=0.05, help="stub upstream latency in seconds")
+    ap.add_argument("--jitter", type=float, default=0.02)
+    ap.add_argument("--error-rate", type=float, default=0.0, help="fraction of upstream calls answered with 503")
+    ap.add_argument("--slow", action="append", metavar="NAME=S[:ERR]",
+                    help=f"per-upstream latency / error rate; NAME in {', '.join(UPSTREAM_NAMES)}")
+    ap.add_argument("--crime-source", choices=["index", "soda"], default="index",
+                    help="local crime index (fixture CSV) or stub SODA queries")
+    ap.add_argument("--trace-alloc", action="store_true", help="tracemalloc peak per stage")
+    args = ap.parse_args()
+
+    stub_stats = stub_environment(
+        llm_delay=args.llm_delay, llm_jitter=args.llm_jitter, latency=args.latency, jitter=args.jitter,
+        error_rate=args.error_rate, crime_source=args.crime_source,
+        overrides=_parse_overrides(args.slow, args.latency, args.jitter, args.error_rate),
+    )
+    from upstream import upstream_stats
+    from prompt_codec import prompt_stats
+
+    config = {k: v for k, v in vars(args).items() if k != "only"}
+    if args.only in (None, "stages"):
+        print(json.dumps({"bench": "stages", "config": config, **run_stages(args.iterations, args.trace_alloc)}))
+    if args.only in (None, "endpoints"):
+        print(json.dumps({"bench": "endpoints", "config": config, **run_endpoints(args.requests, args.concurrency)}))
+    print(json.dumps({"bench": "upstreams", "max_rss_mb": _max_rss_mb(),
+                      "stub_calls": stub_stats.snapshot(), "clients": upstream_stats(),
+                      "prompt_tokens": prompt_stats()}))
@@ -0,0 +1,79 @@
+# benchmarks/prompt_size.py
+"""
+Prompt size per LLM call, verbose JSON vs compact encoding (prompt_codec.py).
+
+Builds the planner message and the optimizer message for weather, preference-note
+and budget signals from the canned benchmark plan, without calling Gemini, and
+prints estimated tokens per call as JSON lines: the total and the per-request
+("dynamic") part that follows the static, cacheable system prefix. Exits 1 when a compact prompt is
+over its cap, so CI can fail on prompt-size regressions:
+
+    python benchmarks/prompt_size.py --max-plan-tokens 900 --max-optimize-tokens 1400
+"""
+import os, sys, json, argparse
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("CACHE_DB_PATH", "")
+
+import event_planner as ep
+from prompt_codec import count_tokens
+from stubs import canned_itinerary, bench_trip
+
+RAIN = {"condition": "Light Rain", "icon": "10d"}
+
+
+def _signals(plan) -> dict:
+    weather = {"legWeather": [{"sequence": leg.sequence, "departTime": leg.departTime, "arriveTime": leg.arriveTime,
+                               "departWeather": RAIN if leg.sequence in (1, 5) else {"condition": "Clouds"},
+                               "arriveWeather": None} for leg in plan.legs]}
+    return {
+        "weather": {"weather": weather},
+        "notes": {"user_notes": ["Swap the park for a museum", "Vegetarian lunch near MoMA"]},
+        "budget": {"tripBudgetUSD": 25},
+        "all": {"weather": weather, "user_notes": ["Swap the park for a museum"], "tripBudgetUSD": 25},
+    }
+
+
+def _sizes(messages: list) -> dict:
+    """Total estimate and the per-request part (everything after the static system prefix)."""
+    return {"total": count_tokens(messages), "dynamic": count_tokens([m for m in messages if m["role"] != "system"])}
+
+
+def measure() -> list:
+    trip_dict = dict(bench_trip(), cuisines="Thai", dietPreferences="vegetarian")
+    trip = ep.TripRequest(**trip_dict)
+    plan = canned_itinerary()
+    rows = [{"call": "plan", **{enc: _sizes(ep._planner_messages(trip, enc)) for enc in ("json", "compact")}}]
+
+    keep = ["sequence", "mode", "departTime", "arriveTime", "fromLocation", "toLocation",
+            "estDurationMin", "costEstimateUSD", "accessibilityNotes", "choiceReasoning"]
+    slim = ep._strip_itinerary_for_optimizer(plan, keep)
+    for name, sig in _signals(plan).items():
+        _, risks = ep._summarize_weather_risk_from_overlay(sig.get("weather"))
+        notes, budget = sig.get("user_notes") or [], sig.get("tripBudgetUSD")
+        rows.append({"call": f"optimize[{name}]",
+                     **{enc: _sizes(ep._optimizer_messages(trip, notes, budget, risks, slim, enc))
+                        for enc in ("json", "compact")}})
+    for r in rows:
+        r["saved_pct"] = round(100 * (1 - r["compact"]["total"] / r["json"]["total"]), 1)
+        r["dynamic_saved_pct"] = round(100 * (1 - r["compact"]["dynamic"] / r["json"]["dynamic"]), 1)
+    return rows
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--max-plan-tokens", type=int, help="fail if the compact planner prompt is larger")
+    ap.add_argument("--max-optimize-tokens", type=int, help="fail if any compact optimizer prompt is larger")
+    args = ap.parse_args()
+
+    over = []
+    for row in measure():
+        cap = args.max_plan_tokens if row["call"] == "plan" else args.max_optimize_tokens
+        row["cap"] = cap
+        if cap is not None and row["compact"]["total"] > cap:
+            over.append(row["call"])
+        print(json.dumps(row))
+    if over:
+        print(json.dumps({"error": "prompt over cap", "calls": over}))
+        sys.exit(1)
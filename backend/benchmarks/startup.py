@@ -0,0 +1,86 @@
+# benchmarks/startup.py
+"""
+Startup cost of the backend: how long a fresh worker takes to import the app, and
+how long warm_up() (Gemini client, crime index) adds on top. Each sample is a new
+interpreter, so nothing is cached between runs. Prints JSON lines.
+
+    python benchmarks/startup.py --runs 5
+    python benchmarks/startup.py --module asgi_app --top 15
+
+Also checks that the app imports without GEMINI_API_KEY (TTS-only workers, tooling).
+"""
+import os, sys, json, argparse, statistics, subprocess
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+_PROBE = """
+import time, json
+t = time.perf_counter()
+import {module}
+imported = time.perf_counter() - t
+warm = None
+if {warm}:
+    import event_planner
+    t = time.perf_counter()
+    steps = event_planner.warm_up()
+    warm = {{"total_s": round(time.perf_counter() - t, 3), **steps}}
+print(json.dumps({{"import_s": round(imported, 3), "warm_up": warm}}))
+"""
+
+
+def _run(code: str, env: dict, *args) -> subprocess.CompletedProcess:
+    return subprocess.run([sys.executable, *args, "-c", code], cwd=BACKEND_DIR, env=env,
+                          capture_output=True, text=True)
+
+
+def _env(with_key: bool) -> dict:
+    env = dict(os.environ, CACHE_DB_PATH="", PYTHONWARNINGS="ignore")
+    if with_key:
+        env.setdefault("GEMINI_API_KEY", "startup-bench")  # the client is built, never called
+    else:
+        env.pop("GEMINI_API_KEY", None)
+    return env
+
+
+def measure(module: str, runs: int, warm: bool) -> dict:
+    imports, warms = [], []
+    for _ in range(runs):
+        r = _run(_PROBE.format(module=module, warm=warm), _env(True))
+        if r.returncode:
+            return {"error": r.stderr.strip().splitlines()[-1:]}
+        out = json.loads(r.stdout.strip().splitlines()[-1])
+        imports.append(out["import_s"])
+        if out["warm_up"]:
+            warms.append(out["warm_up"])
+    result = {"import_p50_s": statistics.median(imports), "import_max_s": max(imports)}
+    if warms:
+        result["warm_up_p50_s"] = statistics.median(w["total_s"] for w in warms)
+        result["warm_up_steps"] = warms[-1]
+    return result
+
+
+def import_profile(module: str, top: int) -> list:
+    """Slowest modules by cumulative import time (python -X importtime)."""
+    r = _run(f"import {module}", _env(True), "-X", "importtime")
+    rows = []
+    for line in r.stderr.splitlines():
+        parts = line[len("import time:"):].split("|")
+        if not line.startswith("import time:") or len(parts) != 3 or not parts[1].strip().isdigit():
+            continue  # header row / interpreter noise
+        rows.append((int(parts[1]), parts[2].strip()))
+    return [{"module": n, "cumulative_ms": round(us / 1000, 1)} for us, n in sorted(rows, reverse=True)[:top]]
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--module", default="app", help="module a worker imports (app or asgi_app)")
+    ap.add_argument("--runs", type=int, default=5)
+    ap.add_argument("--top", type=int, default=10, help="slowest imports to list")
+    args = ap.parse_args()
+
+    no_key = _run(f"import {args.module}", _env(False))
+    print(json.dumps({"bench": "startup", "module": args.module, "runs": args.runs,
+                      **measure(args.module, args.runs, warm=True),
+                      "imports_without_gemini_key": no_key.returncode == 0}))
+    print(json.dumps({"bench": "import_profile", "module": args.module,
+                      "slowest": import_profile(args.module, args.top)}))
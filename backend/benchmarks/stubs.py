@@ -0,0 +1,281 @@
+# benchmarks/stubs.py
+"""
+Local stand-ins for every upstream the pipeline talks to, so benchmarks run offline.
+
+One threaded HTTP server answers the four upstream APIs with canned payloads:
+  GET  /data/2.5/forecast                    OpenWeatherMap 5-day/3-hour forecast
+  GET  /search                               Nominatim (coordinates hashed from the query)
+  GET  /resource/<dataset>.json              NYC Open Data SODA (count / top offenses)
+  POST /v1/text-to-speech/<voice>/stream     ElevenLabs (chunked fake MP3)
+Each upstream has its own latency, jitter and error rate (errors are 503s, so the
+retry / circuit-breaker path in upstream.py is exercised too).
+
+Gemini is replaced by StubLLM, which returns canned Itinerary / OptimizationResult
+objects after a configurable delay. Call stub_environment() before importing
+event_planner, app or asgi_app: those read their upstream URLs at import time.
+"""
+import os, json, time, random, asyncio, hashlib, tempfile, threading
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+UPSTREAM_NAMES = ("owm", "nominatim", "soda", "elevenlabs")
+
+
+@dataclass
+class StubProfile:
+    latency_s: float = 0.05
+    jitter_s: float = 0.0
+    error_rate: float = 0.0
+
+    def wait(self) -> bool:
+        """Sleep for one simulated round trip; False if this call should fail."""
+        time.sleep(max(0.0, self.latency_s + random.uniform(-self.jitter_s, self.jitter_s)))
+        return random.random() >= self.error_rate
+
+
+@dataclass
+class StubStats:
+    calls: dict = field(default_factory=lambda: {n: 0 for n in UPSTREAM_NAMES})
+    errors: dict = field(default_factory=lambda: {n: 0 for n in UPSTREAM_NAMES})
+    lock: threading.Lock = field(default_factory=threading.Lock)
+
+    def count(self, name: str, ok: bool) -> None:
+        with self.lock:
+            self.calls[name] += 1
+            self.errors[name] += 0 if ok else 1
+
+    def snapshot(self) -> dict:
+        with self.lock:
+            return {n: {"calls": self.calls[n], "errors": self.errors[n]} for n in UPSTREAM_NAMES}
+
+
+# ---- canned upstream payloads ----
+def _forecast_payload() -> dict:
+    """40 three-hour blocks from the current issue slot; every fourth block is rainy."""
+    start = int(time.time() // 10800) * 10800
+    blocks = []
+    for i in range(40):
+        rainy = i % 4 == 2
+        blocks.append({
+            "dt": start + i * 10800,
+            "main": {"temp": 14.0 + (i % 8), "humidity": 60 + (i % 5) * 5},
+            "weather": [{"description": "light rain" if rainy else "scattered clouds",
+                         "icon": "10d" if rainy else "03d"}],
+            "wind": {"speed": 3.5},
+        })
+    return {"list": blocks}
+
+
+def _geocode_payload(q: str) -> list:
+    """Stable coordinates inside Midtown Manhattan for any query."""
+    h = hashlib.sha1(q.encode()).digest()
+    return [{"lat": f"{40.74 + h[0] / 255 * 0.04:.6f}", "lon": f"{-74.00 + h[1] / 255 * 0.03:.6f}"}]
+
+
+def _soda_payload(params: dict) -> list:
+    where = (params.get("$where") or [""])[0]
+    n = 20 + int(hashlib.sha1(where.encode()).hexdigest()[:4], 16) % 200
+    if "$group" in params:
+        names = ["PETIT LARCENY", "HARASSMENT 2", "GRAND LARCENY", "ASSAULT 3 & RELATED OFFENSES",
+                 "CRIMINAL MISCHIEF & RELATED OF"]
+        limit = int((params.get("$limit") or ["5"])[0])
+        return [{"offense": name, "c": str(max(1, n // (i + 2)))} for i, name in enumerate(names[:limit])]
+    return [{"count_1": str(n)}]
+
+
+_FAKE_MP3_CHUNK = b"ID3\x04\x00\x00\x00\x00\x00\x00" + bytes(range(256)) * 16
+
+
+class _UpstreamStubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    profiles: dict = {}
+    stats: StubStats = None
+
+    def _route(self) -> str:
+        path = urlparse(self.path).path
+        if path.startswith("/data/2.5/forecast"):
+            return "owm"
+        if path.startswith("/search"):
+            return "nominatim"
+        if path.startswith("/resource/"):
+            return "soda"
+        if path.startswith("/v1/text-to-speech/"):
+            return "elevenlabs"
+        return ""
+
+    def _json(self, status: int, payload) -> None:
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _serve(self) -> None:
+        name = self._route()
+        if not name:
+            return self._json(404, {"error": "no stub for this path"})
+        ok = self.profiles[name].wait()
+        self.stats.count(name, ok)
+        if not ok:
+            return self._json(503, {"error": f"stub {name} failure"})
+
+        params = parse_qs(urlparse(self.path).query)
+        if name == "owm":
+            return self._json(200, _forecast_payload())
+        if name == "nominatim":
+            return self._json(200, _geocode_payload((params.get("q") or [""])[0]))
+        if name == "soda":
+            return self._json(200, _soda_payload(params))
+
+        # ElevenLabs: chunked audio, a few chunks per segment like the real stream
+        self.rfile.read(int(self.headers.get("Content-Length") or 0))
+        self.send_response(200)
+        self.send_header("Content-Type", "audio/mpeg")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        for _ in range(4):
+            self.wfile.write(f"{len(_FAKE_MP3_CHUNK):x}\r\n".encode() + _FAKE_MP3_CHUNK + b"\r\n")
+        self.wfile.write(b"0\r\n\r\n")
+
+    do_GET = _serve
+    do_POST = _serve
+
+    def log_message(self, *args):
+        pass
+
+
+def serve_upstreams(profiles: dict) -> tuple:
+    """Start the stub server; returns (base_url, StubStats)."""
+    stats = StubStats()
+    handler = type("UpstreamStub", (_UpstreamStubHandler,), {"profiles": profiles, "stats": stats})
+    server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return f"http://127.0.0.1:{server.server_port}", stats
+
+
+# ---- Gemini stand-in ----
+def canned_itinerary(n: int = 0, start: str = "Times Square, New York, NY 10036, USA"):
+    """Five-leg plan; n > 0 suffixes the places so each plan needs fresh overlay lookups."""
+    from event_planner import Itinerary, Leg
+    tag = f" #{n}" if n else ""
+    bryant, moma, park = (f"Bryant Park{tag}, New York, NY 10018", f"MoMA{tag}, 11 W 53rd St, New York, NY 10019",
+                          f"Central Park{tag}, New York, NY 10024")
+    legs = [
+        ("walk", "09:00", "09:15", start, bryant, 15, 0.0),
+        ("activity", "09:15", "10:15", bryant, bryant, 60, 0.0),
+        ("subway", "10:15", "10:35", bryant, moma, 20, 2.90),
+        ("activity", "10:35", "12:35", moma, moma, 120, 30.0),
+        ("walk", "12:35", "12:55", moma, park, 20, 0.0),
+    ]
+    return Itinerary(summary="Midtown highlights (stub plan)", assumptions=["Canned benchmark plan."], legs=[
+        Leg(sequence=i + 1, mode=mode, departTime=dep, arriveTime=arr, fromLocation=src, toLocation=dst,
+            estDurationMin=minutes, costEstimateUSD=cost, choiceReasoning="benchmark")
+        for i, (mode, dep, arr, src, dst, minutes, cost) in enumerate(legs)
+    ])
+
+
+class StubLLM:
+    """Chat-model stand-in: with_structured_output(schema) returns a runnable yielding canned objects."""
+
+    def __init__(self, delay_s: float = 1.0, jitter_s: float = 0.0, unique_places: bool = True, schema=None):
+        self.delay_s, self.jitter_s, self.unique_places, self.schema = delay_s, jitter_s, unique_places, schema
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def with_structured_output(self, schema):
+        return StubLLM(self.delay_s, self.jitter_s, self.unique_places, schema)
+
+    def _delay(self) -> float:
+        return max(0.0, self.delay_s + random.uniform(-self.jitter_s, self.jitter_s))
+
+    def _result(self):
+        from event_planner import OptimizationResult
+        with self._lock:
+            self.calls += 1
+            n = self.calls if self.unique_places else 0
+        plan = canned_itinerary(n)
+        if self.schema is OptimizationResult:
+            return OptimizationResult(summary="stub optimization", changes=[], optimized=plan,
+                                      assumptions=plan.assumptions)
+        return plan
+
+    def invoke(self, messages, config=None):
+        time.sleep(self._delay())
+        return self._result()
+
+    async def ainvoke(self, messages, config=None):
+        await asyncio.sleep(self._delay())
+        return self._result()
+
+    def batch_as_completed(self, inputs, config=None, *, return_exceptions=False):
+        """(index, result) as each call finishes, at most config["max_concurrency"] at once."""
+        from concurrent.futures import ThreadPoolExecutor, as_completed
+        workers = (config or {}).get("max_concurrency") or len(inputs) or 1
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            futures = {pool.submit(self.invoke, messages, config): i for i, messages in enumerate(inputs)}
+            for f in as_completed(futures):
+                yield futures[f], f.result()
+
+    async def abatch_as_completed(self, inputs, config=None, *, return_exceptions=False):
+        sem = asyncio.Semaphore((config or {}).get("max_concurrency") or len(inputs) or 1)
+
+        async def one(i, messages):
+            async with sem:
+                return i, await self.ainvoke(messages, config)
+        for coro in asyncio.as_completed([one(i, m) for i, m in enumerate(inputs)]):
+            yield await coro
+
+
+def stub_environment(*, llm_delay: float = 1.0, llm_jitter: float = 0.0, latency: float = 0.05,
+                     jitter: float = 0.0, error_rate: float = 0.0, overrides: dict = None,
+                     crime_source: str = "index", unique_places: bool = True) -> StubStats:
+    """
+    Point every upstream at the local stub server and swap Gemini for StubLLM.
+    overrides: {upstream name: StubProfile} for per-upstream latency / error rate.
+    crime_source: "index" (local fixture CSV) or "soda" (stub SODA queries).
+    Returns the stub server's per-upstream call counters.
+    """
+    profiles = {n: StubProfile(latency, jitter, error_rate) for n in UPSTREAM_NAMES}
+    profiles.update(overrides or {})
+    base, stats = serve_upstreams(profiles)
+    os.environ.update({
+        "GEMINI_API_KEY": os.getenv("GEMINI_API_KEY", "stub"),
+        "WEATHER_API_KEY": "stub",
+        "ELEVEN_LABS_API": "stub",
+        "CACHE_DB_PATH": "",
+        "PLAN_CACHE_TTL_S": "0",
+        "TTS_CACHE_DIR": tempfile.mkdtemp(prefix="tts-bench-"),
+        "OWM_BASE_URL": base,
+        "NOMINATIM_BASE_URL": base,
+        "NYC_CRIME_BASE": f"{base}/resource",
+        "ELEVENLABS_BASE_URL": base,
+        "NOMINATIM_RATE_PER_S": "1000000",  # the stub has no usage policy
+        "NOMINATIM_MAX_CONCURRENCY": "32",
+        "CRIME_INDEX_PATH": os.path.join(BACKEND_DIR, "data", "crime_fixture.csv") if crime_source == "index" else "",
+    })
+    import event_planner
+
+    stub = StubLLM(llm_delay, llm_jitter, unique_places)
+    event_planner.llm = stub
+    event_planner.structured_llm = stub.with_structured_output(event_planner.Itinerary)
+    return stats
+
+
+def bench_trip(start_location: str = "Times Square, New York, NY 10036, USA") -> dict:
+    """A trip starting 09:00 tomorrow, inside the stub forecast window."""
+    day = (datetime.now() + timedelta(days=1)).strftime("%Y-%m-%d")
+    return {
+        "startLocation": start_location,
+        "endLocation": "",
+        "transportMode": ["subways", "walk"],
+        "startTime": f"{day}T09:00",
+        "tripDuration": "6",
+        "wheelchairAccessible": "false",
+        "activityPreferences": "Sightseeing, Museums, Parks",
+        "budgetPreferences": "100",
+    }
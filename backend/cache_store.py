@@ -0,0 +1,255 @@
+# cache_store.py
+"""
+Two-tier key/value cache with per-entry TTLs.
+
+- Memory tier: bounded LRU (OrderedDict), per process.
+- Persistent tier (optional): one SQLite file shared by every process that points
+  at it, so entries survive restarts and are visible to all workers.
+
+Values must be JSON-serializable. Each cache has its own namespace inside the file.
+
+SingleFlight sits next to a cache: concurrent misses for the same key wait on one
+in-progress fetch instead of each calling the upstream.
+"""
+import os, json, time, asyncio, sqlite3, weakref, threading
+from collections import OrderedDict
+from concurrent.futures import Future
+from typing import Any, Awaitable, Callable, Optional, Tuple
+
+import metrics
+
+# Shared SQLite file for all persistent caches; set CACHE_DB_PATH="" to keep caches in memory only.
+CACHE_DB_PATH = os.getenv("CACHE_DB_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "cache.sqlite3"))
+
+MISS = object()  # sentinel: distinguishes "not cached" from a cached None
+
+# Live caches / flights, for the /metrics collectors below
+_CACHES: "weakref.WeakSet[TTLCache]" = weakref.WeakSet()
+_FLIGHTS: "weakref.WeakSet[SingleFlight]" = weakref.WeakSet()
+
+
+class _SqliteTier:
+    """Thin wrapper over one SQLite connection (WAL so several workers can share it)."""
+
+    def __init__(self, path: str):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=5)
+        self._lock = threading.Lock()
+        with self._lock:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS kv ("
+                " ns TEXT NOT NULL, k TEXT NOT NULL, v TEXT NOT NULL, expires_at REAL NOT NULL,"
+                " PRIMARY KEY (ns, k))"
+            )
+            self._conn.commit()
+
+    def get(self, ns: str, key: str) -> Optional[Tuple[Any, float]]:
+        with self._lock:
+            row = self._conn.execute("SELECT v, expires_at FROM kv WHERE ns=? AND k=?", (ns, key)).fetchone()
+        if row is None:
+            return None
+        return json.loads(row[0]), row[1]
+
+    def set(self, ns: str, key: str, value: Any, expires_at: float) -> None:
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO kv (ns, k, v, expires_at) VALUES (?, ?, ?, ?)",
+                (ns, key, json.dumps(value), expires_at),
+            )
+            self._conn.commit()
+
+    def delete(self, ns: str, key: str) -> None:
+        with self._lock:
+            self._conn.execute("DELETE FROM kv WHERE ns=? AND k=?", (ns, key))
+            self._conn.commit()
+
+    def purge_expired(self, ns: str, before: float) -> int:
+        with self._lock:
+            cur = self._conn.execute("DELETE FROM kv WHERE ns=? AND expires_at < ?", (ns, before))
+            self._conn.commit()
+            return cur.rowcount
+
+
+_TIERS: dict = {}
+_TIERS_LOCK = threading.Lock()
+
+def _sqlite_tier(path: Optional[str]) -> Optional[_SqliteTier]:
+    """One connection per file per process."""
+    if not path:
+        return None
+    with _TIERS_LOCK:
+        if path not in _TIERS:
+            try:
+                _TIERS[path] = _SqliteTier(path)
+            except sqlite3.Error as e:
+                print(f"Persistent cache disabled ({path}: {e}).")
+                _TIERS[path] = None
+        return _TIERS[path]
+
+
+class TTLCache:
+    """
+    LRU memory tier in front of an optional SQLite tier.
+    Every entry carries its own expiry, so positive and negative results can use different TTLs.
+    """
+
+    def __init__(self, namespace: str, *, max_items: int = 1024, db_path: Optional[str] = CACHE_DB_PATH):
+        self.namespace = namespace
+        self.max_items = max_items
+        self._mem: "OrderedDict[str, Tuple[Any, float]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._disk = _sqlite_tier(db_path)
+        self.hits = 0
+        self.misses = 0
+        _CACHES.add(self)
+
+    def _remember(self, key: str, value: Any, expires_at: float) -> None:
+        with self._lock:
+            self._mem[key] = (value, expires_at)
+            self._mem.move_to_end(key)
+            while len(self._mem) > self.max_items:
+                self._mem.popitem(last=False)
+
+    def get_entry(self, key: str) -> Optional[Tuple[Any, float]]:
+        """(value, expires_at) even if expired, or None if the key is unknown."""
+        with self._lock:
+            entry = self._mem.get(key)
+            if entry is not None:
+                self._mem.move_to_end(key)
+                return entry
+        if self._disk is not None:
+            try:
+                entry = self._disk.get(self.namespace, key)
+            except sqlite3.Error:
+                entry = None
+            if entry is not None:
+                self._remember(key, *entry)
+                return entry
+        return None
+
+    def get(self, key: str, default: Any = MISS) -> Any:
+        """Fresh value for key, or `default` (MISS) if absent or expired."""
+        entry = self.get_entry(key)
+        if entry is None or entry[1] < time.time():
+            self.misses += 1
+            metrics.trace_count(f"cache.{self.namespace}.miss")
+            return default
+        self.hits += 1
+        metrics.trace_count(f"cache.{self.namespace}.hit")
+        return entry[0]
+
+    def set(self, key: str, value: Any, ttl_s: float) -> None:
+        expires_at = time.time() + ttl_s
+        self._remember(key, value, expires_at)
+        if self._disk is not None:
+            try:
+                self._disk.set(self.namespace, key, value, expires_at)
+            except sqlite3.Error:
+                pass  # memory tier still has it
+
+    def delete(self, key: str) -> None:
+        with self._lock:
+            self._mem.pop(key, None)
+        if self._disk is not None:
+            try:
+                self._disk.delete(self.namespace, key)
+            except sqlite3.Error:
+                pass
+
+    def purge_expired(self) -> int:
+        now = time.time()
+        with self._lock:
+            for k in [k for k, (_, exp) in self._mem.items() if exp < now]:
+                del self._mem[k]
+        if self._disk is not None:
+            try:
+                return self._disk.purge_expired(self.namespace, now)
+            except sqlite3.Error:
+                return 0
+        return 0
+
+    def __len__(self) -> int:
+        return len(self._mem)
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent calls per key: the first caller (leader) runs the fetch and
+    everyone who asks for the same key meanwhile gets its result (or its exception).
+    Nothing is retained once the call finishes; the leader is expected to have
+    written its cache by then, so later callers hit the cache instead.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self._calls: "dict[str, Future]" = {}
+        self._lock = threading.Lock()
+        self.leaders = 0
+        self.shared = 0
+        _FLIGHTS.add(self)
+
+    def _join(self, key: str) -> Tuple[Future, bool]:
+        with self._lock:
+            fut = self._calls.get(key)
+            if fut is not None:
+                self.shared += 1
+                metrics.trace_count(f"singleflight.{self.name}.shared")
+                return fut, False
+            fut = self._calls[key] = Future()
+            self.leaders += 1
+            return fut, True
+
+    def _finish(self, key: str) -> None:
+        with self._lock:
+            self._calls.pop(key, None)
+
+    def do(self, key: str, fn: Callable[[], Any]) -> Any:
+        fut, leader = self._join(key)
+        if not leader:
+            return fut.result()
+        try:
+            fut.set_result(fn())
+        except BaseException as e:
+            fut.set_exception(e)
+        finally:
+            self._finish(key)
+        return fut.result()
+
+    async def ado(self, key: str, fn: Callable[[], Awaitable[Any]]) -> Any:
+        """`do` for coroutines; shares the same in-flight table, so sync and async callers coalesce too."""
+        fut, leader = self._join(key)
+        if not leader:
+            return await asyncio.wrap_future(fut)
+        try:
+            fut.set_result(await fn())
+        except BaseException as e:
+            fut.set_exception(e)
+        finally:
+            self._finish(key)
+        return fut.result()
+
+    def stats(self) -> dict:
+        return {"leaders": self.leaders, "shared": self.shared}
+
+
+def cache_stats() -> dict:
+    """Per-namespace hits / misses / hit ratio / memory-tier size (this process)."""
+    stats: dict = {}
+    for cache in list(_CACHES):
+        s = stats.setdefault(cache.namespace, {"hits": 0, "misses": 0, "items": 0})
+        s["hits"] += cache.hits
+        s["misses"] += cache.misses
+        s["items"] += len(cache)
+    for s in stats.values():
+        total = s["hits"] + s["misses"]
+        s["hit_ratio"] = round(s["hits"] / total, 4) if total else None
+    return stats
+
+
+def flight_stats() -> dict:
+    return {f.name: f.stats() for f in list(_FLIGHTS)}
+
+
+metrics.register_collector("cache", cache_stats)
+metrics.register_collector("singleflight", flight_stats)
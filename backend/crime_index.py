@@ -0,0 +1,293 @@
+# crime_index.py
+"""
+Local, offline copy of NYPD Complaint Data (NYC Open Data 5uac-w243).
+
+Ingest writes one compressed NumPy partition per month:
+    <out_dir>/YYYY-MM.npz   (lat, lon, day, offense codes, offense names)
+
+CrimeIndex loads the partitions (or a CSV such as data/crime_fixture.csv) into
+flat arrays sorted by grid cell. `aggregate` takes a batch of points and the full
+(lookback x radius) grid and computes every count and the top offenses in one
+vectorized pass, touching only the grid cells around each point.
+
+Usage:
+    python crime_index.py ingest --since 2024-10-01 --until 2025-10-01 --out data/crime
+    python crime_index.py ingest --csv data/crime_fixture.csv --out data/crime
+"""
+import os, csv, json, math, argparse
+from typing import Optional, List, Tuple, Sequence
+from datetime import datetime, date, timedelta
+
+import numpy as np
+
+from upstream import SODA  # base URL: NYC_CRIME_BASE, token: NYC_APP_TOKEN
+
+NYC_CRIME_DATASET = "5uac-w243"
+
+CELL_DEG   = 0.005      # ~550 m of latitude per grid cell
+_EPOCH     = date(1970, 1, 1)
+_PAGE_SIZE = 50000
+
+
+def _day_number(d) -> int:
+    """Days since 1970-01-01 for a date/datetime."""
+    if isinstance(d, datetime):
+        d = d.date()
+    return (d - _EPOCH).days
+
+def _deg_bbox(lat: float, lon: float, radius_m: int) -> Tuple[float, float, float, float]:
+    """Same bbox approximation the SODA where-clause uses, so counts match."""
+    dlat = radius_m / 111320.0
+    dlon = radius_m / (111320.0 * max(0.1, math.cos(math.radians(lat))))
+    return (lat - dlat, lat + dlat, lon - dlon, lon + dlon)
+
+
+class CrimeIndex:
+    """Columnar complaint records with a uniform lat/lon grid index."""
+
+    def __init__(self, lat, lon, day, offense, offense_names: List[str], cell_deg: float = CELL_DEG):
+        lat = np.asarray(lat, dtype=np.float64)
+        lon = np.asarray(lon, dtype=np.float64)
+        self.cell_deg = cell_deg
+        self.offense_names = list(offense_names)
+
+        if len(lat):
+            self.lat0, self.lon0 = float(lat.min()), float(lon.min())
+            iy = ((lat - self.lat0) / cell_deg).astype(np.int64)
+            ix = ((lon - self.lon0) / cell_deg).astype(np.int64)
+            self.ny, self.nx = int(iy.max()) + 1, int(ix.max()) + 1
+        else:
+            self.lat0 = self.lon0 = 0.0
+            iy = ix = np.zeros(0, dtype=np.int64)
+            self.ny = self.nx = 0
+
+        # Row-major cell ids; sorting makes each grid row a set of contiguous slices.
+        cell = iy * self.nx + ix
+        order = np.argsort(cell, kind="stable")
+        self.cell    = cell[order]
+        self.lat     = lat[order]
+        self.lon     = lon[order]
+        self.day     = np.asarray(day, dtype=np.int32)[order]
+        self.offense = np.asarray(offense, dtype=np.int32)[order]
+
+    def __len__(self) -> int:
+        return len(self.lat)
+
+    @property
+    def date_range(self) -> Optional[Tuple[date, date]]:
+        if not len(self):
+            return None
+        return (_EPOCH + timedelta(days=int(self.day.min())),
+                _EPOCH + timedelta(days=int(self.day.max())))
+
+    # ---- loading ----
+    @classmethod
+    def load(cls, path: str) -> "CrimeIndex":
+        """Load a partition directory written by `ingest`, a single .npz, or a CSV."""
+        if os.path.isdir(path):
+            files = sorted(os.path.join(path, f) for f in os.listdir(path) if f.endswith(".npz"))
+            parts = [_read_npz(f) for f in files]
+        elif path.endswith(".npz"):
+            parts = [_read_npz(path)]
+        else:
+            parts = [_read_csv(path)]
+        return cls(*_merge_parts(parts))
+
+    # ---- queries ----
+    def _candidates(self, lat: float, lon: float, radius_m: int) -> np.ndarray:
+        """Row indices in the grid cells overlapping the radius bbox."""
+        if not len(self):
+            return np.zeros(0, dtype=np.int64)
+        min_lat, max_lat, min_lon, max_lon = _deg_bbox(lat, lon, radius_m)
+        y0 = max(0, int(math.floor((min_lat - self.lat0) / self.cell_deg)))
+        y1 = min(self.ny - 1, int(math.floor((max_lat - self.lat0) / self.cell_deg)))
+        x0 = max(0, int(math.floor((min_lon - self.lon0) / self.cell_deg)))
+        x1 = min(self.nx - 1, int(math.floor((max_lon - self.lon0) / self.cell_deg)))
+        if y0 > y1 or x0 > x1:
+            return np.zeros(0, dtype=np.int64)
+        ys = np.arange(y0, y1 + 1, dtype=np.int64)
+        lo = np.searchsorted(self.cell, ys * self.nx + x0, side="left")
+        hi = np.searchsorted(self.cell, ys * self.nx + x1, side="right")
+        return np.concatenate([np.arange(a, b) for a, b in zip(lo, hi)])
+
+    def aggregate(
+        self,
+        lats: Sequence[float], lons: Sequence[float],
+        windows,
+        radius_seq: Sequence[int],
+        *,
+        metric: str = "bbox",
+        limit: int = 5,
+    ) -> Tuple[np.ndarray, np.ndarray, List[List[dict]]]:
+        """
+        Count complaints for every point x window x radius in one vectorized pass.
+
+        windows: [W, 2] (start, end) dates shared by all points, or [P, W, 2] per point.
+        metric:  "bbox" matches the SODA where-clause; "haversine" uses true circles.
+
+        Returns (counts[P, W, R], first[P], top_offenses[P]) where first is the flat
+        index w * R + r of the first non-empty cell in widening order (-1 if none) and
+        top_offenses are computed for that cell.
+        """
+        lats = np.asarray(lats, dtype=np.float64)
+        lons = np.asarray(lons, dtype=np.float64)
+        P, R = len(lats), len(radius_seq)
+        if not P:
+            return np.zeros((0, 0, R), dtype=np.int64), np.zeros(0, dtype=np.int64), []
+        win = _window_days(windows, P)
+        W = win.shape[1]
+
+        # Candidate rows per point, flattened into (point, row) pairs sorted by point.
+        parts = [self._candidates(lats[p], lons[p], max(radius_seq)) for p in range(P)]
+        seg = np.zeros(P + 1, dtype=np.int64)
+        seg[1:] = np.cumsum([len(x) for x in parts])
+        rows = np.concatenate(parts)
+        pid = np.repeat(np.arange(P), np.diff(seg))
+
+        plat, plon = lats[pid], lons[pid]
+        clat, clon, cday = self.lat[rows], self.lon[rows], self.day[rows]
+        radii = np.asarray(radius_seq, dtype=np.float64)[:, None]
+        if metric == "haversine":
+            in_radius = _haversine_m(plat, plon, clat, clon)[None, :] <= radii
+        else:
+            dlat = radii / 111320.0
+            dlon = radii / (111320.0 * np.maximum(0.1, np.cos(np.radians(plat))))[None, :]
+            in_radius = (np.abs(clat - plat) <= dlat) & (np.abs(clon - plon) <= dlon)
+        in_window = (cday >= win[pid, :, 0].T) & (cday <= win[pid, :, 1].T)
+
+        hit = in_window[:, None, :] & in_radius[None, :, :]            # [W, R, N]
+        csum = np.zeros((W, R, len(rows) + 1), dtype=np.int64)
+        np.cumsum(hit, axis=-1, out=csum[:, :, 1:])
+        counts = (csum[:, :, seg[1:]] - csum[:, :, seg[:-1]]).transpose(2, 0, 1)
+
+        flat = counts.reshape(P, W * R) > 0
+        first = np.where(flat.any(axis=1), flat.argmax(axis=1), -1)
+
+        # Top offenses for each point's chosen cell: one bincount over (point, offense).
+        sel = first[pid]
+        chosen = np.zeros(len(rows), dtype=bool)
+        ok = np.nonzero(sel >= 0)[0]
+        chosen[ok] = hit.reshape(W * R, -1)[sel[ok], ok]
+        K = max(1, len(self.offense_names))
+        tally = np.bincount(pid[chosen] * K + self.offense[rows[chosen]], minlength=P * K).reshape(P, K)
+        order = np.argsort(-tally, axis=1, kind="stable")[:, :limit]
+        tops = [[{"offense": self.offense_names[k], "count": int(tally[p, k])}
+                 for k in order[p] if tally[p, k] > 0] for p in range(P)]
+        return counts, first, tops
+
+
+def _window_days(windows, n_points: int) -> np.ndarray:
+    """Normalize (start, end) date pairs to an int day array of shape [P, W, 2]."""
+    def days(w):
+        return [[_day_number(s), _day_number(e)] for s, e in w]
+    if windows and isinstance(windows[0][0], (date, datetime)):
+        arr = np.array(days(windows), dtype=np.int64)
+        return np.broadcast_to(arr, (n_points,) + arr.shape)
+    return np.array([days(w) for w in windows], dtype=np.int64).reshape(n_points, -1, 2)
+
+def _haversine_m(lat1, lon1, lat2, lon2) -> np.ndarray:
+    lat1, lon1, lat2, lon2 = map(np.radians, (lat1, lon1, lat2, lon2))
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * 6371000.0 * np.arcsin(np.sqrt(a))
+
+
+# ---- partition IO ----
+def _read_npz(path: str) -> tuple:
+    with np.load(path, allow_pickle=False) as z:
+        return (z["lat"], z["lon"], z["day"], z["offense"], [str(n) for n in z["offense_names"]])
+
+def _parse_row(date_s: str, lat_s, lon_s, offense: Optional[str]):
+    """SODA rows look like {'cmplnt_fr_dt': '2024-06-30T00:00:00.000', 'latitude': '40.7', ...}."""
+    try:
+        d = datetime.strptime(str(date_s)[:10], "%Y-%m-%d").date()
+        return _day_number(d), float(lat_s), float(lon_s), (offense or "Unknown").strip() or "Unknown"
+    except (TypeError, ValueError):
+        return None
+
+def _columns(rows) -> tuple:
+    names: dict = {}
+    lat, lon, day, off = [], [], [], []
+    for d, la, lo, o in rows:
+        day.append(d); lat.append(la); lon.append(lo)
+        off.append(names.setdefault(o, len(names)))
+    return (np.array(lat, dtype=np.float64), np.array(lon, dtype=np.float64),
+            np.array(day, dtype=np.int32), np.array(off, dtype=np.int32), list(names))
+
+def _read_csv(path: str) -> tuple:
+    with open(path, newline="") as f:
+        rows = [_parse_row(r.get("cmplnt_fr_dt"), r.get("latitude"), r.get("longitude"), r.get("ofns_desc"))
+                for r in csv.DictReader(f)]
+    return _columns(r for r in rows if r)
+
+def _merge_parts(parts: List[tuple]) -> tuple:
+    """Concatenate partitions, remapping per-partition offense codes to one vocabulary."""
+    vocab: dict = {}
+    lat, lon, day, off = [], [], [], []
+    for p_lat, p_lon, p_day, p_off, p_names in parts:
+        remap = np.array([vocab.setdefault(n, len(vocab)) for n in p_names], dtype=np.int32)
+        lat.append(p_lat); lon.append(p_lon); day.append(p_day)
+        off.append(remap[p_off] if len(p_off) else p_off.astype(np.int32))
+    if not parts:
+        empty = np.zeros(0)
+        return empty, empty, empty.astype(np.int32), empty.astype(np.int32), []
+    return np.concatenate(lat), np.concatenate(lon), np.concatenate(day), np.concatenate(off), list(vocab)
+
+def write_partitions(columns: tuple, out_dir: str) -> List[str]:
+    """Split columns by month and write one YYYY-MM.npz per partition."""
+    lat, lon, day, off, names = columns
+    os.makedirs(out_dir, exist_ok=True)
+    months = np.array([(_EPOCH + timedelta(days=int(d))).strftime("%Y-%m") for d in day])
+    written = []
+    for month in sorted(set(months.tolist())):
+        m = months == month
+        path = os.path.join(out_dir, f"{month}.npz")
+        np.savez_compressed(path, lat=lat[m], lon=lon[m], day=day[m], offense=off[m],
+                            offense_names=np.array(names))
+        written.append(path)
+    return written
+
+
+# ---- ingest ----
+def _fetch_soda(since: date, until: date, timeout=60):
+    """Page through the complaint dataset for rows with coordinates in [since, until]."""
+    where = (f"cmplnt_fr_dt BETWEEN '{since:%Y-%m-%d}' AND '{until:%Y-%m-%d}' "
+             f"AND latitude IS NOT NULL AND longitude IS NOT NULL")
+    offset = 0
+    while True:
+        r = SODA.get(
+            f"{NYC_CRIME_DATASET}.json",
+            params={"$select": "cmplnt_fr_dt,latitude,longitude,ofns_desc",
+                    "$where": where, "$order": ":id",
+                    "$limit": _PAGE_SIZE, "$offset": offset},
+            timeout=(3.05, timeout),
+        )
+        r.raise_for_status()
+        page = r.json() or []
+        for row in page:
+            parsed = _parse_row(row.get("cmplnt_fr_dt"), row.get("latitude"), row.get("longitude"), row.get("ofns_desc"))
+            if parsed:
+                yield parsed
+        if len(page) < _PAGE_SIZE:
+            break
+        offset += _PAGE_SIZE
+
+def ingest(out_dir: str, since: Optional[date] = None, until: Optional[date] = None,
+           csv_path: Optional[str] = None) -> List[str]:
+    columns = _read_csv(csv_path) if csv_path else _columns(_fetch_soda(since, until))
+    return write_partitions(columns, out_dir)
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description="Build the local NYPD complaint index.")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    ing = sub.add_parser("ingest", help="Download (or read a CSV) and write monthly partitions")
+    ing.add_argument("--out", default="data/crime")
+    ing.add_argument("--since", type=date.fromisoformat, default=date.today() - timedelta(days=400))
+    ing.add_argument("--until", type=date.fromisoformat, default=date.today())
+    ing.add_argument("--csv", help="Ingest a local CSV export instead of calling SODA")
+    args = ap.parse_args()
+
+    files = ingest(args.out, since=args.since, until=args.until, csv_path=args.csv)
+    idx = CrimeIndex.load(args.out)
+    print(json.dumps({"partitions": len(files), "rows": len(idx),
+                      "date_range": [str(d) for d in (idx.date_range or ())]}))
@@ -1,14 +1,22 @@
-import os, json
-from typing import List, Optional, Literal
+import os, re, json, math, time, bisect, asyncio, hashlib, threading
+from collections import OrderedDict
+from concurrent.futures import (Future, ThreadPoolExecutor, wait, as_completed, FIRST_COMPLETED,
+                                TimeoutError as FuturesTimeout)
+from typing import List, Optional, Literal, Tuple
 from datetime import datetime, timedelta
+from zoneinfo import ZoneInfo
+from dateutil import parser as _dtparse
 from pydantic import BaseModel, Field, field_validator, model_validator
 from dotenv import load_dotenv; load_dotenv()
+from cache_store import TTLCache, MISS, SingleFlight
+from upstream import OWM, NOMINATIM, SODA
+import metrics
+import prompt_codec
+from prompt_codec import PROMPT_ENCODING
 
 # Load NOMINATIM_UA from .env (or use default if not set)
 NOMINATIM_UA = os.getenv("NOMINATIM_UA", "trip-buddy/0.1 (contact: nair.gauthamvm@gmail.com)")
 
-from langchain_google_genai import ChatGoogleGenerativeAI
-
 #Input schema validation
 class TripRequest(BaseModel):
     startLocation: str
@@ -76,12 +84,67 @@ class Itinerary(BaseModel):
     legs: List[Leg]
 
 # Gemini LLM setup
-api_key = os.environ.get("GEMINI_API_KEY")
-if not api_key:
-    raise RuntimeError("GOOGLE_API_KEY not FOUND.")
-
-llm = ChatGoogleGenerativeAI(model="gemini-2.5-flash", google_api_key=api_key)
-structured_llm = llm.with_structured_output(Itinerary)
+# The client and its structured wrappers are built on first use (once per process),
+# so importing this module needs neither GEMINI_API_KEY nor langchain_google_genai;
+# TTS-only workers and tooling never pay for them. warm_up() builds them up front.
+
+llm = None               # ChatGoogleGenerativeAI
+structured_llm = None    # llm.with_structured_output(Itinerary)
+opt_llm_struct = None    # llm.with_structured_output(OptimizationResult)
+_LLM_CONFIG = None       # invoke config: token-usage callback when metrics are on
+_LLM_LOCK = threading.Lock()
+
+def _token_usage_handler():
+    from langchain_core.callbacks import BaseCallbackHandler
+
+    class _TokenUsage(BaseCallbackHandler):
+        """Adds each Gemini reply's usage_metadata to the llm token counters (and the request trace)."""
+        run_inline = True
+
+        def on_llm_end(self, response, **kwargs):
+            for generations in response.generations:
+                for g in generations:
+                    usage = getattr(getattr(g, "message", None), "usage_metadata", None) or {}
+                    metrics.count("llm.input_tokens", usage.get("input_tokens", 0))
+                    metrics.count("llm.output_tokens", usage.get("output_tokens", 0))
+
+    return _TokenUsage()
+
+def _llm_clients() -> tuple:
+    """(structured_llm, opt_llm_struct, invoke config), built once; raises if GEMINI_API_KEY is missing."""
+    global llm, structured_llm, opt_llm_struct, _LLM_CONFIG
+    if structured_llm is None or opt_llm_struct is None:
+        with _LLM_LOCK:
+            if llm is None:
+                api_key = os.environ.get("GEMINI_API_KEY")
+                if not api_key:
+                    raise RuntimeError("GEMINI_API_KEY not found.")
+                from langchain_google_genai import ChatGoogleGenerativeAI
+                llm = ChatGoogleGenerativeAI(model="gemini-2.5-flash", google_api_key=api_key)
+            if structured_llm is None:
+                structured_llm = llm.with_structured_output(Itinerary)
+            if opt_llm_struct is None:
+                opt_llm_struct = llm.with_structured_output(OptimizationResult)
+            if _LLM_CONFIG is None and metrics.METRICS_ENABLED:
+                _LLM_CONFIG = {"callbacks": [_token_usage_handler()]}
+    return structured_llm, opt_llm_struct, _LLM_CONFIG
+
+def warm_up() -> dict:
+    """
+    Build everything that is otherwise created on first request: Gemini clients,
+    the local crime index. Call once per worker *after* fork (gunicorn post_fork,
+    ASGI before_serving); gRPC-backed clients must not be shared across a fork.
+    Returns seconds spent per step (llm is None when GEMINI_API_KEY is unset).
+    """
+    timings = {"llm": None}
+    if structured_llm is not None or os.environ.get("GEMINI_API_KEY"):  # TTS-only workers have no key
+        t = time.perf_counter()
+        _llm_clients()
+        timings["llm"] = round(time.perf_counter() - t, 3)
+    t = time.perf_counter()
+    _get_crime_index()
+    timings["crime_index"] = round(time.perf_counter() - t, 3)
+    return timings
 
 # Planner function
 SYSTEM_INSTRUCTIONS = f"""You are a precise urban travel planner. Given a set of preferences, start and end location, your task is to suggest exact addresses and names of nearby attractions, or places to visit. Consider travel timings between attractions.
@@ -99,12 +162,166 @@ Constraints:
 Output must VALIDATE against the provided JSON schema.
 """
 
-def plan_trip(request_json: str) -> Itinerary:
+# ===== Plan cache =====
+# Keyed on the normalized TripRequest: canonical locations, start time rounded to
+# PLAN_TIME_BUCKET_MIN, sorted modes and folded preferences. With PLAN_CACHE_NEAR on,
+# a request that differs only by date/start time (within the same PLAN_NEAR_BAND_H
+# band of the day) reuses a cached plan with its leg times shifted.
+
+PLAN_CACHE_TTL_S     = float(os.getenv("PLAN_CACHE_TTL_S", str(6 * 3600)))
+PLAN_TIME_BUCKET_MIN = int(os.getenv("PLAN_TIME_BUCKET_MIN", "30"))
+PLAN_CACHE_NEAR      = os.getenv("PLAN_CACHE_NEAR", "false").lower() in ("1", "true", "yes")
+PLAN_NEAR_BAND_H     = int(os.getenv("PLAN_NEAR_BAND_H", "2"))
+
+_PLAN_CACHE = TTLCache("plan", max_items=int(os.getenv("PLAN_CACHE_SIZE", "512")))
+_PLAN_STATS = {"exact_hits": 0, "near_hits": 0, "misses": 0}
+_PLAN_STATS_LOCK = threading.Lock()
+# Identical concurrent plan requests (same exact cache key) share one Gemini call
+_PLAN_FLIGHT = SingleFlight("plan")
+
+def _fold(text: Optional[str]) -> str:
+    return " ".join((text or "").lower().replace(",", " , ").split())
+
+def _plan_cache_key(trip: TripRequest, near: bool = False) -> str:
+    hours = round((getattr(trip, "endTime") - trip.startTime).total_seconds() / 3600)
+    if near:
+        when = f"band{trip.startTime.hour // PLAN_NEAR_BAND_H}"
+    else:
+        bucket = trip.startTime.replace(second=0, microsecond=0)
+        bucket -= timedelta(minutes=bucket.minute % PLAN_TIME_BUCKET_MIN)
+        when = bucket.isoformat()
+    canon = {
+        "start": _normalize_address(trip.startLocation),
+        "end": _normalize_address(trip.endLocation or ""),
+        "modes": sorted(set(trip.transportMode)),
+        "when": when,
+        "hours": hours,
+        "wheelchair": trip.wheelchairAccessible,
+        "prefs": [_fold(trip.cuisines), _fold(trip.dietPreferences),
+                  _fold(trip.activityPreferences), _fold(trip.budgetPreferences)],
+    }
+    digest = hashlib.sha256(json.dumps(canon, sort_keys=True).encode()).hexdigest()
+    return ("near:" if near else "exact:") + digest
+
+def _shift_time_str(value: Optional[str], base: datetime, delta: timedelta) -> Optional[str]:
+    """Shift a leg time, keeping its style ("HH:MM" stays short, ISO stays ISO)."""
+    dt = _coerce_dt(value, base)
+    if dt is None:
+        return value
+    shifted = dt + delta
+    return shifted.strftime("%H:%M") if len(value.strip()) <= 8 else shifted.isoformat()
+
+def _shift_itinerary(itin: Itinerary, cached_start: datetime, new_start: datetime) -> Itinerary:
+    delta = new_start - cached_start
+    if not delta:
+        return itin
+    legs = [
+        leg.model_copy(update={
+            "departTime": _shift_time_str(leg.departTime, cached_start, delta),
+            "arriveTime": _shift_time_str(leg.arriveTime, cached_start, delta),
+        })
+        for leg in itin.legs
+    ]
+    note = f"Reused a cached plan shifted by {int(delta.total_seconds() // 60)} min; verify opening hours."
+    return itin.model_copy(update={"legs": legs, "assumptions": list(itin.assumptions) + [note]})
+
+def _count_plan(stat: str) -> None:
+    with _PLAN_STATS_LOCK:
+        _PLAN_STATS[stat] += 1
+
+def plan_cache_stats() -> dict:
+    """Hit/miss counters for the plan cache (this process)."""
+    with _PLAN_STATS_LOCK:
+        stats = dict(_PLAN_STATS)
+    total = sum(stats.values())
+    stats["hit_ratio"] = round((stats["exact_hits"] + stats["near_hits"]) / total, 4) if total else None
+    return stats
+
+metrics.register_collector("plan_cache", plan_cache_stats)
+
+def _cached_plan(trip: TripRequest) -> Optional[Itinerary]:
+    """Exact (then near, if enabled) plan cache lookup, re-timed to the request."""
+    cached = _PLAN_CACHE.get(_plan_cache_key(trip))
+    if cached is not MISS:
+        _count_plan("exact_hits")
+    elif PLAN_CACHE_NEAR:
+        cached = _PLAN_CACHE.get(_plan_cache_key(trip, near=True))
+        if cached is not MISS:
+            _count_plan("near_hits")
+    if cached is MISS:
+        _count_plan("misses")
+        return None
+    return _shift_itinerary(Itinerary(**cached["plan"]),
+                            datetime.fromisoformat(cached["startTime"]), trip.startTime)
+
+def _store_plan(trip: TripRequest, itinerary: Itinerary) -> None:
+    entry = {"startTime": trip.startTime.isoformat(), "plan": itinerary.model_dump(mode="json")}
+    _PLAN_CACHE.set(_plan_cache_key(trip), entry, PLAN_CACHE_TTL_S)
+    if PLAN_CACHE_NEAR:
+        _PLAN_CACHE.set(_plan_cache_key(trip, near=True), entry, PLAN_CACHE_TTL_S)
+
+@metrics.timed("plan_trip")
+def plan_trip(request_json: str, *, use_cache: bool = True) -> Itinerary:
     # 1) Validate input
     data = json.loads(request_json)
     trip = TripRequest(**data)
 
+    if not use_cache:
+        return _invoke_planner(trip)
+    cached = _cached_plan(trip)
+    if cached is not None:
+        return cached
+
+    def fetch():
+        itinerary = _invoke_planner(trip)
+        _store_plan(trip, itinerary)
+        return itinerary.model_dump(mode="json"), trip.startTime.isoformat()
+    return _shared_plan(trip, _PLAN_FLIGHT.do(_plan_cache_key(trip), fetch))
+
+def _shared_plan(trip: TripRequest, shared: tuple) -> Itinerary:
+    """Leader's plan for a coalesced call; followers in the same time bucket get it re-timed."""
+    plan, start = shared
+    return _shift_itinerary(Itinerary(**plan), datetime.fromisoformat(start), trip.startTime)
+
+@metrics.timed("plan_trip")
+async def aplan_trip(request_json: str, *, use_cache: bool = True) -> Itinerary:
+    """plan_trip for the ASGI app: the Gemini call is awaited (ainvoke) instead of blocking a thread."""
+    trip = TripRequest(**json.loads(request_json))
+    if not use_cache:
+        return _finalize_plan(trip, await _ainvoke_planner_llm(trip))
+    cached = _cached_plan(trip)
+    if cached is not None:
+        return cached
+
+    async def fetch():
+        itinerary = _finalize_plan(trip, await _ainvoke_planner_llm(trip))
+        _store_plan(trip, itinerary)
+        return itinerary.model_dump(mode="json"), trip.startTime.isoformat()
+    return _shared_plan(trip, await _PLAN_FLIGHT.ado(_plan_cache_key(trip), fetch))
+
+# Static task rules for the compact encoding; they sit in the system message so every
+# planner call shares one cacheable prefix and the user message carries only the trip.
+PLANNER_TASK = """
+Task (the user message lists the trip as key=value lines; times are local):
+- Build an itinerary from start to end (or back near start if no end) using ONLY the listed modes.
+- Stay between from..until. Target overall duration ~hours if given.
+- Honor wheelchair, cuisine, diet, activities and budget when present.
+- Include very short notes in choice reasoning field regarding choice, or if any constraint may be violated.
+- Each leg should be realistic and sequential with full, proper and exact locations. Keep legs to maximum of 6 if possible.
+- Make sure to add each and every attractions, places to visit, restaurants etc as locations, while obeying the detailed constraints.
+- Recheck everything to make sure cost and time constraints are considered and outputted in the JSON.
+"""
+_PLANNER_SYSTEM_COMPACT = {"role": "system", "content": SYSTEM_INSTRUCTIONS + PLANNER_TASK}
+
+def _planner_messages(trip: TripRequest, encoding: str = PROMPT_ENCODING) -> list:
     # 2) Craft prompt
+    if encoding == "compact":
+        trip_fields = dict(trip.model_dump(exclude_none=True), endTime=trip.endTime)
+        return _counted("plan", [
+            _PLANNER_SYSTEM_COMPACT,
+            {"role": "user", "content": prompt_codec.encode_trip(trip_fields)},
+        ])
+
     user_prompt = f"""
 User trip request (ISO times are local):
 {trip.json()}
@@ -122,15 +339,29 @@ Task:
 - Make sure to add each and every attractions, places to visit, restaurants etc as locations, while obeying the detailed constaraints. 
 - Recheck everything to make sure cost and time constraints anre considered and outputted in the JSON.
 """
+    return _counted("plan", [
+        {"role": "system", "content": SYSTEM_INSTRUCTIONS},
+        {"role": "user", "content": user_prompt},
+    ])
 
+def _counted(kind: str, messages: list) -> list:
+    """Record the prompt's estimated size (prompt_codec stats, llm.prompt_tokens counter)."""
+    metrics.count("llm.prompt_tokens", prompt_codec.record(kind, messages))
+    return messages
+
+metrics.register_collector("prompt", prompt_codec.prompt_stats)
+
+def _invoke_planner(trip: TripRequest) -> Itinerary:
     # 3) Invoke LLM for structured JSON
-    itinerary: Itinerary = structured_llm.invoke(
-        [
-            {"role": "system", "content": SYSTEM_INSTRUCTIONS},
-            {"role": "user", "content": user_prompt},
-        ]
-    )
-    return itinerary
+    planner, _, config = _llm_clients()
+    with metrics.span("llm.plan"):
+        itinerary: Itinerary = planner.invoke(_planner_messages(trip), config=config)
+    return _finalize_plan(trip, itinerary)
+
+async def _ainvoke_planner_llm(trip: TripRequest) -> Itinerary:
+    planner, _, config = _llm_clients()
+    with metrics.span("llm.plan"):
+        return await planner.ainvoke(_planner_messages(trip), config=config)
 
 # Optimizer node: schema
 class OptimizationSignals(BaseModel):
@@ -161,15 +392,88 @@ class OptimizationResult(BaseModel):
     notes: List[str] = []                   # misc. reminders for the next node
 
 # Weather sidecar overlay
-import requests
-from dateutil import parser as _dtparse
-from datetime import datetime, timedelta
-
-OWM_FORECAST_URL  = "https://api.openweathermap.org/data/2.5/forecast"
+OWM_FORECAST_PATH = "data/2.5/forecast"  # base URL: OWM_BASE_URL (upstream.py)
 WEATHER_API_KEY   = os.getenv("WEATHER_API_KEY")
 
-# simple caches
-_WEATHER_Q_CACHE: dict[str, list | None] = {}
+# Overlay fan-out: per-endpoint lookups run on a shared bounded pool, and each
+# overlay returns whatever has resolved once its deadline passes. The lookups are
+# blocking HTTP calls, so these pools cap how many plans can be in their overlay
+# stage at once: size them for the in-flight plans you expect (the ASGI app keeps
+# hundreds). Upstream load stays bounded by the per-host caps in upstream.py.
+OVERLAY_MAX_WORKERS   = int(os.getenv("OVERLAY_MAX_WORKERS", "32"))
+# Stage workers mostly wait on lookups; each plan in its overlay stage holds two
+OVERLAY_STAGE_WORKERS = int(os.getenv("OVERLAY_STAGE_WORKERS", str(2 * OVERLAY_MAX_WORKERS)))
+OVERLAY_DEADLINE_S    = float(os.getenv("OVERLAY_DEADLINE_S", "25"))
+
+_OVERLAY_POOL = ThreadPoolExecutor(max_workers=OVERLAY_MAX_WORKERS, thread_name_prefix="overlay-leg")
+# Separate pool for whole-overlay tasks so they never wait on their own workers.
+_STAGE_POOL   = ThreadPoolExecutor(max_workers=OVERLAY_STAGE_WORKERS, thread_name_prefix="overlay-stage")
+
+def _fan_out(fn, items: list, deadline_s: Optional[float], limit: Optional[int] = None) -> Tuple[list, int]:
+    """
+    Run fn(item) for every item on the overlay pool, at most `limit` at a time if given.
+    Returns (results in input order, number of lookups still pending at the deadline).
+    Pending or failed lookups come back as None.
+    """
+    if not items:
+        return [], 0
+    if limit is None or limit >= len(items):
+        futures = [_OVERLAY_POOL.submit(metrics.bind(fn), it) for it in items]
+        done, pending = wait(futures, timeout=deadline_s)
+    else:
+        # Background work (batch prefetch) leaves the rest of the pool to interactive overlays
+        end = None if deadline_s is None else time.monotonic() + deadline_s
+        futures, done, pending = [], set(), set()
+        for it in items:
+            if len(pending) >= limit:
+                remaining = None if end is None else max(0.0, end - time.monotonic())
+                finished, pending = wait(pending, timeout=remaining, return_when=FIRST_COMPLETED)
+                done |= finished
+                if not finished:
+                    break  # deadline reached; the remaining items never start
+            f = _OVERLAY_POOL.submit(metrics.bind(fn), it)
+            futures.append(f)
+            pending.add(f)
+        else:
+            remaining = None if end is None else max(0.0, end - time.monotonic())
+            finished, pending = wait(pending, timeout=remaining)
+            done |= finished
+    for f in pending:
+        f.cancel()  # drops queued work; running lookups finish in the background
+    results = [f.result() if f in done and f.exception() is None else None for f in futures]
+    results += [None] * (len(items) - len(futures))
+    return results, len(items) - len(done)
+
+# ---- Forecast cache ----
+# OWM re-issues the 5-day/3-hour forecast every 3 hours, so entries are keyed by
+# city and issue slot. A slot's entry stays readable for WEATHER_STALE_S after the
+# next issue so a cold key can be served slightly stale while it refreshes in the
+# background. Backed by the shared SQLite cache, so every worker process sees it.
+
+WEATHER_ISSUE_S        = 3 * 3600
+WEATHER_STALE_S        = float(os.getenv("WEATHER_STALE_S", str(3 * 3600)))
+WEATHER_NEGATIVE_TTL_S = float(os.getenv("WEATHER_NEGATIVE_TTL_S", "300"))
+
+_WEATHER_Q_CACHE = TTLCache("owm-forecast", max_items=int(os.getenv("WEATHER_CACHE_SIZE", "256")))
+_WEATHER_REFRESH_POOL = ThreadPoolExecutor(max_workers=2, thread_name_prefix="owm-refresh")
+# (city, slot) -> time before which no new background refresh starts: running ones
+# block forever, failed ones back off for WEATHER_NEGATIVE_TTL_S.
+_WEATHER_REFRESHING: dict = {}
+_WEATHER_REFRESH_LOCK = threading.Lock()
+
+# Parsed forecasts, keyed like _WEATHER_Q_CACHE entries (city@slot).
+_FORECAST_SERIES: "OrderedDict[str, _ForecastSeries]" = OrderedDict()
+_FORECAST_SERIES_LOCK = threading.Lock()
+
+# Trip times are local to the city being planned; OWM timestamps are UTC.
+TRIP_TZ = ZoneInfo(os.getenv("TRIP_TZ", "America/New_York"))
+# Blend the two nearest 3-hour blocks instead of snapping to the closest one.
+WEATHER_INTERPOLATE = os.getenv("WEATHER_INTERPOLATE", "false").lower() in ("1", "true", "yes")
+
+def _issue_slot(ts: Optional[float] = None) -> int:
+    """Start (epoch seconds) of the OWM issue window containing ts."""
+    ts = time.time() if ts is None else ts
+    return int(ts // WEATHER_ISSUE_S) * WEATHER_ISSUE_S
 
 _COUNTRY_MAP = {
     "USA": "US", "UNITED STATES": "US", "US": "US",
@@ -233,48 +537,134 @@ def _extract_city_q(place: str) -> str:
 
     return f"{city},{country_code}" if country_code else city
 
-def _owm_forecast_blocks_by_place(place: str) -> Optional[list]:
-    """
-    Fetch 5-day/3-hour forecast blocks using 'q' only (no geocoding).
-    """
-    if not WEATHER_API_KEY or not place:
-        return None
-    q = _extract_city_q(place)
-    if not q:
-        return None
+# Concurrent misses for the same city@slot wait on one OWM call
+_FORECAST_FLIGHT = SingleFlight("owm-forecast")
 
-    key = q.lower()
-    if key in _WEATHER_Q_CACHE:
-        return _WEATHER_Q_CACHE[key]
+def _slim_block(b: dict) -> dict:
+    """Keep only the fields _fmt reads, so cached forecasts stay small."""
+    w = (b.get("weather") or [{}])[0]
+    m = b.get("main") or {}
+    return {
+        "dt": b["dt"],
+        "main": {"temp": m.get("temp"), "humidity": m.get("humidity")},
+        "weather": [{"description": w.get("description"), "icon": w.get("icon")}],
+        "wind": {"speed": (b.get("wind") or {}).get("speed")},
+    }
 
+def _fetch_owm_blocks(q: str) -> Optional[list]:
     try:
-        r = requests.get(
-            OWM_FORECAST_URL,
+        r = OWM.get(
+            OWM_FORECAST_PATH,
             params={"q": q, "appid": WEATHER_API_KEY, "units": "metric"},
-            timeout=20,
         )
         if r.status_code != 200:
-            _WEATHER_Q_CACHE[key] = None
             return None
-        blocks = r.json().get("list", [])
-        _WEATHER_Q_CACHE[key] = blocks
-        return blocks
+        return [_slim_block(b) for b in r.json().get("list", [])]
     except Exception:
-        _WEATHER_Q_CACHE[key] = None
         return None
 
-def _pick_closest(blocks: list, target: datetime) -> Optional[dict]:
-    if not blocks or not target:
+def _store_forecast(city: str, slot: int, blocks: Optional[list]) -> None:
+    if blocks is None:
+        ttl = WEATHER_NEGATIVE_TTL_S
+    else:
+        ttl = slot + WEATHER_ISSUE_S - time.time() + WEATHER_STALE_S
+    _WEATHER_Q_CACHE.set(f"{city}@{slot}", blocks, ttl)
+
+def _refresh_forecast(q: str, city: str, slot: int) -> None:
+    """
+    Background refresh while a stale forecast is served. A failed fetch writes no
+    negative entry (that would hide the stale forecast); the refresh backs off instead.
+    """
+    blocks = None
+    try:
+        blocks = _fetch_owm_blocks(q)
+        if blocks is not None:
+            _store_forecast(city, slot, blocks)
+        _WEATHER_Q_CACHE.purge_expired()
+    finally:
+        with _WEATHER_REFRESH_LOCK:
+            if blocks is None:
+                _WEATHER_REFRESHING[(city, slot)] = time.time() + WEATHER_NEGATIVE_TTL_S
+            else:
+                _WEATHER_REFRESHING.pop((city, slot), None)
+
+def _owm_forecast_entry(place: str) -> Tuple[Optional[str], Optional[list]]:
+    """
+    (cache key, forecast blocks) for a place, using 'q' only (no geocoding).
+    Served from the forecast cache; a miss in the current issue slot falls back to the
+    previous slot's forecast (refreshed in the background) before blocking on OWM.
+    """
+    if not WEATHER_API_KEY or not place:
+        return None, None
+    q = _extract_city_q(place)
+    if not q:
+        return None, None
+
+    city = q.lower()
+    slot = _issue_slot()
+    key = f"{city}@{slot}"
+    blocks = _WEATHER_Q_CACHE.get(key)
+    if blocks is not MISS and blocks:
+        return key, blocks
+
+    # A miss, or a cached failure, in this slot: serve the previous slot's forecast if there is one
+    stale_key = f"{city}@{slot - WEATHER_ISSUE_S}"
+    stale = _WEATHER_Q_CACHE.get(stale_key)
+    if stale is not MISS and stale:
+        now = time.time()
+        with _WEATHER_REFRESH_LOCK:
+            start = _WEATHER_REFRESHING.get((city, slot), 0) <= now
+            if start:
+                for k in [k for k in _WEATHER_REFRESHING if k[1] < slot]:
+                    del _WEATHER_REFRESHING[k]
+                _WEATHER_REFRESHING[(city, slot)] = float("inf")
+        if start:
+            _WEATHER_REFRESH_POOL.submit(_refresh_forecast, q, city, slot)
+        return stale_key, stale
+
+    if blocks is not MISS:
+        return key, blocks
+    return key, _FORECAST_FLIGHT.do(key, lambda: _fetch_forecast(q, city, slot))
+
+def _fetch_forecast(q: str, city: str, slot: int) -> Optional[list]:
+    blocks = _fetch_owm_blocks(q)
+    _store_forecast(city, slot, blocks)
+    return blocks
+
+@metrics.timed("owm_forecast")
+def _owm_forecast_blocks_by_place(place: str) -> Optional[list]:
+    """Fetch 5-day/3-hour forecast blocks using 'q' only (no geocoding)."""
+    return _owm_forecast_entry(place)[1]
+
+def _forecast_series_by_place(place: str) -> Optional["_ForecastSeries"]:
+    """Parsed, time-sorted forecast for a place; built once per cached forecast."""
+    key, blocks = _owm_forecast_entry(place)
+    if not blocks:
         return None
-    # OWM dt is seconds since epoch (UTC). Good enough for 3-hour bins.
-    return min(blocks, key=lambda b: abs(datetime.fromtimestamp(b["dt"]) - target))
+    with _FORECAST_SERIES_LOCK:
+        series = _FORECAST_SERIES.get(key)
+        if series is not None:
+            _FORECAST_SERIES.move_to_end(key)
+            return series
+    series = _ForecastSeries(blocks)
+    with _FORECAST_SERIES_LOCK:
+        _FORECAST_SERIES[key] = series
+        while len(_FORECAST_SERIES) > _WEATHER_Q_CACHE.max_items:
+            _FORECAST_SERIES.popitem(last=False)
+    return series
+
+def _to_epoch(target: datetime) -> float:
+    """Trip times are naive local (TRIP_TZ); OWM block times are UTC epochs."""
+    if target.tzinfo is None:
+        target = target.replace(tzinfo=TRIP_TZ)
+    return target.timestamp()
 
 def _fmt(block: dict) -> dict:
     w = (block.get("weather") or [{}])[0]
     m = block.get("main") or {}
     wind = block.get("wind") or {}
     return {
-        "time": datetime.fromtimestamp(block["dt"]).isoformat(),
+        "time": datetime.fromtimestamp(block["dt"], TRIP_TZ).isoformat(),
         "temp_c": m.get("temp"),
         "condition": (w.get("description") or "").title(),
         "humidity_pct": m.get("humidity"),
@@ -283,6 +673,61 @@ def _fmt(block: dict) -> dict:
         "source": "openweathermap:q"
     }
 
+def _lerp(a, b, f: float):
+    if a is None or b is None:
+        return a if f < 0.5 else b
+    return round(a + (b - a) * f, 2)
+
+class _ForecastSeries:
+    """Forecast blocks sorted by epoch, with _fmt output precomputed per block."""
+
+    def __init__(self, blocks: list):
+        ordered = sorted(blocks, key=lambda b: b["dt"])
+        self.epochs = [b["dt"] for b in ordered]
+        self.formatted = [_fmt(b) for b in ordered]
+
+    def closest(self, target: datetime) -> Optional[dict]:
+        """Formatted block nearest to target (bisect over the sorted epochs)."""
+        if not self.epochs or not target:
+            return None
+        t = _to_epoch(target)
+        i = bisect.bisect_left(self.epochs, t)
+        if i == 0:
+            return self.formatted[0]
+        if i == len(self.epochs):
+            return self.formatted[-1]
+        return self.formatted[i] if self.epochs[i] - t < t - self.epochs[i - 1] else self.formatted[i - 1]
+
+    def interpolate(self, target: datetime) -> Optional[dict]:
+        """
+        Linear blend of the two blocks around target for the numeric fields;
+        condition/icon come from the nearer block. Outside the forecast range -> closest.
+        """
+        if not self.epochs or not target:
+            return None
+        t = _to_epoch(target)
+        i = bisect.bisect_left(self.epochs, t)
+        if i == 0 or i == len(self.epochs) or self.epochs[i] == t:
+            return self.closest(target)
+        e0, e1 = self.epochs[i - 1], self.epochs[i]
+        b0, b1 = self.formatted[i - 1], self.formatted[i]
+        f = (t - e0) / (e1 - e0)
+        near = b0 if f < 0.5 else b1
+        return {
+            "time": datetime.fromtimestamp(t, TRIP_TZ).isoformat(),
+            "temp_c": _lerp(b0["temp_c"], b1["temp_c"], f),
+            "condition": near["condition"],
+            "humidity_pct": _lerp(b0["humidity_pct"], b1["humidity_pct"], f),
+            "wind_mps": _lerp(b0["wind_mps"], b1["wind_mps"], f),
+            "icon": near["icon"],
+            "source": "openweathermap:q (interpolated)",
+        }
+
+def _pick_closest(series: Optional[_ForecastSeries], target: datetime, interpolate: bool = False) -> Optional[dict]:
+    if series is None or not target:
+        return None
+    return series.interpolate(target) if interpolate else series.closest(target)
+
 def _ensure_leg_times(req: TripRequest, itin: Itinerary) -> list[tuple[Leg, datetime, datetime]]:
     """
     Guarantee each leg has a depart/arrive dt (even if Node 1 omitted times):
@@ -312,7 +757,26 @@ def _ensure_leg_times(req: TripRequest, itin: Itinerary) -> list[tuple[Leg, date
         resolved.append((leg, dep, arr))
     return resolved
 
-def build_weather_overlay_by_place(trip_request_json: str, itin: Itinerary) -> dict:
+def _weather_record(leg: Leg, dep_dt: datetime, arr_dt: datetime,
+                    depart: Optional[dict], arrive: Optional[dict]) -> dict:
+    return {
+        "sequence": leg.sequence,
+        "fromLocation": leg.fromLocation,
+        "toLocation": leg.toLocation,
+        "departTime": dep_dt.isoformat(),
+        "arriveTime": arr_dt.isoformat(),
+        "departWeather": depart,
+        "arriveWeather": arrive,
+    }
+
+@metrics.timed("weather_overlay")
+def build_weather_overlay_by_place(
+    trip_request_json: str,
+    itin: Itinerary,
+    *,
+    deadline_s: Optional[float] = OVERLAY_DEADLINE_S,
+    interpolate: bool = WEATHER_INTERPOLATE,
+) -> dict:
     """
     Sidecar overlay (does NOT modify itinerary):
     {
@@ -335,28 +799,247 @@ def build_weather_overlay_by_place(trip_request_json: str, itin: Itinerary) -> d
     req = TripRequest(**json.loads(trip_request_json))
     resolved = _ensure_leg_times(req, itin)
 
-    out = {"legWeather": []}
+    # Leg endpoints in order: [from_0, to_0, from_1, to_1, ...]
+    endpoints = []
     for leg, dep_dt, arr_dt in resolved:
-        blocks_from = _owm_forecast_blocks_by_place(leg.fromLocation)
-        blocks_to   = _owm_forecast_blocks_by_place(leg.toLocation)
-
-        depart = _fmt(_pick_closest(blocks_from, dep_dt)) if blocks_from else None
-        arrive = _fmt(_pick_closest(blocks_to,   arr_dt)) if blocks_to   else None
-
-        out["legWeather"].append({
-            "sequence": leg.sequence,
-            "fromLocation": leg.fromLocation,
-            "toLocation": leg.toLocation,
-            "departTime": dep_dt.isoformat(),
-            "arriveTime": arr_dt.isoformat(),
-            "departWeather": depart,
-            "arriveWeather": arrive,
-        })
+        endpoints.append((leg.fromLocation, dep_dt))
+        endpoints.append((leg.toLocation, arr_dt))
+
+    # Planning stage: forecasts are per city, so fetch one series per unique city and
+    # pick one block per unique (city, minute) pair, then fan the picks back out.
+    cities = [_weather_place_key(place) for place, _ in endpoints]
+    unique = {}
+    for city, (place, _) in zip(cities, endpoints):
+        if city and city not in unique:
+            unique[city] = place
+    series_list, pending = _fan_out(_forecast_series_by_place, list(unique.values()), deadline_s)
+    series = dict(zip(unique, series_list))
+
+    picks: dict = {}
+    results = []
+    for city, (_, when) in zip(cities, endpoints):
+        pair = (city, when.replace(second=0, microsecond=0))
+        if pair not in picks:
+            picks[pair] = _pick_closest(series.get(city), when, interpolate) if city else None
+        results.append(picks[pair])
+
+    out = {"legWeather": []}
+    for idx, (leg, dep_dt, arr_dt) in enumerate(resolved):
+        out["legWeather"].append(_weather_record(leg, dep_dt, arr_dt, results[2 * idx], results[2 * idx + 1]))
+    if pending:
+        out["note"] = f"Overlay deadline reached; {pending} forecast lookups still pending."
     return out
 
 ###############################################################################
+# ===== Schedule solver =====
+# Deterministic validation/repair of leg times. Order, overlaps, the trip window and
+# leg durations are fixed locally (a single pass over the legs); only what the timeline
+# cannot absorb (over budget, legs that don't fit even when compressed) needs the LLM.
+
+SCHEDULE_MIN_LEG_MIN   = int(os.getenv("SCHEDULE_MIN_LEG_MIN", "10"))   # floor when compressing legs
+SCHEDULE_TOLERANCE_MIN = int(os.getenv("SCHEDULE_TOLERANCE_MIN", "5"))  # ignore smaller duration mismatches
+_TRANSIT_MODES = {"walk", "subway", "subways", "bus", "train", "ferry", "taxi"}
+
+_AMOUNT = r"(\d[\d,]*(?:\.\d+)?)"
+# Currency-marked amounts only: "$100", "$50-$100" / "$50-100" (upper end), "100 USD", "100 dollars"
+_CURRENCY_AMOUNT = re.compile(
+    rf"\$\s*{_AMOUNT}(?:\s*(?:-|–|to)\s*\$?\s*{_AMOUNT})?|{_AMOUNT}\s*(?:usd|dollars?)\b", re.I)
+
+def _explicit_budget_usd(budget_usd) -> Optional[float]:
+    """tripBudgetUSD as a number ("$1,500" -> 1500, "50-100" -> 100); None for "" or no number."""
+    if isinstance(budget_usd, (int, float)) and not isinstance(budget_usd, bool):
+        return float(budget_usd)
+    nums = re.findall(_AMOUNT, budget_usd) if isinstance(budget_usd, str) else []
+    return max(float(n.replace(",", "")) for n in nums) if nums else None
+
+def _budget_cap_usd(trip: TripRequest, budget_usd=None) -> Optional[float]:
+    """
+    The explicit budget if it has a number, else the largest currency-marked amount
+    in budgetPreferences ("$100 for 2 people" -> 100, "cheap, 2 people" -> None).
+    """
+    explicit = _explicit_budget_usd(budget_usd)
+    if explicit is not None:
+        return explicit
+    amounts = [float(n.replace(",", "")) for m in _CURRENCY_AMOUNT.findall(trip.budgetPreferences or "")
+               for n in m if n]
+    return max(amounts) if amounts else None
+
+def _local(dt: Optional[datetime]) -> Optional[datetime]:
+    """Naive TRIP_TZ time; offset-aware values ("...T09:00-04:00") are converted first."""
+    if dt is None or dt.tzinfo is None:
+        return dt
+    return dt.astimezone(TRIP_TZ).replace(tzinfo=None)
+
+def _trip_window(trip: TripRequest) -> Tuple[datetime, datetime]:
+    return _local(trip.startTime), _local(getattr(trip, "endTime"))
+
+def _leg_dt(value: Optional[str], trip: TripRequest) -> Optional[datetime]:
+    """Leg time as naive local time; a bare "HH:MM" earlier than the start rolls to the next day if that fits the window."""
+    start, end = _trip_window(trip)
+    dt = _local(_coerce_dt(value, start))
+    if dt is not None and len(value.strip()) <= 8 and dt < start and dt + timedelta(days=1) <= end:
+        dt += timedelta(days=1)
+    return dt
+
+def _time_like(original: Optional[str], dt: datetime, trip: TripRequest) -> str:
+    """Format dt the way the leg wrote its time ("HH:MM" stays short, ISO stays ISO)."""
+    short = len(original.strip()) <= 8 if original else dt.date() == _trip_window(trip)[0].date()
+    return dt.strftime("%H:%M") if short else dt.strftime("%Y-%m-%dT%H:%M")
+
+def _minutes(a: datetime, b: datetime) -> int:
+    return int(round((b - a).total_seconds() / 60))
+
+def _chain_score(legs: List[Leg]) -> int:
+    """How many consecutive legs connect (leg N's toLocation is leg N+1's fromLocation)."""
+    return sum(_normalize_address(a.toLocation) == _normalize_address(b.fromLocation)
+               for a, b in zip(legs, legs[1:]))
+
+def check_schedule(trip: TripRequest, itin: Itinerary, *, budget_usd=None) -> List[dict]:
+    """Violations as [{"sequence", "kind", "detail"}]; an empty list means the plan is consistent."""
+    out = []
+    start, end = _trip_window(trip)
+    seqs = [leg.sequence for leg in itin.legs]
+    if seqs != list(range(1, len(seqs) + 1)):
+        out.append({"sequence": None, "kind": "sequence", "detail": f"sequence numbers {seqs}"})
+    prev_arr = None
+    for leg in itin.legs:
+        dep, arr = _leg_dt(leg.departTime, trip), _leg_dt(leg.arriveTime, trip)
+        if dep is None or arr is None:
+            out.append({"sequence": leg.sequence, "kind": "missing_time", "detail": "depart or arrive time missing"})
+            continue
+        if arr <= dep:
+            out.append({"sequence": leg.sequence, "kind": "negative_duration", "detail": f"{leg.departTime} -> {leg.arriveTime}"})
+        if dep < start or arr > end:
+            out.append({"sequence": leg.sequence, "kind": "outside_window",
+                        "detail": f"{dep:%H:%M}-{arr:%H:%M} outside {start:%H:%M}-{end:%H:%M}"})
+        if prev_arr is not None and dep < prev_arr:
+            out.append({"sequence": leg.sequence, "kind": "overlap", "detail": f"departs {dep:%H:%M} before previous arrival {prev_arr:%H:%M}"})
+        if leg.estDurationMin and arr > dep and abs(_minutes(dep, arr) - leg.estDurationMin) > SCHEDULE_TOLERANCE_MIN:
+            out.append({"sequence": leg.sequence, "kind": "duration_mismatch",
+                        "detail": f"{_minutes(dep, arr)} min scheduled, {leg.estDurationMin} min estimated"})
+        prev_arr = arr if prev_arr is None else max(prev_arr, arr)
+    cap = _budget_cap_usd(trip, budget_usd)
+    total = sum(leg.costEstimateUSD or 0 for leg in itin.legs)
+    if cap is not None and total > cap:
+        out.append({"sequence": None, "kind": "over_budget", "detail": f"${total:.2f} > ${cap:.2f}"})
+    return out
+
+def repair_schedule(
+    trip: TripRequest, itin: Itinerary, *, budget_usd=None
+) -> Tuple[Itinerary, List[ChangeItem], List[dict]]:
+    """
+    Repair leg order and times against the trip window.
+    - order: sequence order, or departure order if that connects more legs end to end;
+    - durations: the scheduled span when the leg's own times are valid; estDurationMin only
+      when a time is missing or the leg overlaps its predecessor or leaves the window;
+      else an even share of the free time;
+    - timeline: each leg departs at its planned time or the previous arrival, whichever is later;
+      if that overruns the window, gaps are closed, then non-transit legs are shortened
+      proportionally (not below SCHEDULE_MIN_LEG_MIN).
+    Returns (repaired itinerary, ChangeItem per changed leg, violations left for the LLM).
+    """
+    legs = list(itin.legs)
+    if not legs:
+        return itin, [], check_schedule(trip, itin, budget_usd=budget_usd)
+    start, end = _trip_window(trip)
+    timed = {id(leg): (_leg_dt(leg.departTime, trip), _leg_dt(leg.arriveTime, trip)) for leg in legs}
+
+    ordered = sorted(legs, key=lambda l: l.sequence)
+    if all(timed[id(l)][0] for l in legs):
+        by_time = sorted(ordered, key=lambda l: timed[id(l)][0])
+        if _chain_score(by_time) > _chain_score(ordered):
+            ordered = by_time
+
+    durations, prev_arr = [], None
+    for leg in ordered:
+        dep, arr = timed[id(leg)]
+        est = leg.estDurationMin if leg.estDurationMin and leg.estDurationMin > 0 else None
+        valid = dep is not None and arr is not None and arr > dep
+        broken = not valid or dep < start or arr > end or (prev_arr is not None and dep < prev_arr)
+        if valid and not (broken and est):
+            durations.append(_minutes(dep, arr))
+        else:
+            durations.append(est)
+        if valid:
+            prev_arr = arr if prev_arr is None else max(prev_arr, arr)
+    window = _minutes(start, end)
+    unknown = durations.count(None)
+    if unknown:
+        share = max(SCHEDULE_MIN_LEG_MIN, (window - sum(d for d in durations if d)) // unknown)
+        durations = [d if d is not None else share for d in durations]
+
+    def place(keep_gaps: bool) -> List[datetime]:
+        cursor, deps = start, []
+        for leg, d in zip(ordered, durations):
+            want = timed[id(leg)][0] if keep_gaps else None
+            dep = want if want is not None and want >= cursor else cursor
+            deps.append(dep)
+            cursor = dep + timedelta(minutes=d)
+        return deps
+
+    deps = place(keep_gaps=True)
+    if deps[-1] + timedelta(minutes=durations[-1]) > end:
+        deps = place(keep_gaps=False)
+        overflow = sum(durations) - window
+        if overflow > 0:
+            flexible = [i for i, leg in enumerate(ordered)
+                        if (leg.mode or "").lower() not in _TRANSIT_MODES and durations[i] > SCHEDULE_MIN_LEG_MIN]
+            slack = sum(durations[i] - SCHEDULE_MIN_LEG_MIN for i in flexible)
+            if slack > 0:
+                ratio = min(1.0, overflow / slack)
+                for i in flexible:
+                    durations[i] -= math.ceil((durations[i] - SCHEDULE_MIN_LEG_MIN) * ratio)
+                deps = place(keep_gaps=False)
+
+    repaired, changes = [], []
+    for seq, (leg, dep, d) in enumerate(zip(ordered, deps, durations), start=1):
+        arr = dep + timedelta(minutes=d)
+        old_dep, old_arr = timed[id(leg)]
+        if (old_dep, old_arr, leg.sequence) == (dep, arr, seq):
+            repaired.append(leg)
+            continue
+        new_leg = leg.model_copy(update={
+            "sequence": seq,
+            "departTime": _time_like(leg.departTime, dep, trip),
+            "arriveTime": _time_like(leg.arriveTime, arr, trip),
+            "estDurationMin": d,
+        })
+        repaired.append(new_leg)
+        old_d = (_minutes(old_dep, old_arr) if old_dep and old_arr and old_arr > old_dep
+                 else leg.estDurationMin)
+        if old_d is not None and d != old_d:
+            kind, reason = ("shorten" if d < old_d else "extend"), "Schedule repair: fitted the leg into the trip window."
+        else:
+            kind, reason = "move", "Schedule repair: removed overlap/out-of-order timing or filled missing times."
+        changes.append(ChangeItem(
+            change_type=kind, target_sequence=leg.sequence, new_sequence=seq,
+            before=leg, after=new_leg, reason=reason,
+            expected_time_delta_min=(d - old_d) if old_d is not None else None,
+        ))
+
+    if not changes:
+        return itin, [], check_schedule(trip, itin, budget_usd=budget_usd)
+    costs = [leg.costEstimateUSD for leg in repaired if leg.costEstimateUSD is not None]
+    fixed = itin.model_copy(update={
+        "legs": repaired,
+        "totalEstDurationMin": _minutes(deps[0], deps[-1] + timedelta(minutes=durations[-1])),
+        "totalEstCostUSD": round(sum(costs), 2) if costs else itin.totalEstCostUSD,
+    })
+    return fixed, changes, check_schedule(trip, fixed, budget_usd=budget_usd)
+
+def _finalize_plan(trip: TripRequest, itin: Itinerary) -> Itinerary:
+    """Repair a fresh LLM plan's timeline before it is cached or returned (unrepaired if the solver fails)."""
+    try:
+        fixed, changes, _ = repair_schedule(trip, itin)
+    except Exception:
+        return itin
+    if not changes:
+        return itin
+    note = f"Leg times adjusted locally for {len(changes)} leg(s) (overlaps, order or trip window)."
+    return fixed.model_copy(update={"assumptions": list(fixed.assumptions) + [note]})
+
+
 # ===== Minimal context helpers for optimizer =====
-from typing import Tuple
 
 def _strip_itinerary_for_optimizer(itin: Itinerary, keep_fields: List[str]) -> List[dict]:
     """Return legs as a list of dicts containing only the fields the LLM must preserve/edit."""
@@ -405,6 +1088,143 @@ def _summarize_weather_risk_from_overlay(overlay: Optional[dict]) -> Tuple[bool,
         })
     return any_bad, risks
 
+def _match_weather_risks(overlay: Optional[dict], risks: List[dict], itin: Itinerary) -> List[dict]:
+    """
+    Risk rows renumbered to `itin`'s legs. The overlay was built for the plan before
+    repair_schedule may have reordered it, so rows are matched by from/to place; rows
+    whose leg is gone are dropped, rows without places keep their sequence.
+    """
+    places = {lw.get("sequence"): (lw.get("fromLocation"), lw.get("toLocation"))
+              for lw in (overlay or {}).get("legWeather", [])}
+    by_place: dict = {}
+    for leg in itin.legs:
+        by_place.setdefault(_leg_places(leg.fromLocation, leg.toLocation), []).append(leg.sequence)
+    out = []
+    for r in risks:
+        src, dst = places.get(r["sequence"], (None, None))
+        if not src and not dst:
+            out.append(r)
+            continue
+        seqs = by_place.get(_leg_places(src, dst))
+        if seqs:
+            out.append(dict(r, sequence=seqs.pop(0)))
+    return out
+
+# ---- Rule-based weather tier ----
+# Applies the optimizer's own weather policy locally: subway instead of a long walk,
+# or a shift of up to WEATHER_SHIFT_MAX_MIN into a dry forecast block. Only outdoor
+# activities in bad weather (which need an indoor replacement) are left to the LLM.
+WEATHER_WALK_SWAP_MIN = int(os.getenv("WEATHER_WALK_SWAP_MIN", "10"))   # shorter walks are left alone
+WEATHER_SHIFT_MAX_MIN = int(os.getenv("WEATHER_SHIFT_MAX_MIN", "45"))
+SUBWAY_FARE_USD       = float(os.getenv("SUBWAY_FARE_USD", "2.90"))
+_OUTDOOR_HINTS = ("park", "garden", "pier", "bridge", "high line", "beach", "zoo", "plaza",
+                  "square", "promenade", "boardwalk", "island", "outdoor", "walking tour", "cruise")
+
+def _subway_minutes(walk_min: int) -> int:
+    """Rough subway time for a walk: ~40% of the walking time plus station access/wait."""
+    return max(8, round(walk_min * 0.4) + 6)
+
+def _is_outdoor(leg: Leg) -> bool:
+    text = f"{leg.toLocation} {leg.choiceReasoning or ''}".lower()
+    return any(h in text for h in _OUTDOOR_HINTS)
+
+def _dry_shift(trip: TripRequest, leg: Leg, lo: Optional[datetime] = None,
+               hi: Optional[datetime] = None) -> Optional[int]:
+    """
+    Smallest shift (minutes, within ±WEATHER_SHIFT_MAX_MIN) whose depart/arrive forecasts
+    are not bad, keeping the leg inside the trip window and [lo, hi] (the previous leg's
+    arrival and the next leg's departure), so the schedule repair won't move it back.
+    """
+    dep, arr = _leg_dt(leg.departTime, trip), _leg_dt(leg.arriveTime, trip)
+    if dep is None or arr is None:
+        return None
+    start, end = _trip_window(trip)
+    start, end = max(start, lo or start), min(end, hi or end)
+    series = _forecast_series_by_place(leg.fromLocation)
+    if series is None:
+        return None
+    for mins in range(15, WEATHER_SHIFT_MAX_MIN + 1, 15):
+        for delta in (mins, -mins):
+            d = timedelta(minutes=delta)
+            if dep + d < start or arr + d > end:
+                continue
+            if not _is_bad_weather(_pick_closest(series, dep + d)) and not _is_bad_weather(_pick_closest(series, arr + d)):
+                return delta
+    return None
+
+def _apply_weather_rules(
+    trip: TripRequest, itin: Itinerary, weather_risks: List[dict]
+) -> Tuple[Itinerary, List[ChangeItem], List[int]]:
+    """
+    Deterministic weather fixes for the legs flagged bad in weather_risks.
+    Returns (itinerary, changes, sequences that still need the LLM).
+    """
+    bad = {r["sequence"] for r in weather_risks if r.get("departBad") or r.get("arriveBad")}
+    legs, changes, unresolved = [], [], []
+    for i, leg in enumerate(itin.legs):
+        mode = (leg.mode or "").lower()
+        if leg.sequence not in bad or mode in ("subway", "subways"):
+            legs.append(leg)
+            continue
+        if mode == "walk":
+            dep, arr = _leg_dt(leg.departTime, trip), _leg_dt(leg.arriveTime, trip)
+            walk_min = leg.estDurationMin or (_minutes(dep, arr) if dep and arr else 0)
+            if walk_min < WEATHER_WALK_SWAP_MIN:
+                legs.append(leg)
+                continue
+            if "subways" in trip.transportMode:
+                ride = _subway_minutes(walk_min)
+                update = {"mode": "subway", "estDurationMin": ride,
+                          "costEstimateUSD": round((leg.costEstimateUSD or 0) + SUBWAY_FARE_USD, 2),
+                          "choiceReasoning": f"Subway instead of a {walk_min}-min walk in bad weather."}
+                if dep is not None:
+                    update["arriveTime"] = _time_like(leg.arriveTime, dep + timedelta(minutes=ride), trip)
+                if trip.wheelchairAccessible:
+                    update["accessibilityNotes"] = "Verify step-free stations (elevators) on this route."
+                new_leg = leg.model_copy(update=update)
+                changes.append(ChangeItem(
+                    change_type="replace", target_sequence=leg.sequence, new_sequence=leg.sequence,
+                    before=leg, after=new_leg, reason="Bad weather: subway instead of a long walk.",
+                    expected_time_delta_min=ride - walk_min, expected_budget_delta_usd=SUBWAY_FARE_USD,
+                    risk_notes=update.get("accessibilityNotes"),
+                ))
+                legs.append(new_leg)
+                continue
+        prev_arr = _leg_dt(legs[-1].arriveTime, trip) if legs else None
+        next_dep = _leg_dt(itin.legs[i + 1].departTime, trip) if i + 1 < len(itin.legs) else None
+        shift = _dry_shift(trip, leg, prev_arr, next_dep) if mode == "walk" or _is_outdoor(leg) else None
+        if shift is not None:
+            d = timedelta(minutes=shift)
+            new_leg = leg.model_copy(update={
+                "departTime": _time_like(leg.departTime, _leg_dt(leg.departTime, trip) + d, trip),
+                "arriveTime": _time_like(leg.arriveTime, _leg_dt(leg.arriveTime, trip) + d, trip),
+            })
+            changes.append(ChangeItem(
+                change_type="move", target_sequence=leg.sequence, new_sequence=leg.sequence,
+                before=leg, after=new_leg, reason=f"Bad weather: shifted {shift:+d} min into a drier forecast window.",
+                expected_time_delta_min=0,
+            ))
+            legs.append(new_leg)
+        elif mode == "walk" or _is_outdoor(leg):
+            unresolved.append(leg.sequence)  # no dry slot between its neighbours: needs the LLM
+            legs.append(leg)
+        else:
+            legs.append(leg)
+    return itin.model_copy(update={"legs": legs}), changes, unresolved
+
+def _shifts_undone(trip: TripRequest, changes: List[ChangeItem], itin: Itinerary) -> List[int]:
+    """Sequences of weather-shifted legs that the schedule repair moved off their dry slot."""
+    by_places = {_leg_places(leg.fromLocation, leg.toLocation): leg for leg in itin.legs}
+    undone = []
+    for c in changes:
+        if c.change_type != "move" or c.after is None:
+            continue
+        leg = by_places.get(_leg_places(c.after.fromLocation, c.after.toLocation))
+        if leg is None or (_leg_dt(leg.departTime, trip), _leg_dt(leg.arriveTime, trip)) != \
+                (_leg_dt(c.after.departTime, trip), _leg_dt(c.after.arriveTime, trip)):
+            undone.append(c.target_sequence)
+    return undone
+
 OPTIMIZER_SYSTEM = """You are a conservative itinerary optimizer.
 
 SCOPE:
@@ -435,13 +1255,16 @@ OUTPUT:
 - Keep 'choiceReasoning' short (≤ 15 words) when a leg is changed for weather/budget/preference reasons.
 """
 
-def optimize_itinerary(
+def _optimizer_request(
     trip_request_json: str,
     current_itinerary_json: str,
     signals_json: str
-) -> OptimizationResult:
-    """Optimize using ONLY minimal retained fields + new preferences/notes + weather overlay."""
-    opt_llm_struct = llm.with_structured_output(OptimizationResult)
+) -> Tuple[TripRequest, Optional[OptimizationResult], Optional[list]]:
+    """
+    (trip, local result, None) when no LLM is needed, else (trip, None, optimizer LLM messages).
+    The current plan's timeline is repaired locally first (repair_schedule), so the LLM only
+    sees a consistent schedule and is skipped when signals need no generative change.
+    """
     # Parse + validate inputs
     req_data = json.loads(trip_request_json)
     trip = TripRequest(**req_data)
@@ -453,7 +1276,15 @@ def optimize_itinerary(
     # signals.weather is expected to be the overlay dict you built earlier
     weather_overlay = sig_data.get("weather")
     new_notes = sig_data.get("user_notes") or []    # new prefs/notes only
-    new_budget = sig_data.get("tripBudgetUSD", None)
+    # The frontend sends its free-text preferences as one string
+    new_notes = [new_notes] if isinstance(new_notes, str) else new_notes if isinstance(new_notes, list) else []
+    # "$1,500" -> 1500.0; "" (the frontend's empty field) and unparseable budgets are no budget
+    new_budget = _explicit_budget_usd(sig_data.get("tripBudgetUSD"))
+
+    current_itin, repairs, residual = repair_schedule(trip, current_itin, budget_usd=new_budget)
+    over_budget = any(v["kind"] == "over_budget" for v in residual)
+    # The cap the plan broke (explicit, or from budgetPreferences) goes into the LLM prompt
+    prompt_budget = new_budget if new_budget is not None else _budget_cap_usd(trip) if over_budget else None
 
     # Slim the current itinerary to just the essential, non-conflicting fields
     KEEP_LEG_FIELDS = [
@@ -464,25 +1295,76 @@ def optimize_itinerary(
     ]
     slim_legs = _strip_itinerary_for_optimizer(current_itin, KEEP_LEG_FIELDS)
 
-    # Compress weather to leg-level risk flags
+    # Compress weather to leg-level risk flags, renumbered to the repaired legs
     any_bad, weather_risks = _summarize_weather_risk_from_overlay(weather_overlay)
+    weather_risks = _match_weather_risks(weather_overlay, weather_risks, current_itin)
+    any_bad = any(r["departBad"] or r["arriveBad"] for r in weather_risks)
 
-    # If neither weather risk nor new notes/budget, short-circuit: no changes
-    if not any_bad and not new_notes and new_budget is None:
-        # Return a no-op result
+    # If neither weather risk nor new notes, and the budget (if any) already holds, no LLM needed
+    if not any_bad and not new_notes and not over_budget:
+        total = sum(leg.costEstimateUSD or 0 for leg in current_itin.legs)
         no_changes = OptimizationResult(
-            summary="No weather risks or new preferences. Itinerary unchanged.",
-            changes=[],
+            summary=(f"Schedule repaired locally ({len(repairs)} leg(s) retimed); no other changes needed."
+                     if repairs else "No weather risks or new preferences. Itinerary unchanged."),
+            changes=repairs,
             optimized=current_itin,
             assumptions=(current_itin.assumptions or []) + ["No new signals; kept as-is."],
-            budget_summary=None,
-            notes=[]
+            budget_summary=(f"Estimated total ${total:.2f}, within ${new_budget:.2f}."
+                            if new_budget is not None else None),
+            notes=[v["detail"] for v in residual]
         )
-        return no_changes
+        return trip, no_changes, None
+
+    # Weather is the only signal: apply the rule tier; the LLM is only needed for
+    # outdoor activities that want an indoor replacement, or if fares break the budget
+    if any_bad and not new_notes and not over_budget:
+        ruled, weather_changes, unresolved = _apply_weather_rules(trip, current_itin, weather_risks)
+        ruled, retimed, residual = repair_schedule(trip, ruled, budget_usd=new_budget)
+        if (not unresolved and not _shifts_undone(trip, weather_changes, ruled)
+                and not any(v["kind"] == "over_budget" for v in residual)):
+            total = sum(leg.costEstimateUSD or 0 for leg in ruled.legs)
+            note = (f"Weather rules applied to {len(weather_changes)} leg(s) (subway for long walks, ≤{WEATHER_SHIFT_MAX_MIN} min shifts)."
+                    if weather_changes else "Bad weather only affects sheltered or short legs; kept as-is.")
+            return trip, OptimizationResult(
+                summary=note,
+                changes=repairs + weather_changes + retimed,
+                optimized=ruled,
+                assumptions=(ruled.assumptions or []) + [note],
+                budget_summary=(f"Estimated total ${total:.2f}, within ${new_budget:.2f}."
+                                if new_budget is not None else None),
+                notes=[v["detail"] for v in residual]
+            ), None
+
+    if prompt_budget is None and any(v["kind"] == "over_budget" for v in residual):
+        prompt_budget = _budget_cap_usd(trip)  # weather fares pushed the plan over budgetPreferences
+    return trip, None, _optimizer_messages(trip, new_notes, prompt_budget, weather_risks, slim_legs)
+
+# Static part of the compact optimizer prompt, kept in the system message (cacheable prefix)
+OPTIMIZER_COMPACT_INPUT = """
+INPUT FORMAT:
+- The user message has key=value lines (window, modes, wheelchair, budgetUSD, notes), the legs with
+  bad weather under bad_weather, then a places legend (@n=full place name) and a legs table
+  (seq|mode|dep|arr|min|from|to[|usd][|access][|why]) whose from/to cells are @n references.
+- In the output, ALWAYS write full place names from the legend, never @n.
+- Optimize ONLY if bad_weather lists legs, or if notes / budgetUSD require a tweak.
+  Otherwise return the legs unchanged (resequence 1..N if needed).
+"""
+_OPTIMIZER_SYSTEM_COMPACT = {"role": "system", "content": OPTIMIZER_SYSTEM + OPTIMIZER_COMPACT_INPUT}
+
+def _optimizer_messages(trip: TripRequest, new_notes: list, new_budget, weather_risks: list,
+                        slim_legs: List[dict], encoding: str = PROMPT_ENCODING) -> list:
+    window = (trip.startTime.isoformat(), getattr(trip, "endTime").isoformat())
+    if encoding == "compact":
+        return _counted("optimize", [
+            _OPTIMIZER_SYSTEM_COMPACT,
+            {"role": "user", "content": prompt_codec.encode_optimizer_context(
+                window=window, modes=trip.transportMode, wheelchair=trip.wheelchairAccessible,
+                notes=new_notes, budget_usd=new_budget, weather_risks=weather_risks, legs=slim_legs)},
+        ])
 
     # Build minimal LLM context
     context = {
-        "trip_window": {"start": trip.startTime.isoformat(), "end": getattr(trip, "endTime").isoformat()},
+        "trip_window": {"start": window[0], "end": window[1]},
         "allowedModes": trip.transportMode,               # e.g., ["subways","walk"]
         "wheelchairAccessible": trip.wheelchairAccessible,
         "new_preferences": {
@@ -500,17 +1382,20 @@ def optimize_itinerary(
         + json.dumps(context, default=str)
     )
 
-    result: OptimizationResult = opt_llm_struct.invoke(
-        [
-            {"role": "system", "content": OPTIMIZER_SYSTEM},
-            {"role": "user", "content": user_msg}
-        ]
-    )
+    return _counted("optimize", [
+        {"role": "system", "content": OPTIMIZER_SYSTEM},
+        {"role": "user", "content": user_msg}
+    ])
 
+def _resequence(trip: TripRequest, result: OptimizationResult) -> OptimizationResult:
     if result.optimized.legs:
         # result.optimized.legs = result.optimized.legs[:6]
         for idx, leg in enumerate(result.optimized.legs, start=1):
             leg.sequence = idx
+        # Validate the LLM's timeline too; any retiming is reported as extra changes
+        fixed, repairs, _ = repair_schedule(trip, result.optimized)
+        if repairs:
+            result = result.model_copy(update={"optimized": fixed, "changes": list(result.changes) + repairs})
 
     return result
 
@@ -518,32 +1403,158 @@ def optimize_itinerary(
 
 ##################################################################################
 
-# Create a structured wrapper for optimizer output
-#opt_llm_struct = llm.with_structured_output(OptimizationResult)
+# The optimizer's structured wrapper is built once, with the client (_llm_clients)
+
+@metrics.timed("optimize_itinerary")
+def optimize_itinerary(
+    trip_request_json: str,
+    current_itinerary_json: str,
+    signals_json: str
+) -> OptimizationResult:
+    """Optimize using ONLY minimal retained fields + new preferences/notes + weather overlay."""
+    trip, no_changes, messages = _optimizer_request(trip_request_json, current_itinerary_json, signals_json)
+    if no_changes is not None:
+        return no_changes
+    _, optimizer, config = _llm_clients()
+    with metrics.span("llm.optimize"):
+        result = optimizer.invoke(messages, config=config)
+    return _resequence(trip, result)
+
+@metrics.timed("optimize_itinerary")
+async def aoptimize_itinerary(
+    trip_request_json: str,
+    current_itinerary_json: str,
+    signals_json: str
+) -> OptimizationResult:
+    """optimize_itinerary for the ASGI app (awaits the Gemini call)."""
+    # The weather rules may fetch a forecast (blocking HTTP), so keep them off the event loop
+    trip, no_changes, messages = await asyncio.to_thread(
+        _optimizer_request, trip_request_json, current_itinerary_json, signals_json)
+    if no_changes is not None:
+        return no_changes
+    _, optimizer, config = _llm_clients()
+    with metrics.span("llm.optimize"):
+        result = await optimizer.ainvoke(messages, config=config)
+    return _resequence(trip, result)
 
-# ===================== CRIME OVERLAY (NYC Open Data) ===================== #
 
-import os, time, math, requests
-from typing import Optional, List, Tuple
-from datetime import datetime, timedelta
-from dateutil import parser as _dtp
 
-NYC_CRIME_BASE   = "https://data.cityofnewyork.us/resource"
+# ===================== CRIME OVERLAY (NYC Open Data) ===================== #
+
 NYC_CRIME_DATASET = "5uac-w243"  # NYPD Complaint Data (Historic) - robust, but slightly laggy
+_CRIME_SOURCE     = f"NYC Open Data NYPD {NYC_CRIME_DATASET}"
+CRIME_WIDEN_STEPS = (45, 180, 365)    # lookback days, widened until a window has data
+CRIME_RADIUS_SEQ  = (400, 800, 1200)  # search radius (m), widened the same way
+
+def _crime_stats(count: Optional[int], start: datetime, end: datetime, radius_m: Optional[int],
+                 top_offenses: list, source: str = _CRIME_SOURCE, note: Optional[str] = None) -> dict:
+    """One endpoint's crime stats; every lookup path (SODA, local index, failures) returns this shape."""
+    stats = {"count": count, "window": f"{_date_only(start)}..{_date_only(end)}", "radius_m": radius_m,
+             "top_offenses": top_offenses, "source": source}
+    if note:
+        stats["note"] = note
+    return stats
+
+def _crime_overlay(records: list, widen_steps: Tuple[int, ...] = CRIME_WIDEN_STEPS,
+                   radius_seq: Tuple[int, ...] = CRIME_RADIUS_SEQ,
+                   lookback_days_default: Optional[int] = None) -> dict:
+    """{"legCrime": records, "params": {...}}, the shape every crime overlay path returns."""
+    return {"legCrime": records,
+            "params": {"lookback_days_default": widen_steps[0] if lookback_days_default is None else lookback_days_default,
+                       "widen_steps": list(widen_steps),
+                       "radius_seq": list(radius_seq)}}
+
+# ---- Local crime index (optional) ----
+# Partition dir from `python crime_index.py ingest`, a single .npz, or a CSV such as
+# data/crime_fixture.csv. When set, crime stats are answered in memory instead of SODA.
+CRIME_INDEX_PATH = os.getenv("CRIME_INDEX_PATH")
+_CRIME_INDEX = None
+_CRIME_INDEX_LOCK = threading.Lock()
+
+def _get_crime_index():
+    """Load the local index once; None means use SODA."""
+    global _CRIME_INDEX
+    if not CRIME_INDEX_PATH:
+        return None
+    if _CRIME_INDEX is None:
+        with _CRIME_INDEX_LOCK:
+            if _CRIME_INDEX is None:
+                try:
+                    from crime_index import CrimeIndex
+                    _CRIME_INDEX = CrimeIndex.load(CRIME_INDEX_PATH)
+                except Exception as e:
+                    print(f"Crime index unavailable ({e}); falling back to SODA.")
+                    _CRIME_INDEX = False
+    return _CRIME_INDEX or None
 
 # ---- Geocoding (Nominatim) ----
 ## NOMINATIM_UA is now loaded at the top after load_dotenv
-_GEOCODE_CACHE: dict[str, Optional[Tuple[float, float]]] = {}
 
-def _geocode_nominatim(address: str, timeout=20) -> Optional[Tuple[float, float]]:
+GEOCODE_TTL_S          = float(os.getenv("GEOCODE_TTL_S", str(30 * 24 * 3600)))  # places rarely move
+GEOCODE_NEGATIVE_TTL_S = float(os.getenv("GEOCODE_NEGATIVE_TTL_S", str(24 * 3600)))
+GEOCODE_ERROR_TTL_S    = 60.0  # transient upstream errors: retry soon, but don't hammer
+
+# LRU memory tier over the shared SQLite cache; values are [lat, lon] or None.
+_GEOCODE_CACHE = TTLCache("geocode", max_items=int(os.getenv("GEOCODE_CACHE_SIZE", "4096")))
+
+class _TokenBucket:
+    """Blocking token bucket shared by every thread; callers reserve the next free slot."""
+
+    def __init__(self, rate_per_s: float, burst: int = 1):
+        self.interval = 1.0 / rate_per_s
+        self.burst = burst
+        self._next = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self) -> None:
+        with self._lock:
+            now = time.monotonic()
+            # Allow up to `burst` tokens to accumulate while idle.
+            start = max(self._next, now - self.interval * (self.burst - 1))
+            self._next = start + self.interval
+        delay = start - now
+        if delay > 0:
+            time.sleep(delay)
+
+_GEOCODE_FLIGHT = SingleFlight("geocode")
+
+# Nominatim usage policy: at most 1 request/second across the whole process.
+_NOMINATIM_BUCKET = _TokenBucket(float(os.getenv("NOMINATIM_RATE_PER_S", "1.0")))
+# Geocode misses run on their own single worker, so the token bucket only ever
+# sleeps there; a large fan-out queues here instead of holding overlay pool slots.
+_NOMINATIM_POOL = ThreadPoolExecutor(max_workers=1, thread_name_prefix="nominatim")
+
+_COUNTRY_SUFFIX = re.compile(r"(,\s*(usa|us|u\.s\.a\.|united states( of america)?))+$")
+
+def _normalize_address(address: str) -> str:
+    """Cache key: case/whitespace/comma spacing folded and a trailing country dropped."""
+    key = re.sub(r"\s+", " ", (address or "").strip().lower())
+    key = re.sub(r"\s*,\s*", ", ", key).strip(" ,.")
+    return _COUNTRY_SUFFIX.sub("", key).strip(" ,.")
+
+def _geocode_nominatim(address: str, timeout=None) -> Optional[Tuple[float, float]]:
     if not address: 
         return None
-    key = address.strip().lower()
-    if key in _GEOCODE_CACHE:
-        return _GEOCODE_CACHE[key]
+    key = _normalize_address(address)
+    cached = _GEOCODE_CACHE.get(key)
+    if cached is not MISS:
+        return tuple(cached) if cached else None
+    return _NOMINATIM_POOL.submit(metrics.bind(_resolve_geocode), key, address, timeout).result()
+
+@metrics.timed("geocode")
+def _resolve_geocode(key: str, address: str, timeout=None) -> Optional[Tuple[float, float]]:
+    """Runs on _NOMINATIM_POOL; an earlier queued miss may already have filled the cache."""
+    cached = _GEOCODE_CACHE.get(key)
+    if cached is not MISS:
+        return tuple(cached) if cached else None
+    # Concurrent misses for the same normalized address share one Nominatim call
+    return _GEOCODE_FLIGHT.do(key, lambda: _fetch_geocode(key, address, timeout))
+
+def _fetch_geocode(key: str, address: str, timeout=None) -> Optional[Tuple[float, float]]:
+    _NOMINATIM_BUCKET.acquire()  # be polite to Nominatim
     try:
-        r = requests.get(
-            "https://nominatim.openstreetmap.org/search",
+        r = NOMINATIM.get(
+            "search",
             params={"q": address, "format": "json", "limit": 1},
             headers={"User-Agent": NOMINATIM_UA},
             timeout=timeout,
@@ -551,20 +1562,47 @@ def _geocode_nominatim(address: str, timeout=20) -> Optional[Tuple[float, float]
         r.raise_for_status()
         js = r.json()
         if not js:
-            _GEOCODE_CACHE[key] = None
+            _GEOCODE_CACHE.set(key, None, GEOCODE_NEGATIVE_TTL_S)
             return None
         lat, lon = float(js[0]["lat"]), float(js[0]["lon"])
-        _GEOCODE_CACHE[key] = (lat, lon)
-        time.sleep(1.0)  # be polite to Nominatim
+        _GEOCODE_CACHE.set(key, [lat, lon], GEOCODE_TTL_S)
         return (lat, lon)
     except Exception:
-        _GEOCODE_CACHE[key] = None
+        _GEOCODE_CACHE.set(key, None, GEOCODE_ERROR_TTL_S)
         return None
 
+def geocode_many(addresses: List[str], deadline_s: Optional[float] = None) -> dict:
+    """
+    Geocode a batch of addresses: duplicates (after normalization) are resolved once,
+    cache hits return immediately, and misses queue on the Nominatim worker (never
+    on the overlay pool). The caller's thread is the only one that waits.
+    Returns {address: (lat, lon) | None}; addresses still pending at the deadline are omitted.
+    """
+    resolved: dict = {}
+    misses: dict = {}
+    for addr in addresses:
+        if not addr:
+            continue
+        key = _normalize_address(addr)
+        if key in resolved or key in misses:
+            continue
+        cached = _GEOCODE_CACHE.get(key)
+        if cached is not MISS:
+            resolved[key] = tuple(cached) if cached else None
+        else:
+            misses[key] = _NOMINATIM_POOL.submit(metrics.bind(_resolve_geocode), key, addr)
+    if misses:
+        done, pending = wait(misses.values(), timeout=deadline_s)
+        for f in pending:
+            f.cancel()  # a later call re-queues it; the running one still fills the cache
+        for key, f in misses.items():
+            if f in done:
+                resolved[key] = f.result() if f.exception() is None else None
+    return {addr: resolved[_normalize_address(addr)]
+            for addr in addresses if addr and _normalize_address(addr) in resolved}
+
 # ---- SODA helpers ----
-def _headers():
-    h = {}
-    return h
+# Base URL (NYC_CRIME_BASE) and X-App-Token (NYC_APP_TOKEN) live on the SODA upstream.
 
 def _date_only(dt: datetime) -> str:
     return dt.strftime("%Y-%m-%d")
@@ -577,13 +1615,19 @@ def _deg_bbox(lat: float, lon: float, radius_m: int) -> Tuple[float, float, floa
     dlon = radius_m / (111320.0 * max(0.1, math.cos(math.radians(lat))))
     return (lat - dlat, lat + dlat, lon - dlon, lon + dlon)
 
-def _crime_count(where: str, timeout=25) -> Optional[int]:
+# Identical in-flight SODA queries (same where-clause) share one request
+_SODA_FLIGHT = SingleFlight("soda")
+
+@metrics.timed("crime_count")
+def _crime_count(where: str, timeout=None) -> Optional[int]:
     """Return count for where-clause (bbox/date only)."""
+    return _SODA_FLIGHT.do(f"count|{where}", lambda: _fetch_crime_count(where, timeout))
+
+def _fetch_crime_count(where: str, timeout=None) -> Optional[int]:
     try:
-        r = requests.get(
-            f"{NYC_CRIME_BASE}/{NYC_CRIME_DATASET}.json",
+        r = SODA.get(
+            f"{NYC_CRIME_DATASET}.json",
             params={"$select": "count(1)", "$where": where},
-            headers=_headers(),
             timeout=timeout,
         )
         r.raise_for_status()
@@ -594,14 +1638,18 @@ def _crime_count(where: str, timeout=25) -> Optional[int]:
     except Exception:
         return None
 
-def _crime_top_offenses(where: str, limit=5, timeout=30) -> List[dict]:
+@metrics.timed("crime_top_offenses")
+def _crime_top_offenses(where: str, limit=5, timeout=None) -> List[dict]:
     """
     Top offense descriptions near the point/window.
     Uses COALESCE to bucket nulls.
     """
+    return _SODA_FLIGHT.do(f"top{limit}|{where}", lambda: _fetch_crime_top_offenses(where, limit, timeout))
+
+def _fetch_crime_top_offenses(where: str, limit=5, timeout=None) -> List[dict]:
     try:
-        r = requests.get(
-            f"{NYC_CRIME_BASE}/{NYC_CRIME_DATASET}.json",
+        r = SODA.get(
+            f"{NYC_CRIME_DATASET}.json",
             params={
                 "$select": "COALESCE(ofns_desc,'Unknown') as offense, count(1) as c",
                 "$where": where,
@@ -609,7 +1657,6 @@ def _crime_top_offenses(where: str, limit=5, timeout=30) -> List[dict]:
                 "$order": "c DESC",
                 "$limit": limit,
             },
-            headers=_headers(),
             timeout=timeout,
         )
         r.raise_for_status()
@@ -643,54 +1690,76 @@ def _where_bbox(lat: float, lon: float, radius_m: int, start: datetime, end: dat
 def _crime_stats_for_point(
     lat: float, lon: float,
     start: datetime, end: datetime,
-    radius_seq: Tuple[int, ...] = (400, 800, 1200),
+    radius_seq: Tuple[int, ...] = CRIME_RADIUS_SEQ,
 ) -> dict:
     """
     Try increasing radii until we find results. Returns compact stats (no samples).
     """
+    index = _get_crime_index()
+    if index is not None:
+        return _local_crime_stats(index, [(lat, lon)], [(start, end)], radius_seq)[0]
+
     for radius_m in radius_seq:
         where_bbox = _where_bbox(lat, lon, radius_m, start, end)
         cnt = _crime_count(where_bbox)
         if cnt is not None and cnt > 0:
-            return {
-                "count": cnt,
-                "window": f"{_date_only(start)}..{_date_only(end)}",
-                "radius_m": radius_m,
-                "top_offenses": _crime_top_offenses(where_bbox),
-                "source": f"NYC Open Data NYPD {NYC_CRIME_DATASET}",
-            }
+            return _crime_stats(cnt, start, end, radius_m, _crime_top_offenses(where_bbox))
 
     # No hits at any radius -> return explicit zero
-    return {
-        "count": 0,
-        "window": f"{_date_only(start)}..{_date_only(end)}",
-        "radius_m": radius_seq[-1] if radius_seq else None,
-        "top_offenses": [],
-        "source": f"NYC Open Data NYPD {NYC_CRIME_DATASET}",
-        "note": "No geocoded matches for this window/radius; dataset may lag or coords missing.",
-    }
+    return _crime_stats(0, start, end, radius_seq[-1] if radius_seq else None, [],
+                        note="No geocoded matches for this window/radius; dataset may lag or coords missing.")
+
+@metrics.timed("crime_index")
+def _local_crime_stats(
+    index,
+    points: List[Tuple[float, float]],
+    windows: List[Tuple[datetime, datetime]],
+    radius_seq: Tuple[int, ...],
+) -> List[dict]:
+    """
+    Stats for many points from one vectorized pass over the local index.
+    Picks the first non-empty (window, radius) cell per point, in the same widening
+    order as the SODA path (window outer, radius inner).
+    """
+    counts, first, tops = index.aggregate(
+        [p[0] for p in points], [p[1] for p in points], windows, radius_seq
+    )
+    source = f"{_CRIME_SOURCE} (local index)"
+    out = []
+    for p, cell in enumerate(first):
+        if cell >= 0:
+            w, r = divmod(int(cell), len(radius_seq))
+            start, end = windows[w]
+            out.append(_crime_stats(int(counts[p, w, r]), start, end, radius_seq[r], tops[p], source))
+        else:
+            start, end = windows[-1]
+            out.append(_crime_stats(0, start, end, radius_seq[-1] if radius_seq else None, [], source,
+                                    "No matches in the local index for this window/radius; it may need a fresh ingest."))
+    return out
+
+def _geocode_failed_stats(base_start: datetime, base_end: datetime, radius_seq: Tuple[int, ...]) -> dict:
+    return _crime_stats(None, base_start, base_end, radius_seq[-1], [],
+                        note="Geocoding failed; cannot compute nearby stats.")
 
 def _adaptive_stats_for_place(
     place: str,
     base_start: datetime, base_end: datetime,
-    radius_seq: Tuple[int, ...] = (400, 800, 1200),
-    lookbacks: Tuple[int, ...] = (45, 180, 365),  # widen window progressively (days)
+    radius_seq: Tuple[int, ...] = CRIME_RADIUS_SEQ,
+    lookbacks: Tuple[int, ...] = CRIME_WIDEN_STEPS,  # widen window progressively (days)
 ) -> dict:
     """
     Geocode place, then try multiple (lookback, radius) combos until we get data.
     """
     geo = _geocode_nominatim(place)
     if not geo:
-        return {
-            "count": None,
-            "window": f"{_date_only(base_start)}..{_date_only(base_end)}",
-            "radius_m": radius_seq[-1],
-            "top_offenses": [],
-            "source": f"NYC Open Data NYPD {NYC_CRIME_DATASET}",
-            "note": "Geocoding failed; cannot compute nearby stats.",
-        }
+        return _geocode_failed_stats(base_start, base_end, radius_seq)
     lat, lon = geo
 
+    index = _get_crime_index()
+    if index is not None:
+        windows = [(base_end - timedelta(days=days), base_end) for days in lookbacks]
+        return _local_crime_stats(index, [geo], windows, radius_seq)[0]
+
     # try from tightest to widest window
     for days in lookbacks:
         start = base_end - timedelta(days=days)
@@ -702,13 +1771,24 @@ def _adaptive_stats_for_place(
     # Nothing even with widest window -> return last attempt with count (0/None) as-is
     return _crime_stats_for_point(lat, lon, base_end - timedelta(days=lookbacks[-1]), base_end, radius_seq)
 
+def _crime_record(leg, from_stats: Optional[dict], to_stats: Optional[dict]) -> dict:
+    return {
+        "sequence": leg.sequence,
+        "fromLocation": leg.fromLocation,
+        "toLocation": leg.toLocation,
+        "fromCrime": from_stats,
+        "toCrime": to_stats,
+    }
+
+@metrics.timed("crime_overlay")
 def build_crime_overlay_by_place(
     trip_request_json: str,
     itin,  # Itinerary Pydantic object from your code
     *,
-    lookback_days_default: int = 45,
-    widen_steps: Tuple[int, ...] = (45, 180, 365),
-    radius_seq: Tuple[int, ...] = (400, 800, 1200),
+    lookback_days_default: int = CRIME_WIDEN_STEPS[0],
+    widen_steps: Tuple[int, ...] = CRIME_WIDEN_STEPS,
+    radius_seq: Tuple[int, ...] = CRIME_RADIUS_SEQ,
+    deadline_s: Optional[float] = OVERLAY_DEADLINE_S,
 ) -> dict:
     """
     Returns a sidecar overlay—does NOT mutate your itinerary.
@@ -733,29 +1813,548 @@ def build_crime_overlay_by_place(
     base_start = req.startTime
     base_end   = getattr(req, "endTime")
 
-    out = {"legCrime": [], "params": {"lookback_days_default": lookback_days_default,
-                                      "widen_steps": list(widen_steps),
-                                      "radius_seq": list(radius_seq)}}
-
-    for leg in (itin.legs or []):
-        from_stats = _adaptive_stats_for_place(
-            leg.fromLocation, base_start, base_end,
-            radius_seq=radius_seq, lookbacks=widen_steps
-        ) if leg.fromLocation else None
-
-        to_stats = _adaptive_stats_for_place(
-            leg.toLocation, base_start, base_end,
-            radius_seq=radius_seq, lookbacks=widen_steps
-        ) if leg.toLocation else None
-
-        out["legCrime"].append({
-            "sequence": leg.sequence,
-            "fromLocation": leg.fromLocation,
-            "toLocation": leg.toLocation,
-            "fromCrime": from_stats,
-            "toCrime": to_stats,
-        })
+    out = _crime_overlay([], widen_steps, radius_seq, lookback_days_default)
+
+    legs = itin.legs or []
+    endpoints = []
+    for leg in legs:
+        endpoints.append(leg.fromLocation)
+        endpoints.append(leg.toLocation)
+
+    index = _get_crime_index()
+    if index is not None:
+        # Only geocoding touches the network; all endpoints are then aggregated at once.
+        # False = geocoding failed; None = no place, or still pending at the deadline.
+        coords = geocode_many(endpoints, deadline_s)
+        geos = [(coords[p] or False) if p in coords else None for p in endpoints]
+        pending = len({_normalize_address(p) for p, g in zip(endpoints, geos) if p and g is None})
+        windows = [(base_end - timedelta(days=days), base_end) for days in widen_steps]
+        # One aggregate row per unique place, fanned back out to every endpoint
+        located = {}
+        for p, g in zip(endpoints, geos):
+            if g:
+                located.setdefault(_normalize_address(p), g)
+        stats = dict(zip(located, _local_crime_stats(index, list(located.values()), windows, radius_seq)))
+        results = [
+            stats[_normalize_address(p)] if g else
+            (_geocode_failed_stats(base_start, base_end, radius_seq) if g is False else None)
+            for p, g in zip(endpoints, geos)
+        ]
+    else:
+        # Resolve every unique address up front through the shared rate limiter;
+        # the per-endpoint searches below then hit the geocode cache.
+        started = time.monotonic()
+        geocode_many(endpoints, deadline_s)
+        if deadline_s is not None:
+            deadline_s = max(0.0, deadline_s - (time.monotonic() - started))
+
+        # One adaptive search per unique place, fanned back out to every endpoint
+        unique = {}
+        for place in endpoints:
+            if place:
+                unique.setdefault(_normalize_address(place), place)
+
+        def _stats_for(place: str) -> dict:
+            return _adaptive_stats_for_place(
+                place, base_start, base_end,
+                radius_seq=radius_seq, lookbacks=widen_steps
+            )
+        found, pending = _fan_out(_stats_for, list(unique.values()), deadline_s)
+        stats = dict(zip(unique, found))
+        results = [stats[_normalize_address(p)] if p else None for p in endpoints]
+
+    for idx, leg in enumerate(legs):
+        out["legCrime"].append(_crime_record(leg, results[2 * idx], results[2 * idx + 1]))
+    if pending:
+        out["note"] = f"Overlay deadline reached; {pending} crime lookups still pending."
 
     return out
 
+# ===================== OVERLAY STAGE ===================== #
+
+class _Memo:
+    """
+    Per-request memo for the per-leg overlay paths: the first task to ask for a key
+    computes it, and tasks for neighbouring legs sharing that endpoint wait and reuse it.
+    """
+
+    def __init__(self):
+        self._futures: dict = {}
+        self._lock = threading.Lock()
+
+    def get(self, key, fn):
+        with self._lock:
+            fut = self._futures.get(key)
+            owner = fut is None
+            if owner:
+                fut = self._futures[key] = Future()
+        if owner:
+            try:
+                fut.set_result(fn())
+            except Exception as e:
+                fut.set_exception(e)
+        return fut.result()
+
+def _weather_place_key(place: Optional[str]) -> Optional[str]:
+    """Forecasts are fetched per city, so every place in the same city shares one."""
+    q = _extract_city_q(place) if place else ""
+    return q.lower() or None
+
+def _weather_leg_record(leg: Leg, dep_dt: datetime, arr_dt: datetime, interpolate: bool,
+                        memo: Optional[_Memo] = None) -> dict:
+    memo = memo or _Memo()
+
+    def _at(place: str, when: datetime) -> Optional[dict]:
+        city = _weather_place_key(place)
+        if not city:
+            return None
+        series = memo.get(("series", city), lambda: _forecast_series_by_place(place))
+        return memo.get(("pick", city, when.replace(second=0, microsecond=0)),
+                        lambda: _pick_closest(series, when, interpolate))
+
+    return _weather_record(leg, dep_dt, arr_dt, _at(leg.fromLocation, dep_dt), _at(leg.toLocation, arr_dt))
+
+def _crime_leg_record(leg: Leg, base_start: datetime, base_end: datetime,
+                      widen_steps: Tuple[int, ...], radius_seq: Tuple[int, ...],
+                      memo: Optional[_Memo] = None) -> dict:
+    memo = memo or _Memo()
+    stats = [
+        memo.get(("crime", _normalize_address(place)), lambda place=place: _adaptive_stats_for_place(
+            place, base_start, base_end, radius_seq=radius_seq, lookbacks=widen_steps))
+        if place else None
+        for place in (leg.fromLocation, leg.toLocation)
+    ]
+    return _crime_record(leg, *stats)
+
+OVERLAY_GRACE_S = 0.25  # a stage that hit its deadline still needs a moment to assemble its overlay
+
+def _timed_out_overlay(kind: str, trip_request_json: str, itin: Itinerary) -> dict:
+    """Overlay with every leg unresolved, for a stage that missed the deadline (e.g. queued behind other requests)."""
+    note = "Overlay deadline reached before this stage finished; all legs pending."
+    if kind == "weather":
+        if not WEATHER_API_KEY:
+            return {"legWeather": [], "note": "No WEATHER_API_KEY; overlay skipped."}
+        resolved = _ensure_leg_times(TripRequest(**json.loads(trip_request_json)), itin)
+        return {"legWeather": [_weather_record(leg, dep, arr, None, None) for leg, dep, arr in resolved],
+                "note": note}
+    return dict(_crime_overlay([_crime_record(leg, None, None) for leg in itin.legs or []]), note=note)
+
+def _submit_stages(trip_request_json: str, itin: Itinerary, deadline_s: Optional[float]) -> list:
+    """
+    Queue both overlay stages. The deadline runs from now, not from when a stage worker
+    picks the task up: a stage that starts late only gets the time that is left.
+    Returns [(kind, future)] and the absolute deadline (None without one).
+    """
+    deadline = None if deadline_s is None else time.monotonic() + deadline_s
+
+    def stage(fn):
+        remaining = None if deadline is None else max(0.0, deadline - time.monotonic())
+        return fn(trip_request_json, itin, deadline_s=remaining)
+
+    return [(kind, _STAGE_POOL.submit(metrics.bind(stage), fn)) for kind, fn in
+            (("weather", build_weather_overlay_by_place), ("crime", build_crime_overlay_by_place))], deadline
+
+def build_overlays(
+    trip_request_json: str,
+    itin: Itinerary,
+    *,
+    deadline_s: Optional[float] = OVERLAY_DEADLINE_S,
+) -> Tuple[dict, dict]:
+    """
+    Run the weather and crime overlays side by side once the base plan exists.
+    deadline_s bounds the whole call, queueing for a stage worker included; each overlay
+    returns whatever has resolved by then (all legs pending if its stage never ran).
+    Returns (weather_overlay, crime_overlay).
+    """
+    stages, deadline = _submit_stages(trip_request_json, itin, deadline_s)
+    out = []
+    for kind, fut in stages:
+        timeout = None if deadline is None else max(0.0, deadline - time.monotonic()) + OVERLAY_GRACE_S
+        try:
+            out.append(fut.result(timeout=timeout))
+        except FuturesTimeout:
+            fut.cancel()
+            out.append(_timed_out_overlay(kind, trip_request_json, itin))
+    return out[0], out[1]
+
+async def abuild_overlays(
+    trip_request_json: str,
+    itin: Itinerary,
+    *,
+    deadline_s: Optional[float] = OVERLAY_DEADLINE_S,
+) -> Tuple[dict, dict]:
+    """build_overlays for the ASGI app: the stages run on the overlay pools and are awaited, not joined."""
+    stages, deadline = _submit_stages(trip_request_json, itin, deadline_s)
+    timeout = None if deadline is None else max(0.0, deadline - time.monotonic()) + OVERLAY_GRACE_S
+    await asyncio.wait([asyncio.wrap_future(fut) for _, fut in stages], timeout=timeout)
+    out = []
+    for kind, fut in stages:
+        if fut.done() and not fut.cancelled():
+            out.append(fut.result())
+        else:
+            fut.cancel()
+            out.append(_timed_out_overlay(kind, trip_request_json, itin))
+    return out[0], out[1]
+
+def stream_overlays(
+    trip_request_json: str,
+    itin: Itinerary,
+    *,
+    deadline_s: Optional[float] = OVERLAY_DEADLINE_S,
+    interpolate: bool = WEATHER_INTERPOLATE,
+    widen_steps: Tuple[int, ...] = CRIME_WIDEN_STEPS,
+    radius_seq: Tuple[int, ...] = CRIME_RADIUS_SEQ,
+):
+    """
+    Incremental form of build_overlays for streaming clients. Yields
+        ("legWeather", index, record) / ("legCrime", index, record)
+    as each leg resolves (any order), then
+        ("summary", None, {"weather_overlay": {...}, "crime_overlay": {...}})
+    with both overlays in the same shape build_overlays returns.
+    """
+    req = TripRequest(**json.loads(trip_request_json))
+    resolved = _ensure_leg_times(req, itin)
+    base_start, base_end = req.startTime, getattr(req, "endTime")
+
+    memo = _Memo()  # shared endpoints of neighbouring legs are resolved once
+    futures = {}
+    for i, (leg, dep_dt, arr_dt) in enumerate(resolved):
+        if WEATHER_API_KEY:
+            futures[_OVERLAY_POOL.submit(metrics.bind(_weather_leg_record), leg, dep_dt, arr_dt, interpolate, memo)] = ("legWeather", i)
+        futures[_OVERLAY_POOL.submit(metrics.bind(_crime_leg_record), leg, base_start, base_end,
+                                     widen_steps, radius_seq, memo)] = ("legCrime", i)
 
+    records = {"legWeather": {}, "legCrime": {}}
+    try:
+        for f in as_completed(futures, timeout=deadline_s):
+            kind, i = futures[f]
+            if f.exception() is None:
+                records[kind][i] = f.result()
+                yield kind, i, records[kind][i]
+    except FuturesTimeout:
+        for f in futures:
+            f.cancel()
+
+    weather_pending = sum(1 for k, _ in futures.values() if k == "legWeather") - len(records["legWeather"])
+    crime_pending   = sum(1 for k, _ in futures.values() if k == "legCrime") - len(records["legCrime"])
+
+    if WEATHER_API_KEY:
+        weather = {"legWeather": [
+            records["legWeather"].get(i) or _weather_record(leg, dep_dt, arr_dt, None, None)
+            for i, (leg, dep_dt, arr_dt) in enumerate(resolved)
+        ]}
+        if weather_pending:
+            weather["note"] = f"Overlay deadline reached; {weather_pending} legs still pending."
+    else:
+        weather = {"legWeather": [], "note": "No WEATHER_API_KEY; overlay skipped."}
+
+    crime = _crime_overlay([records["legCrime"].get(i) or _crime_record(leg, None, None)
+                            for i, (leg, _, _) in enumerate(resolved)], widen_steps, radius_seq)
+    if crime_pending:
+        crime["note"] = f"Overlay deadline reached; {crime_pending} legs still pending."
+
+    yield "summary", None, {"weather_overlay": weather, "crime_overlay": crime}
+
+def _leg_places(from_loc: Optional[str], to_loc: Optional[str]) -> tuple:
+    return (_normalize_address(from_loc or ""), _normalize_address(to_loc or ""))
+
+def refresh_overlays(
+    trip_request_json: str,
+    new_itin: Itinerary,
+    old_weather: Optional[dict],
+    old_crime: Optional[dict],
+    changes: Optional[List["ChangeItem"]] = None,
+    *,
+    deadline_s: Optional[float] = OVERLAY_DEADLINE_S,
+    interpolate: bool = WEATHER_INTERPOLATE,
+) -> Tuple[dict, dict, dict]:
+    """
+    Overlays for a replanned itinerary, reusing records of legs that did not change.
+
+    A weather record is reused when (fromLocation, toLocation, depart, arrive) match an
+    old record; a crime record when (fromLocation, toLocation) match, since crime stats
+    only depend on the places and the trip window. Legs named by a ChangeItem
+    (new_sequence / after) are always recomputed.
+    Returns (weather_overlay, crime_overlay, {"reused": n, "recomputed": m}).
+    """
+    req = TripRequest(**json.loads(trip_request_json))
+    resolved = _ensure_leg_times(req, new_itin)
+    base_start, base_end = req.startTime, getattr(req, "endTime")
+    params = (old_crime or {}).get("params") or {}
+    widen_steps = tuple(params.get("widen_steps") or CRIME_WIDEN_STEPS)
+    radius_seq  = tuple(params.get("radius_seq") or CRIME_RADIUS_SEQ)
+
+    old_w = {}
+    for rec in (old_weather or {}).get("legWeather") or []:
+        if rec and (rec.get("departWeather") or rec.get("arriveWeather")):
+            key = _leg_places(rec.get("fromLocation"), rec.get("toLocation")) + (rec.get("departTime"), rec.get("arriveTime"))
+            old_w[key] = rec
+    old_c = {}
+    for rec in (old_crime or {}).get("legCrime") or []:
+        if rec and (rec.get("fromCrime") or rec.get("toCrime")):
+            old_c[_leg_places(rec.get("fromLocation"), rec.get("toLocation"))] = rec
+
+    touched = set()
+    for ch in changes or []:
+        if ch.new_sequence is not None:
+            touched.add(ch.new_sequence)
+        if ch.after is not None:
+            touched.add(_leg_places(ch.after.fromLocation, ch.after.toLocation))
+
+    weather_recs, crime_recs, todo = [], [], []
+    for i, (leg, dep_dt, arr_dt) in enumerate(resolved):
+        places = _leg_places(leg.fromLocation, leg.toLocation)
+        forced = leg.sequence in touched or places in touched
+        w = None if forced else old_w.get(places + (dep_dt.isoformat(), arr_dt.isoformat()))
+        c = None if forced else old_c.get(places)
+        weather_recs.append(dict(w, sequence=leg.sequence) if w else None)
+        crime_recs.append(dict(c, sequence=leg.sequence) if c else None)
+        if WEATHER_API_KEY and w is None:
+            todo.append(("legWeather", i))
+        if c is None:
+            todo.append(("legCrime", i))
+
+    memo = _Memo()
+
+    def _compute(task):
+        kind, i = task
+        leg, dep_dt, arr_dt = resolved[i]
+        if kind == "legWeather":
+            return _weather_leg_record(leg, dep_dt, arr_dt, interpolate, memo)
+        return _crime_leg_record(leg, base_start, base_end, widen_steps, radius_seq, memo)
+
+    results, pending = _fan_out(_compute, todo, deadline_s)
+    for (kind, i), rec in zip(todo, results):
+        leg, dep_dt, arr_dt = resolved[i]
+        if kind == "legWeather":
+            weather_recs[i] = rec or _weather_record(leg, dep_dt, arr_dt, None, None)
+        else:
+            crime_recs[i] = rec or _crime_record(leg, None, None)
+
+    if WEATHER_API_KEY:
+        weather = {"legWeather": weather_recs}
+    else:
+        weather = {"legWeather": [], "note": "No WEATHER_API_KEY; overlay skipped."}
+    crime = _crime_overlay(crime_recs, widen_steps, radius_seq)
+    if pending:
+        note = f"Overlay deadline reached; {pending} lookups still pending."
+        weather.setdefault("note", note)
+        crime["note"] = note
+
+    total = (2 if WEATHER_API_KEY else 1) * len(resolved)
+    return weather, crime, {"reused": total - len(todo), "recomputed": len(todo)}
+
+async def arefresh_overlays(*args, **kwargs) -> Tuple[dict, dict, dict]:
+    """refresh_overlays for the ASGI app, run on the stage pool and awaited."""
+    return await asyncio.wrap_future(_STAGE_POOL.submit(metrics.bind(refresh_overlays), *args, **kwargs))
+
+# ===================== BATCH PLANNING ===================== #
+# Many trips in one call (tour groups, pre-generated hotel guest plans). All requests
+# are validated up front; identical trips (same plan cache key) share one Gemini call
+# and cache hits skip it; the rest go through the structured model's batch interface
+# with at most BATCH_MAX_CONCURRENCY calls in flight. Overlays start only once every
+# plan is in, so each distinct place in the whole batch is geocoded and each city's
+# forecast fetched once; the per-trip overlays then read those from the caches.
+
+BATCH_MAX_TRIPS       = int(os.getenv("BATCH_MAX_TRIPS", "200"))
+BATCH_MAX_CONCURRENCY = int(os.getenv("BATCH_MAX_CONCURRENCY", "8"))
+# Overlay pool workers the batch-wide forecast prefetch may hold at once
+BATCH_PREFETCH_WORKERS = max(1, int(os.getenv("BATCH_PREFETCH_WORKERS", str(OVERLAY_MAX_WORKERS // 4))))
+
+_BATCH_POOL = ThreadPoolExecutor(max_workers=BATCH_MAX_CONCURRENCY, thread_name_prefix="batch-trip")
+
+def _validate_batch(requests: list) -> Tuple[dict, list]:
+    """({index: TripRequest} for valid requests, [(index, error)] for the rest)."""
+    trips, invalid = {}, []
+    for i, data in enumerate(requests):
+        try:
+            if not isinstance(data, dict):
+                raise ValueError("trip request must be a JSON object")
+            trips[i] = TripRequest(**data)
+        except Exception as e:
+            invalid.append((i, str(e)))
+    return trips, invalid
+
+def _batch_groups(trips: dict, use_cache: bool) -> Tuple[dict, dict]:
+    """
+    ({index: cached plan}, {group key: [indexes]}). Trips with the same plan cache key
+    form one group and one LLM call; without the cache every trip is its own group.
+    """
+    cached, groups = {}, {}
+    for i, trip in trips.items():
+        if not use_cache:
+            groups[i] = [i]
+            continue
+        key = _plan_cache_key(trip)
+        if key in groups:
+            groups[key].append(i)
+            continue
+        plan = _cached_plan(trip)
+        if plan is not None:
+            cached[i] = plan
+        else:
+            groups[key] = [i]
+    return cached, groups
+
+def _batch_fanout(trips: dict, idxs: list, itinerary: Itinerary, use_cache: bool) -> dict:
+    """{index: plan} for one group: the leader's plan, repaired and cached, re-timed for each member."""
+    leader = trips[idxs[0]]
+    plan = _finalize_plan(leader, itinerary)
+    if use_cache:
+        _store_plan(leader, plan)
+    shared = (plan.model_dump(mode="json"), leader.startTime.isoformat())
+    return {i: plan if i == idxs[0] else _shared_plan(trips[i], shared) for i in idxs}
+
+def _batch_config(max_concurrency: int) -> dict:
+    _, _, config = _llm_clients()
+    return dict(config or {}, max_concurrency=max_concurrency)
+
+@metrics.timed("batch.prefetch")
+def prefetch_places(plans, deadline_s: Optional[float] = OVERLAY_DEADLINE_S) -> dict:
+    """
+    Warm the geocode and forecast caches for every leg endpoint across `plans`:
+    each distinct address is geocoded once and each city's forecast fetched once.
+    Returns {"places": distinct addresses, "cities": distinct forecast cities}.
+    """
+    places = list(dict.fromkeys(p for itin in plans for leg in itin.legs
+                                for p in (leg.fromLocation, leg.toLocation) if p))
+    cities: dict = {}
+    if WEATHER_API_KEY:
+        for place in places:
+            city = _weather_place_key(place)
+            if city:
+                cities.setdefault(city, place)
+    # Forecasts take at most BATCH_PREFETCH_WORKERS overlay workers; geocodes queue on
+    # the single Nominatim worker. Either way interactive overlays keep their slots.
+    weather_f = _STAGE_POOL.submit(metrics.bind(_fan_out), _owm_forecast_blocks_by_place,
+                                   list(cities.values()), deadline_s, BATCH_PREFETCH_WORKERS)
+    geocode_many(places, deadline_s)
+    weather_f.result()
+    return {"places": len({_normalize_address(p) for p in places}), "cities": len(cities)}
+
+def batch_event(kind: str, index: Optional[int], payload: dict, trip_id: Optional[str] = None) -> dict:
+    """One plan_batch item as an NDJSON record: {"event", "index"?, "trip_id"?, **payload}."""
+    event = {"event": kind}
+    if index is not None:
+        event["index"] = index
+    if trip_id:
+        event["trip_id"] = trip_id
+    return {**event, **payload}
+
+def _batch_summary(requests: list, stats: dict, started: float) -> dict:
+    return dict(stats, trips=len(requests), seconds=round(time.perf_counter() - started, 3))
+
+def plan_batch(
+    requests: list,
+    *,
+    max_concurrency: int = BATCH_MAX_CONCURRENCY,
+    use_cache: bool = True,
+    overlays: bool = True,
+    deadline_s: Optional[float] = OVERLAY_DEADLINE_S,
+):
+    """
+    Plan a list of TripRequest dicts. Yields (kind, index, payload), index being the
+    position in `requests`:
+        ("invalid", i, {"error": ...})             failed validation (yielded first)
+        ("plan", i, {"base_plan": {...}})          as each plan arrives (cache hits first)
+        ("error", i, {"error": ...})               this trip's LLM call (or its overlays) failed
+        ("overlays", i, {"weather_overlay": {...}, "crime_overlay": {...}})   unless overlays=False
+        ("summary", None, {...})                   counts and wall time, always last
+    """
+    started = time.perf_counter()
+    trips, invalid = _validate_batch(requests)
+    for i, error in invalid:
+        yield "invalid", i, {"error": error}
+
+    cached, groups = _batch_groups(trips, use_cache)
+    plans = dict(cached)
+    for i, itin in cached.items():
+        yield "plan", i, {"base_plan": itin.model_dump(mode="json")}
+
+    stats = {"planned": 0, "invalid": len(invalid), "failed": 0, "cache_hits": len(cached),
+             "llm_calls": len(groups), "unique_places": 0}
+    if groups:
+        planner, _, _ = _llm_clients()
+        members = list(groups.values())
+        inputs = [_planner_messages(trips[idxs[0]]) for idxs in members]
+        with metrics.span("llm.plan_batch"):
+            for n, out in planner.batch_as_completed(inputs, _batch_config(max_concurrency),
+                                                     return_exceptions=True):
+                if isinstance(out, Exception):
+                    stats["failed"] += len(members[n])
+                    for i in members[n]:
+                        yield "error", i, {"error": str(out)}
+                    continue
+                for i, itin in _batch_fanout(trips, members[n], out, use_cache).items():
+                    plans[i] = itin
+                    yield "plan", i, {"base_plan": itin.model_dump(mode="json")}
+    stats["planned"] = len(plans)
+
+    if overlays and plans:
+        stats["unique_places"] = prefetch_places(plans.values(), deadline_s)["places"]
+        futures = {_BATCH_POOL.submit(metrics.bind(build_overlays), json.dumps(requests[i]), itin,
+                                      deadline_s=deadline_s): i for i, itin in plans.items()}
+        for f in as_completed(futures):
+            if f.exception() is not None:
+                yield "error", futures[f], {"error": f"overlays: {f.exception()}"}
+                continue
+            weather, crime = f.result()
+            yield "overlays", futures[f], {"weather_overlay": weather, "crime_overlay": crime}
+
+    yield "summary", None, _batch_summary(requests, stats, started)
+
+async def aplan_batch(
+    requests: list,
+    *,
+    max_concurrency: int = BATCH_MAX_CONCURRENCY,
+    use_cache: bool = True,
+    overlays: bool = True,
+    deadline_s: Optional[float] = OVERLAY_DEADLINE_S,
+):
+    """plan_batch for the ASGI app: Gemini calls go through abatch_as_completed and overlays are awaited."""
+    started = time.perf_counter()
+    trips, invalid = _validate_batch(requests)
+    for i, error in invalid:
+        yield "invalid", i, {"error": error}
+
+    cached, groups = _batch_groups(trips, use_cache)
+    plans = dict(cached)
+    for i, itin in cached.items():
+        yield "plan", i, {"base_plan": itin.model_dump(mode="json")}
+
+    stats = {"planned": 0, "invalid": len(invalid), "failed": 0, "cache_hits": len(cached),
+             "llm_calls": len(groups), "unique_places": 0}
+    if groups:
+        planner, _, _ = _llm_clients()
+        members = list(groups.values())
+        inputs = [_planner_messages(trips[idxs[0]]) for idxs in members]
+        with metrics.span("llm.plan_batch"):
+            async for n, out in planner.abatch_as_completed(inputs, _batch_config(max_concurrency),
+                                                            return_exceptions=True):
+                if isinstance(out, Exception):
+                    stats["failed"] += len(members[n])
+                    for i in members[n]:
+                        yield "error", i, {"error": str(out)}
+                    continue
+                for i, itin in _batch_fanout(trips, members[n], out, use_cache).items():
+                    plans[i] = itin
+                    yield "plan", i, {"base_plan": itin.model_dump(mode="json")}
+    stats["planned"] = len(plans)
+
+    if overlays and plans:
+        prefetched = await asyncio.to_thread(prefetch_places, list(plans.values()), deadline_s)
+        stats["unique_places"] = prefetched["places"]
+
+        async def one(i, itin):
+            try:
+                return i, await abuild_overlays(json.dumps(requests[i]), itin, deadline_s=deadline_s), None
+            except Exception as e:
+                return i, None, e
+        for coro in asyncio.as_completed([one(i, itin) for i, itin in plans.items()]):
+            i, result, error = await coro
+            if error is not None:
+                yield "error", i, {"error": f"overlays: {error}"}
+                continue
+            yield "overlays", i, {"weather_overlay": result[0], "crime_overlay": result[1]}
+
+    yield "summary", None, _batch_summary(requests, stats, started)
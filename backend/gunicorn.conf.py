@@ -0,0 +1,19 @@
+# gunicorn.conf.py
+"""
+    gunicorn app:app -c gunicorn.conf.py
+
+Builds the Gemini client and loads the crime index in every worker right after
+fork (event_planner.warm_up), so the first request a worker serves doesn't pay
+for them and no gRPC channel is shared between processes.
+"""
+import os
+
+bind = os.getenv("BIND", "0.0.0.0:5000")
+workers = int(os.getenv("WEB_CONCURRENCY", "2"))
+threads = int(os.getenv("WEB_THREADS", "8"))
+timeout = 120
+
+
+def post_fork(server, worker):
+    from event_planner import warm_up
+    server.log.info("worker %s warm-up: %s", worker.pid, warm_up())
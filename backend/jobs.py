@@ -0,0 +1,157 @@
+# jobs.py
+"""
+Background job queue for long-running pipeline work (plan + overlays).
+
+- Jobs are queued in memory and run on a small worker thread pool (JOB_WORKERS).
+- Scheduling: strict priority between classes ("high" > "normal" > "low"), and
+  round-robin across clients within a class, so a client that submits a burst only
+  gets every Nth slot instead of the whole queue.
+- Each client may hold at most JOB_MAX_PENDING_PER_CLIENT queued/running jobs. The
+  caller keys clients by something the requester cannot pick (the peer address).
+- "high" priority is granted by configuration (JOB_HIGH_PRIORITY_CLIENTS), never by
+  the request; everyone else may only opt down to "low".
+- Job status and results live in a TTLCache ("jobs" namespace), so they survive a
+  restart of the process that serves the status endpoint for JOB_RESULT_TTL_S.
+- The queue itself is in memory, so a restart loses queued and running jobs. Each
+  record names the queue that owns it, and every queue keeps a heartbeat key fresh
+  while it runs; a queued/running job whose owner's heartbeat has lapsed is marked
+  "error" (interrupted) the next time its status is read, by any worker.
+"""
+import os, time, uuid, threading
+from collections import OrderedDict, deque
+from typing import Any, Callable, Optional
+
+from cache_store import TTLCache, MISS
+
+JOB_WORKERS                = int(os.getenv("JOB_WORKERS", "4"))
+JOB_MAX_PENDING_PER_CLIENT = int(os.getenv("JOB_MAX_PENDING_PER_CLIENT", "5"))
+JOB_RESULT_TTL_S           = float(os.getenv("JOB_RESULT_TTL_S", "3600"))
+JOB_HEARTBEAT_S            = float(os.getenv("JOB_HEARTBEAT_S", "15"))
+# Comma-separated client keys (peer IPs) whose jobs run at "high" priority
+JOB_HIGH_PRIORITY_CLIENTS  = frozenset(c.strip() for c in os.getenv("JOB_HIGH_PRIORITY_CLIENTS", "").split(",") if c.strip())
+
+PRIORITIES = ("high", "normal", "low")
+
+
+class QueueFull(Exception):
+    """The client already has JOB_MAX_PENDING_PER_CLIENT jobs queued or running."""
+
+
+def job_priority(client: str, requested: Optional[str] = None) -> str:
+    """Priority for a client's job: "high" if configured for it, else "low" if asked for, else "normal"."""
+    if requested is not None and requested not in PRIORITIES:
+        raise ValueError(f"priority must be one of {PRIORITIES}")
+    if client in JOB_HIGH_PRIORITY_CLIENTS:
+        return "high"
+    return "low" if requested == "low" else "normal"
+
+
+class JobQueue:
+    def __init__(self, workers: int = JOB_WORKERS, max_pending_per_client: int = JOB_MAX_PENDING_PER_CLIENT):
+        self.max_pending_per_client = max_pending_per_client
+        # priority -> client -> deque of (job_id, fn, args); OrderedDict order is the round-robin turn
+        self._queues = {p: OrderedDict() for p in PRIORITIES}
+        self._pending = {}  # client -> queued + running count
+        self._cond = threading.Condition()
+        self._status = TTLCache("jobs", max_items=4096)
+        self.owner = uuid.uuid4().hex  # this queue instance; dies with the process
+        self._beat()
+        self._workers = [threading.Thread(target=self._work, name=f"job-worker-{i}", daemon=True)
+                         for i in range(workers)]
+        self._workers.append(threading.Thread(target=self._heartbeat, name="job-heartbeat", daemon=True))
+        for t in self._workers:
+            t.start()
+
+    def submit(self, fn: Callable[..., Any], *args, client: str = "anonymous", priority: str = "normal") -> str:
+        """Queue fn(*args); returns the job id. Raises QueueFull / ValueError."""
+        if priority not in PRIORITIES:
+            raise ValueError(f"priority must be one of {PRIORITIES}")
+        job_id = uuid.uuid4().hex
+        with self._cond:
+            if self._pending.get(client, 0) >= self.max_pending_per_client:
+                raise QueueFull(f"client has {self.max_pending_per_client} jobs pending")
+            self._pending[client] = self._pending.get(client, 0) + 1
+            self._queues[priority].setdefault(client, deque()).append((job_id, fn, args))
+            self._set(job_id, {"status": "queued", "priority": priority, "submitted_at": time.time(),
+                               "owner": self.owner})
+            self._cond.notify()
+        return job_id
+
+    def status(self, job_id: str) -> Optional[dict]:
+        """Job record ({"status": queued|running|done|error, ...}) or None if unknown/expired."""
+        record = self._status.get(job_id)
+        if record is MISS:
+            return None
+        if record["status"] in ("queued", "running") and self._orphaned(record):
+            record = dict(record, status="error", finished_at=time.time(),
+                          error="Job was interrupted by a server restart; please resubmit it.")
+            self._set(job_id, record)
+        if record["status"] == "queued":
+            record = dict(record, position=self._position(job_id))
+        return record
+
+    def _beat(self) -> None:
+        self._status.set(f"owner:{self.owner}", time.time(), 3 * JOB_HEARTBEAT_S)
+
+    def _heartbeat(self) -> None:
+        while True:
+            time.sleep(JOB_HEARTBEAT_S)
+            self._beat()
+
+    def _orphaned(self, record: dict) -> bool:
+        """True if the queue that owns this job is gone (its process restarted or died)."""
+        owner = record.get("owner")
+        if owner == self.owner:
+            return False
+        return not owner or self._status.get(f"owner:{owner}") is MISS
+
+    def _set(self, job_id: str, record: dict) -> None:
+        self._status.set(job_id, record, JOB_RESULT_TTL_S)
+
+    def _position(self, job_id: str) -> Optional[int]:
+        """Approximate number of jobs that will start before this one."""
+        with self._cond:
+            ahead = 0
+            for priority in PRIORITIES:
+                for q in self._queues[priority].values():
+                    for i, (jid, _, _) in enumerate(q):
+                        if jid == job_id:
+                            return ahead + i
+                    ahead += len(q)
+        return None
+
+    def _next(self):
+        """Pop the next job: highest priority class first, then the client whose turn it is."""
+        for priority in PRIORITIES:
+            clients = self._queues[priority]
+            if not clients:
+                continue
+            client, q = next(iter(clients.items()))
+            job = q.popleft()
+            del clients[client]
+            if q:
+                clients[client] = q  # back of the line for this client
+            return client, job
+        return None
+
+    def _work(self) -> None:
+        while True:
+            with self._cond:
+                picked = self._next()
+                while picked is None:
+                    self._cond.wait()
+                    picked = self._next()
+            client, (job_id, fn, args) = picked
+            record = self._status.get(job_id)
+            record = dict({} if record is MISS else record, status="running", started_at=time.time())
+            self._set(job_id, record)
+            try:
+                result = fn(*args)
+                self._set(job_id, dict(record, status="done", finished_at=time.time(), result=result))
+            except Exception as e:
+                self._set(job_id, dict(record, status="error", finished_at=time.time(), error=str(e)))
+            finally:
+                with self._cond:
+                    self._pending[client] -= 1
+                    if not self._pending[client]:
+                        del self._pending[client]
@@ -0,0 +1,252 @@
+# metrics.py
+"""
+Per-stage tracing and Prometheus-style metrics for the planning pipeline.
+
+- `span(name)` / `@timed(name)` time a block or function. Every span feeds a
+  process-wide histogram and, while a request trace is active, the request's own
+  breakdown (calls and cumulative time per span name).
+- `count(name, n)` adds to a per-request and process-wide counter (cache hits,
+  LLM tokens, ...).
+- The active trace lives in a ContextVar; `bind(fn)` carries it into pool threads
+  so overlay lookups still land on the request that started them.
+- `render()` returns the Prometheus text format for GET /metrics, including the
+  collectors other modules register (plan cache, upstreams, caches, single-flight).
+- `server_timing()` formats a trace as a `Server-Timing` response header.
+
+METRICS_ENABLED=false makes span/count/bind no-ops and `timed` returns the function
+unchanged, so the hot path pays nothing.
+"""
+import os, time, inspect, functools, threading
+from contextvars import ContextVar, copy_context
+from typing import Callable, Dict, Optional
+
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "true").lower() in ("1", "true", "yes")
+# Send Server-Timing on every response; otherwise only when the request carries `X-Timing: 1`
+TIMING_HEADER   = os.getenv("TIMING_HEADER", "false").lower() in ("1", "true", "yes")
+METRICS_PREFIX  = "travelbuddy"
+
+_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+_LOCK = threading.Lock()
+_HISTOGRAMS: Dict[str, list] = {}   # span name -> [bucket counts..., +Inf count, sum]
+_COUNTERS: Dict[str, float] = {}
+_COLLECTORS: Dict[str, Callable[[], dict]] = {}
+
+
+class Trace:
+    """Timing breakdown of one request: span name -> [calls, seconds], counter name -> total."""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.spans: Dict[str, list] = {}
+        self.counters: Dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    def add_span(self, name: str, seconds: float) -> None:
+        with self._lock:
+            entry = self.spans.setdefault(name, [0, 0.0])
+            entry[0] += 1
+            entry[1] += seconds
+
+    def add_count(self, name: str, n: float) -> None:
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def as_dict(self) -> dict:
+        with self._lock:
+            return {
+                "total_ms": round((time.perf_counter() - self.started) * 1000, 1),
+                "spans": {k: {"calls": c, "ms": round(s * 1000, 1)} for k, (c, s) in self.spans.items()},
+                "counters": dict(self.counters),
+            }
+
+
+_CURRENT: ContextVar[Optional[Trace]] = ContextVar("trace", default=None)
+
+
+def _observe(name: str, seconds: float) -> None:
+    with _LOCK:
+        h = _HISTOGRAMS.get(name)
+        if h is None:
+            h = _HISTOGRAMS[name] = [0] * (len(_BUCKETS) + 1) + [0.0]
+        for i, bound in enumerate(_BUCKETS):
+            if seconds <= bound:
+                h[i] += 1
+        h[len(_BUCKETS)] += 1
+        h[-1] += seconds
+
+
+class _Span:
+    __slots__ = ("name", "t0")
+
+    def __init__(self, name: str):
+        self.name = name
+
+    def __enter__(self):
+        self.t0 = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        seconds = time.perf_counter() - self.t0
+        _observe(self.name, seconds)
+        trace = _CURRENT.get()
+        if trace is not None:
+            trace.add_span(self.name, seconds)
+        return False
+
+
+class _NoopSpan:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NOOP = _NoopSpan()
+
+
+def span(name: str):
+    """Context manager timing a block under `name`."""
+    return _Span(name) if METRICS_ENABLED else _NOOP
+
+
+def timed(name: str):
+    """Decorator form of span(); works for plain and async functions."""
+    def wrap(fn):
+        if not METRICS_ENABLED:
+            return fn
+        if inspect.iscoroutinefunction(fn):
+            @functools.wraps(fn)
+            async def async_inner(*args, **kwargs):
+                with _Span(name):
+                    return await fn(*args, **kwargs)
+            return async_inner
+
+        @functools.wraps(fn)
+        def inner(*args, **kwargs):
+            with _Span(name):
+                return fn(*args, **kwargs)
+        return inner
+    return wrap
+
+
+def count(name: str, n: float = 1) -> None:
+    if not METRICS_ENABLED or not n:
+        return
+    with _LOCK:
+        _COUNTERS[name] = _COUNTERS.get(name, 0) + n
+    trace = _CURRENT.get()
+    if trace is not None:
+        trace.add_count(name, n)
+
+
+def trace_count(name: str, n: float = 1) -> None:
+    """Per-request counter only (for stats a collector already exports process-wide)."""
+    if not METRICS_ENABLED:
+        return
+    trace = _CURRENT.get()
+    if trace is not None:
+        trace.add_count(name, n)
+
+
+def bind(fn: Callable) -> Callable:
+    """fn wrapped to run in the caller's context (for pool.submit), so spans reach its trace."""
+    if not METRICS_ENABLED or _CURRENT.get() is None:
+        return fn
+    ctx = copy_context()
+    return functools.partial(ctx.run, fn)
+
+
+# ---- request traces ----
+def start_trace():
+    """Begin a request trace; returns a token for end_trace (None when disabled)."""
+    if not METRICS_ENABLED:
+        return None
+    return _CURRENT.set(Trace())
+
+
+def current_trace() -> Optional[Trace]:
+    return _CURRENT.get()
+
+
+def end_trace(token) -> Optional[Trace]:
+    if token is None:
+        return None
+    trace = _CURRENT.get()
+    try:
+        _CURRENT.reset(token)
+    except ValueError:  # finished in a different context than it started (some ASGI servers)
+        _CURRENT.set(None)
+    return trace
+
+
+def wants_timing(headers) -> bool:
+    return METRICS_ENABLED and (TIMING_HEADER or headers.get("X-Timing") in ("1", "true"))
+
+
+def server_timing(trace: Trace) -> str:
+    """`Server-Timing` value: one entry per span (calls in desc, cumulative ms), counters as desc only."""
+    d = trace.as_dict()
+    parts = [f'total;dur={d["total_ms"]}']
+    parts += [f'{k};dur={v["ms"]};desc="{v["calls"]}x"' for k, v in d["spans"].items()]
+    parts += [f'{k};desc="{v:g}"' for k, v in d["counters"].items()]
+    return ", ".join(parts)
+
+
+# ---- Prometheus exposition ----
+def register_collector(name: str, fn: Callable[[], dict]) -> None:
+    """
+    fn() returns either {metric: number} or {label: {metric: number}}; exported as
+    <prefix>_<name>_<metric>[{name="<label>"}] gauges at scrape time. Non-numeric values are skipped.
+    """
+    _COLLECTORS[name] = fn
+
+
+def _metric_name(*parts: str) -> str:
+    return "_".join(p for p in parts if p).replace(".", "_").replace("-", "_").replace(" ", "_").lower()
+
+
+def _num(v) -> Optional[float]:
+    if isinstance(v, bool):
+        return float(v)
+    return float(v) if isinstance(v, (int, float)) else None
+
+
+def render() -> str:
+    lines = []
+    with _LOCK:
+        hists = {k: list(v) for k, v in _HISTOGRAMS.items()}
+        counters = dict(_COUNTERS)
+
+    base = _metric_name(METRICS_PREFIX, "span_seconds")
+    lines += [f"# HELP {base} Time spent per pipeline stage / upstream call.", f"# TYPE {base} histogram"]
+    for name, h in sorted(hists.items()):
+        for bound, n in zip(_BUCKETS, h):
+            lines.append(f'{base}_bucket{{span="{name}",le="{bound:g}"}} {n}')
+        lines.append(f'{base}_bucket{{span="{name}",le="+Inf"}} {h[len(_BUCKETS)]}')
+        lines.append(f'{base}_sum{{span="{name}"}} {h[-1]:.6f}')
+        lines.append(f'{base}_count{{span="{name}"}} {h[len(_BUCKETS)]}')
+
+    for name, v in sorted(counters.items()):
+        metric = _metric_name(METRICS_PREFIX, name, "total")
+        lines += [f"# TYPE {metric} counter", f"{metric} {v:g}"]
+
+    for cname, fn in sorted(_COLLECTORS.items()):
+        try:
+            stats = fn() or {}
+        except Exception:
+            continue
+        families: Dict[str, list] = {}  # one contiguous block per metric family
+        for key, value in sorted(stats.items()):
+            rows = value.items() if isinstance(value, dict) else [(key, value)]
+            for metric, v in rows:
+                v = _num(v)
+                if v is None:
+                    continue
+                full = _metric_name(METRICS_PREFIX, cname, metric)
+                label = f'{{name="{key}"}}' if isinstance(value, dict) else ""
+                families.setdefault(full, []).append(f"{full}{label} {v:g}")
+        for full, rows in families.items():
+            lines += [f"# TYPE {full} gauge", *rows]
+    return "\n".join(lines) + "\n"
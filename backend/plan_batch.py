@@ -0,0 +1,59 @@
+# plan_batch.py
+"""
+Plan many trips from the command line, same pipeline as POST /api/itinerary/batch.
+
+Input is a JSON array of TripRequest objects, {"trips": [...]}, or NDJSON (one trip
+per line), read from a file or stdin. Output is NDJSON: "invalid" / "plan" / "error"
+/ "overlays" events per trip (`index` = position in the input), then one "summary".
+
+Usage:
+    python plan_batch.py trips.json > plans.ndjson
+    cat trips.ndjson | python plan_batch.py --max-concurrency 4 --no-overlays
+    python plan_batch.py trips.json --out plans.ndjson
+"""
+import sys, json, argparse
+
+from event_planner import plan_batch, batch_event, BATCH_MAX_CONCURRENCY
+
+
+def read_trips(text: str) -> list:
+    """JSON array, {"trips": [...]}, or one JSON object per line."""
+    text = text.strip()
+    if not text:
+        return []
+    try:
+        data = json.loads(text)
+    except json.JSONDecodeError:
+        return [json.loads(line) for line in text.splitlines() if line.strip()]
+    if isinstance(data, dict):
+        data = data.get("trips", [data])
+    return data if isinstance(data, list) else [data]
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description="Plan a batch of trips; writes NDJSON events.")
+    ap.add_argument("input", nargs="?", help="JSON / NDJSON file of trip requests (default: stdin)")
+    ap.add_argument("--out", help="write NDJSON here instead of stdout")
+    ap.add_argument("--max-concurrency", type=int, default=BATCH_MAX_CONCURRENCY,
+                    help="Gemini calls in flight")
+    ap.add_argument("--no-overlays", action="store_true", help="plans only; skip weather / crime overlays")
+    ap.add_argument("--no-cache", action="store_true", help="ignore the plan cache")
+    args = ap.parse_args()
+
+    if args.input:
+        with open(args.input) as f:
+            trips = read_trips(f.read())
+    else:
+        trips = read_trips(sys.stdin.read())
+    if not trips:
+        raise SystemExit("no trip requests in input")
+
+    out = open(args.out, "w") if args.out else sys.stdout
+    try:
+        for kind, index, payload in plan_batch(trips, max_concurrency=max(1, args.max_concurrency),
+                                               use_cache=not args.no_cache, overlays=not args.no_overlays):
+            out.write(json.dumps(batch_event(kind, index, payload)) + "\n")
+            out.flush()
+    finally:
+        if out is not sys.stdout:
+            out.close()
@@ -0,0 +1,163 @@
+# prompt_codec.py
+"""
+Compact prompt encoding for the planner and optimizer calls, plus a token counter.
+
+Prompt size drives Gemini latency and cost, and most of it used to be JSON syntax,
+repeated place names and fields the model never needs. The compact form:
+  - writes trips as `key=value` lines with short keys, skipping empty fields;
+  - writes legs as one table (`seq|mode|dep|arr|min|from|to|...`) with every place
+    listed once in a legend and referenced as @n;
+  - keeps per-leg cost / accessibility / reasoning columns only when the signal
+    needs them (budget, wheelchair, preference notes);
+  - lists only the weather rows that are actually bad;
+  - keeps all static instructions in the system message, so every call starts with
+    the same byte-identical prefix (Gemini's implicit prefix caching can reuse it).
+
+count_tokens() is an offline estimate (~4 characters per token for English and
+JSON, the ratio Gemini documents); good for tracking and capping prompt size, not
+for billing. PROMPT_ENCODING=json restores the verbose JSON encoding.
+"""
+import os, math, threading
+from typing import Iterable, List, Optional
+
+PROMPT_ENCODING          = os.getenv("PROMPT_ENCODING", "compact")   # compact | json
+PROMPT_MAX_TOKENS        = int(os.getenv("PROMPT_MAX_TOKENS", "3000"))  # optimizer user message cap
+CHARS_PER_TOKEN          = 4.0
+
+_TRIP_KEYS = {
+    "startLocation": "start", "endLocation": "end", "transportMode": "modes",
+    "startTime": "from", "endTime": "until", "tripDuration": "hours",
+    "wheelchairAccessible": "wheelchair", "cuisines": "cuisine", "dietPreferences": "diet",
+    "activityPreferences": "activities", "budgetPreferences": "budget",
+}
+
+
+def count_tokens(content) -> int:
+    """Estimated tokens for a string or a list of chat messages."""
+    if isinstance(content, str):
+        return math.ceil(len(content) / CHARS_PER_TOKEN)
+    return sum(count_tokens(m.get("content") or "") + 4 for m in content)  # +role/turn overhead
+
+
+# ---- prompt size stats (/metrics collector) ----
+_STATS: dict = {}
+_STATS_LOCK = threading.Lock()
+
+
+def record(kind: str, messages: list) -> int:
+    """Count one call's prompt; returns its token estimate."""
+    n = count_tokens(messages)
+    with _STATS_LOCK:
+        s = _STATS.setdefault(kind, {"calls": 0, "tokens_total": 0, "tokens_max": 0, "tokens_last": 0})
+        s["calls"] += 1
+        s["tokens_total"] += n
+        s["tokens_max"] = max(s["tokens_max"], n)
+        s["tokens_last"] = n
+    return n
+
+
+def prompt_stats() -> dict:
+    with _STATS_LOCK:
+        return {k: dict(v, tokens_avg=round(v["tokens_total"] / v["calls"], 1)) for k, v in _STATS.items()}
+
+
+# ---- encoders ----
+def _val(v) -> str:
+    if isinstance(v, (list, tuple)):
+        return ",".join(str(x) for x in v)
+    if hasattr(v, "isoformat"):
+        return v.isoformat(timespec="minutes")
+    return str(v).replace("\n", " ").replace("|", "/")
+
+
+def encode_trip(trip: dict) -> str:
+    """`key=value` lines with short keys; empty / false-y optional fields are dropped."""
+    lines = []
+    for key, short in _TRIP_KEYS.items():
+        v = trip.get(key)
+        if v in (None, "", [], False) and key != "wheelchairAccessible":
+            continue
+        lines.append(f"{short}={_val(v)}")
+    return "\n".join(lines)
+
+
+# Leg columns: (Leg field, short header)
+_BASE_COLUMNS = [("sequence", "seq"), ("mode", "mode"), ("departTime", "dep"), ("arriveTime", "arr"),
+                 ("estDurationMin", "min")]
+_OPTIONAL_COLUMNS = {"cost": ("costEstimateUSD", "usd"), "access": ("accessibilityNotes", "access"),
+                     "reason": ("choiceReasoning", "why")}
+
+
+def encode_legs(legs: Iterable[dict], extra: Iterable[str] = ()) -> str:
+    """
+    Legs as a place legend plus one pipe-separated table. `extra` picks optional
+    columns: "cost", "access", "reason". Empty cells are left blank.
+    """
+    places: List[str] = []
+    def ref(place: Optional[str]) -> str:
+        if not place:
+            return ""
+        if place not in places:
+            places.append(place)
+        return f"@{places.index(place) + 1}"
+
+    columns = _BASE_COLUMNS + [_OPTIONAL_COLUMNS[c] for c in extra]
+    rows = []
+    for leg in legs:
+        cells = ["" if leg.get(f) is None else _val(leg.get(f)) for f, _ in columns]
+        rows.append("|".join(cells[:5] + [ref(leg.get("fromLocation")), ref(leg.get("toLocation"))] + cells[5:]))
+    header = "|".join([h for _, h in columns[:5]] + ["from", "to"] + [h for _, h in columns[5:]])
+    legend = "\n".join(f"@{i}={p}" for i, p in enumerate(places, start=1))
+    return f"places:\n{legend}\nlegs:\n{header}\n" + "\n".join(rows)
+
+
+def encode_weather_risks(risks: Iterable[dict]) -> str:
+    """Only the legs with bad weather: `seq: depart <cond>; arrive <cond>`."""
+    lines = []
+    for r in risks:
+        parts = []
+        if r.get("departBad"):
+            parts.append(f"depart {r.get('departCondition') or 'bad'}")
+        if r.get("arriveBad"):
+            parts.append(f"arrive {r.get('arriveCondition') or 'bad'}")
+        if parts:
+            lines.append(f"{r.get('sequence')}: " + "; ".join(parts))
+    return "\n".join(lines) or "none"
+
+
+def optimizer_columns(*, budget: bool, wheelchair: bool, notes: bool) -> List[str]:
+    """Optional leg columns the optimizer needs for this signal mix."""
+    cols = []
+    if budget:
+        cols.append("cost")
+    if wheelchair:
+        cols.append("access")
+    if notes:
+        cols.append("reason")
+    return cols
+
+
+def encode_optimizer_context(*, window: tuple, modes: list, wheelchair: bool, notes: list,
+                             budget_usd, weather_risks: list, legs: list,
+                             max_tokens: int = PROMPT_MAX_TOKENS) -> str:
+    """
+    Compact optimizer user message. Optional columns are dropped, reason first, until
+    the estimate fits max_tokens; the place legend and base columns always stay.
+    """
+    if isinstance(notes, str):
+        notes = [notes]
+    # Weather-only replans need neither costs nor the planner's reasoning
+    extra = optimizer_columns(budget=budget_usd is not None or bool(notes), wheelchair=wheelchair,
+                              notes=bool(notes))
+    head = [f"window={window[0]}..{window[1]}", f"modes={_val(modes)}", f"wheelchair={wheelchair}"]
+    if budget_usd is not None:
+        head.append(f"budgetUSD={budget_usd}")
+    if notes:
+        head.append("notes=" + " / ".join(_val(n) for n in notes))
+    head.append("bad_weather:\n" + encode_weather_risks(weather_risks))
+
+    while True:
+        body = "\n".join(head) + "\n" + encode_legs(legs, extra)
+        if count_tokens(body) <= max_tokens or not extra:
+            return body
+        extra = extra[:-1]  # shed reason, then access, then cost
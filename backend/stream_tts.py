@@ -1,29 +1,53 @@
 # stream_tts.py
-from flask import Blueprint, request, send_file, jsonify
-import io
-import os
+from flask import Blueprint, request, jsonify, Response, stream_with_context, send_file, url_for
+import os, asyncio
+from concurrent.futures import ThreadPoolExecutor
 import requests
 from dotenv import load_dotenv
+from audio_cache import AudioCache, audio_key
+from upstream import ELEVENLABS
+import metrics
 
 load_dotenv()
 
 ELEVENLABS_API_KEY = os.getenv("ELEVEN_LABS_API")
 VOICE_ID = "EXAVITQu4vr4xnSDxMaL"  # Rachel voice
+MODEL_ID = "eleven_multilingual_v2"
+VOICE_SETTINGS = {
+    "stability": 0.6,
+    "similarity_boost": 0.85,
+    "speed": 0.85  # slower speech
+}
+TTS_CHUNK_BYTES = int(os.getenv("TTS_CHUNK_BYTES", "16384"))
+# Segments synthesized concurrently across all requests
+TTS_MAX_PARALLEL = int(os.getenv("TTS_MAX_PARALLEL", "3"))
+
+# Synthesized audio keyed by (script, voice, model, settings); replays skip ElevenLabs.
+# Public, with the functions below, for the ASGI app's mirror of these routes.
+AUDIO_CACHE = AudioCache()
+
+_TTS_POOL = ThreadPoolExecutor(max_workers=TTS_MAX_PARALLEL, thread_name_prefix="tts-segment")
 
 tts_app = Blueprint("tts", __name__)
 
-def generate_itinerary_script(base_plan):
-    """Generate spoken text from itinerary JSON."""
+class TTSError(Exception):
+    pass
+
+def generate_itinerary_segments(base_plan):
+    """
+    Spoken text split into an intro/assumptions segment plus one segment per leg,
+    so a replanned itinerary only re-synthesizes the legs that changed.
+    """
     legs = base_plan.get("legs", [])
     assumptions = base_plan.get("assumptions", [])
 
-    lines = ["Here is your planned itinerary for the day:\n"]
-
+    intro = ["Here is your planned itinerary for the day:\n"]
     if assumptions:
-        lines.append("Assumptions for this plan include: ")
+        intro.append("Assumptions for this plan include: ")
         for a in assumptions:
-            lines.append(f"- {a}")
-        lines.append("\n")
+            intro.append(f"- {a}")
+        intro.append("\n")
+    segments = [" ".join(intro)]
 
     for leg in legs:
         sequence = leg.get("sequence", "?")
@@ -34,26 +58,28 @@ def generate_itinerary_script(base_plan):
         arrive = leg.get("arriveTime", "Unknown time")
         reason = leg.get("choiceReasoning", "")
 
-        lines.append(f"Leg {sequence}:")
+        lines = [f"Leg {sequence}:"]
         lines.append(f"{mode} from {from_loc} departing at {depart}, to {to_loc}, arriving at {arrive}.")
         if reason:
             lines.append(f"Reason: {reason}")
         lines.append("\n")
+        segments.append(" ".join(lines))
 
-    return " ".join(lines)
+    return segments
 
-@tts_app.route("/stream-itinerary", methods=["POST"])
-def stream_itinerary_tts():
-    data = request.json
-    base_plan = data.get("base_plan")
-    if not base_plan:
-        return jsonify({"error": "base_plan missing"}), 400
+def generate_itinerary_script(base_plan):
+    """Generate spoken text from itinerary JSON."""
+    return " ".join(generate_itinerary_segments(base_plan))
 
-    # Generate text script
-    text = generate_itinerary_script(base_plan)
+def segment_key(text):
+    return audio_key(text=text, voice_id=VOICE_ID, model_id=MODEL_ID, voice_settings=VOICE_SETTINGS)
+
+def itinerary_key(segments):
+    """Cache key of the whole stitched itinerary."""
+    return segment_key(" ".join(segments))
 
-    # Call Eleven Labs TTS API
-    url = f"https://api.elevenlabs.io/v1/text-to-speech/{VOICE_ID}/stream"
+def _tts_request(text):
+    path = f"v1/text-to-speech/{VOICE_ID}/stream"  # base URL: ELEVENLABS_BASE_URL (upstream.py)
     headers = {
         "xi-api-key": ELEVENLABS_API_KEY,
         "Content-Type": "application/json",
@@ -61,25 +87,158 @@ def stream_itinerary_tts():
     }
     payload = {
         "text": text,
-        "model_id": "eleven_multilingual_v2",
-        "voice_settings": {
-            "stability": 0.6,
-            "similarity_boost": 0.85,
-            "speed": 0.85  # slower speech
-        }
+        "model_id": MODEL_ID,
+        "voice_settings": VOICE_SETTINGS,
     }
+    return path, headers, payload
+
+def _request_tts(text):
+    """Open a streaming ElevenLabs synthesis; raises TTSError on a non-200 reply."""
+    path, headers, payload = _tts_request(text)
+    try:
+        response = ELEVENLABS.post(path, headers=headers, json=payload, stream=True)
+    except requests.RequestException as e:
+        raise TTSError(f"TTS failed: {e}")
+    if response.status_code != 200:
+        error = f"TTS failed: {response.status_code} {response.text}"
+        response.close()
+        raise TTSError(error)
+    return response
 
-    response = requests.post(url, headers=headers, json=payload, stream=True)
+def _relay(response):
+    """Forward audio chunks as they arrive; nothing is buffered beyond one chunk."""
+    try:
+        for chunk in response.iter_content(chunk_size=TTS_CHUNK_BYTES):
+            if chunk:
+                yield chunk
+    finally:
+        response.close()
+
+async def arequest_tts(text):
+    """Async `_request_tts` (httpx) for the ASGI app."""
+    path, headers, payload = _tts_request(text)
+    try:
+        response = await ELEVENLABS.arequest("POST", path, headers=headers, json=payload, stream=True)
+    except Exception as e:
+        raise TTSError(f"TTS failed: {e}")
     if response.status_code != 200:
-        return jsonify({"error": f"TTS failed: {response.status_code} {response.text}"}), 500
+        body = (await response.aread()).decode("utf-8", "replace")
+        await response.aclose()
+        raise TTSError(f"TTS failed: {response.status_code} {body}")
+    return response
+
+async def arelay(response):
+    try:
+        async for chunk in response.aiter_bytes(TTS_CHUNK_BYTES):
+            if chunk:
+                yield chunk
+    finally:
+        await response.aclose()
+
+@metrics.timed("tts.synthesize")
+def _synthesize_segment(key, text):
+    """Synthesize one segment straight into the audio cache; returns its path."""
+    for _ in AUDIO_CACHE.tee(key, _relay(_request_tts(text))):
+        pass
+    return AUDIO_CACHE.path(key)
+
+def synthesize_segments(seg_keys, segments, indexes):
+    """Queue the given segments on the shared synthesis pool; {index: Future of the cached path}."""
+    return {i: _TTS_POOL.submit(metrics.bind(_synthesize_segment), seg_keys[i], segments[i]) for i in indexes}
+
+def _id3_size(head):
+    """Length of a leading ID3v2 tag (0 if none), so stitched segments carry only MP3 frames."""
+    if len(head) < 10 or head[:3] != b"ID3":
+        return 0
+    size = (head[6] << 21) | (head[7] << 14) | (head[8] << 7) | head[9]
+    return 10 + size + (10 if head[5] & 0x10 else 0)
 
-    audio_bytes = io.BytesIO(response.content)
-    audio_bytes.seek(0)
+def read_segment(path, strip_tag):
+    with open(path, "rb") as f:
+        if strip_tag:
+            f.seek(_id3_size(f.read(10)))
+        while True:
+            chunk = f.read(TTS_CHUNK_BYTES)
+            if not chunk:
+                break
+            yield chunk
 
-    # Return audio inline (not as attachment)
-    return send_file(
-        audio_bytes,
+async def aread_segment(path, strip_tag):
+    """`read_segment` for the event loop: each file read runs in a worker thread."""
+    chunks = read_segment(path, strip_tag)
+    try:
+        while True:
+            chunk = await asyncio.to_thread(next, chunks, None)
+            if chunk is None:
+                break
+            yield chunk
+    finally:
+        chunks.close()
+
+@tts_app.route("/stream-itinerary", methods=["POST"])
+def stream_itinerary_tts():
+    data = request.json
+    base_plan = data.get("base_plan")
+    if not base_plan:
+        return jsonify({"error": "base_plan missing"}), 400
+
+    # Generate text script
+    segments = generate_itinerary_segments(base_plan)
+    key = itinerary_key(segments)
+    cached = AUDIO_CACHE.lookup(key)
+    if cached:
+        metrics.count("tts.cache_hits")
+        # File response: served via the server's file wrapper, with Range support
+        resp = send_file(cached, mimetype="audio/mpeg", conditional=True,
+                         as_attachment=False, download_name="itinerary.mp3")
+        resp.headers["X-TTS-Cache"] = "HIT"
+        resp.headers["X-TTS-Audio-URL"] = url_for("tts.cached_audio", key=key)
+        return resp
+
+    # Per-segment cache: after a replan only changed legs miss here
+    seg_keys = [segment_key(t) for t in segments]
+    missing = [i for i, k in enumerate(seg_keys) if not AUDIO_CACHE.lookup(k)]
+    metrics.count("tts.cache_misses")
+    metrics.count("tts.segments_synthesized", len(missing))
+
+    # The first segment streams live (time-to-first-audio = upstream first chunk);
+    # later missing segments synthesize in parallel into the cache meanwhile.
+    first_live = None
+    if missing and missing[0] == 0:
+        try:
+            first_live = _request_tts(segments[0])
+        except TTSError as e:
+            return jsonify({"error": str(e)}), 500
+    pending = synthesize_segments(seg_keys, segments, [i for i in missing if i != 0])
+
+    def stitched():
+        with metrics.span("tts.stream"):
+            for i, seg_key in enumerate(seg_keys):
+                if i == 0 and first_live is not None:
+                    yield from AUDIO_CACHE.tee(seg_key, _relay(first_live))
+                    continue
+                path = pending[i].result() if i in pending else AUDIO_CACHE.path(seg_key)
+                yield from read_segment(path, strip_tag=i > 0)
+
+    # Return audio inline (not as attachment); the stitched stream is also teed
+    # into the whole-itinerary cache entry
+    return Response(
+        stream_with_context(AUDIO_CACHE.tee(key, stitched())),
         mimetype="audio/mpeg",
-        as_attachment=False,  # Important! Inline playback
-        download_name="itinerary.mp3"
+        headers={"Content-Disposition": 'inline; filename="itinerary.mp3"',
+                 "X-Accel-Buffering": "no",
+                 "X-TTS-Cache": "MISS",
+                 "X-TTS-Segments-Synthesized": str(len(missing)),
+                 "X-TTS-Audio-URL": url_for("tts.cached_audio", key=key)},
     )
+
+@tts_app.route("/audio/<key>.mp3", methods=["GET"])
+def cached_audio(key):
+    """Cached audio by content key; GET/HEAD with Range so <audio> elements can seek."""
+    if len(key) != 64 or any(c not in "0123456789abcdef" for c in key):
+        return jsonify({"error": "bad audio key"}), 400
+    path = AUDIO_CACHE.lookup(key)
+    if not path:
+        return jsonify({"error": "audio not cached"}), 404
+    return send_file(path, mimetype="audio/mpeg", conditional=True,
+                     as_attachment=False, download_name="itinerary.mp3")
@@ -0,0 +1,6 @@
+import os, sys
+
+# In-memory caches and no real upstream credentials for tests
+os.environ.setdefault("CACHE_DB_PATH", "")
+os.environ.setdefault("WEATHER_API_KEY", "test")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
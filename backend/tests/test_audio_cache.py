@@ -0,0 +1,30 @@
+import os
+
+import audio_cache
+from audio_cache import AudioCache
+
+KEYS = [f"{i:064x}" for i in range(5)]
+
+
+def test_evicts_least_recently_used_without_rewalking(tmp_path, monkeypatch):
+    walks = []
+    real_walk = os.walk
+    monkeypatch.setattr(audio_cache.os, "walk", lambda root: walks.append(root) or real_walk(root))
+
+    cache = AudioCache(str(tmp_path), max_bytes=3000)
+    for key in KEYS[:3]:
+        cache.put(key, b"x" * 1000)
+    assert cache.lookup(KEYS[0])          # KEYS[1] is now the least recently used
+    cache.put(KEYS[3], b"y" * 1000)
+
+    assert [bool(cache.lookup(k)) for k in KEYS[:4]] == [True, False, True, True]
+    assert len(walks) == 1
+
+
+def test_running_total_tracks_overwrites(tmp_path):
+    cache = AudioCache(str(tmp_path), max_bytes=10_000)
+    cache.put(KEYS[0], b"x" * 1000)
+    cache.put(KEYS[0], b"x" * 400)
+    cache.put(KEYS[1], b"x" * 100)
+    assert cache._bytes == 500
+    assert AudioCache(str(tmp_path)).evict() == 0
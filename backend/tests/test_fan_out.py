@@ -0,0 +1,45 @@
+import threading, time
+
+import event_planner as ep
+from event_planner import Itinerary, Leg
+
+
+def test_limited_fan_out_caps_workers_and_keeps_order():
+    running, peak, lock = [0], [0], threading.Lock()
+
+    def work(x):
+        with lock:
+            running[0] += 1
+            peak[0] = max(peak[0], running[0])
+        time.sleep(0.02)
+        with lock:
+            running[0] -= 1
+        return x * 10
+
+    results, pending = ep._fan_out(work, list(range(10)), 5.0, limit=3)
+    assert (results, pending) == ([x * 10 for x in range(10)], 0)
+    assert peak[0] == 3
+
+
+def test_limited_fan_out_deadline_counts_unstarted_items():
+    results, pending = ep._fan_out(lambda x: time.sleep(0.2), list(range(6)), 0.05, limit=2)
+    assert results == [None] * 6 and pending == 6
+
+
+def test_batch_prefetch_leaves_overlay_pool_to_others(monkeypatch):
+    def slow_forecast(place):
+        time.sleep(0.3)
+    monkeypatch.setattr(ep, "WEATHER_API_KEY", "test")
+    monkeypatch.setattr(ep, "_owm_forecast_blocks_by_place", slow_forecast)
+    monkeypatch.setattr(ep, "geocode_many", lambda places, deadline_s=None: {})
+    monkeypatch.setattr(ep, "_weather_place_key", lambda place: place)
+
+    legs = [Leg(sequence=i, mode="walk", fromLocation=f"Place {i}", toLocation=f"Place {i + 100}")
+            for i in range(2 * ep.OVERLAY_MAX_WORKERS)]
+    batch = threading.Thread(target=ep.prefetch_places, args=([Itinerary(summary="s", assumptions=[], legs=legs)], 1.0))
+    batch.start()
+    time.sleep(0.05)
+    started = time.monotonic()
+    _, pending = ep._fan_out(lambda x: x, list(range(ep.OVERLAY_MAX_WORKERS - ep.BATCH_PREFETCH_WORKERS)), 1.0)
+    assert pending == 0 and time.monotonic() - started < 0.1
+    batch.join()
@@ -0,0 +1,44 @@
+import event_planner as ep
+
+PLACE = "Bryant Park, New York, NY 10018, USA"
+BLOCKS = [{"dt": 0, "main": {"temp": 20.0, "humidity": 50}, "weather": [{"description": "clear sky", "icon": "01d"}],
+           "wind": {"speed": 2.0}}]
+
+
+class _InlinePool:
+    def submit(self, fn, *args):
+        fn(*args)
+
+
+def test_failed_refresh_keeps_serving_stale_forecast(monkeypatch):
+    calls = []
+    monkeypatch.setattr(ep, "WEATHER_API_KEY", "test")
+    monkeypatch.setattr(ep, "_WEATHER_REFRESH_POOL", _InlinePool())
+    monkeypatch.setattr(ep, "_fetch_owm_blocks", lambda q: calls.append(q))   # OWM down: always None
+
+    city = ep._extract_city_q(PLACE).lower()
+    slot = ep._issue_slot()
+    ep._store_forecast(city, slot - ep.WEATHER_ISSUE_S, BLOCKS)
+
+    # Served stale; the background refresh fails
+    key, blocks = ep._owm_forecast_entry(PLACE)
+    assert (key, blocks) == (f"{city}@{slot - ep.WEATHER_ISSUE_S}", BLOCKS)
+    assert len(calls) == 1
+    assert ep._WEATHER_Q_CACHE.get(f"{city}@{slot}") is ep.MISS
+
+    # Still stale after the failure, and the refresh backs off instead of retrying per request
+    assert ep._owm_forecast_entry(PLACE)[1] == BLOCKS
+    assert len(calls) == 1
+
+
+def test_cached_failure_falls_back_to_stale(monkeypatch):
+    monkeypatch.setattr(ep, "WEATHER_API_KEY", "test")
+    monkeypatch.setattr(ep, "_WEATHER_REFRESH_POOL", _InlinePool())
+    monkeypatch.setattr(ep, "_fetch_owm_blocks", lambda q: None)
+
+    place = "MoMA, 11 W 53rd St, Boston, MA 02116, USA"
+    city = ep._extract_city_q(place).lower()
+    slot = ep._issue_slot()
+    ep._store_forecast(city, slot, None)                         # negative entry in the current slot
+    ep._store_forecast(city, slot - ep.WEATHER_ISSUE_S, BLOCKS)
+    assert ep._owm_forecast_entry(place)[1] == BLOCKS
@@ -0,0 +1,39 @@
+import threading, time
+
+import event_planner as ep
+
+
+def test_geocode_fan_out_leaves_overlay_pool_free(monkeypatch):
+    threads = set()
+
+    def slow_fetch(key, address, timeout=None):
+        threads.add(threading.current_thread().name)
+        time.sleep(0.05)   # stands in for the 1 req/s Nominatim bucket
+        return (40.0, -73.0)
+    monkeypatch.setattr(ep, "_fetch_geocode", slow_fetch)
+
+    places = [f"{n} Slow St, New York, NY" for n in range(60)]
+    batch = threading.Thread(target=ep.geocode_many, args=(places, 0.5))
+    batch.start()
+    time.sleep(0.05)
+    # An unrelated overlay fan-out still gets the whole pool while the geocodes queue
+    started = time.monotonic()
+    results, pending = ep._fan_out(lambda x: x, list(range(ep.OVERLAY_MAX_WORKERS)), 1.0)
+    assert pending == 0 and time.monotonic() - started < 0.2
+    batch.join()
+    assert all(name.startswith("nominatim") for name in threads)
+
+
+def test_geocode_many_dedupes_and_omits_pending(monkeypatch):
+    calls = []
+
+    def fetch(key, address, timeout=None):
+        calls.append(key)
+        time.sleep(0.1)
+        ep._GEOCODE_CACHE.set(key, [1.0, 2.0], 60)
+        return (1.0, 2.0)
+    monkeypatch.setattr(ep, "_fetch_geocode", fetch)
+
+    out = ep.geocode_many(["1 Dup Ave, New York, NY", "1 dup ave,new york, ny, USA", "2 Late Ave, New York, NY"], 0.15)
+    assert out == {"1 Dup Ave, New York, NY": (1.0, 2.0), "1 dup ave,new york, ny, USA": (1.0, 2.0)}
+    assert calls.count("1 dup ave, new york, ny") == 1
@@ -0,0 +1,64 @@
+import time
+
+import pytest
+
+import jobs
+
+
+def _wait_done(q, job_id):
+    for _ in range(200):
+        record = q.status(job_id)
+        if record["status"] in ("done", "error"):
+            return record
+        time.sleep(0.01)
+    raise AssertionError("job did not finish")
+
+
+def test_job_runs_to_done():
+    q = jobs.JobQueue(workers=1)
+    record = _wait_done(q, q.submit(lambda x: x * 2, 21))
+    assert (record["status"], record["result"]) == ("done", 42)
+
+
+def test_unfinished_job_from_dead_process_is_reported_failed():
+    q = jobs.JobQueue(workers=1)
+    # Records left behind by a queue whose process restarted: no heartbeat, nobody will run them
+    q._set("gone-queued", {"status": "queued", "priority": "normal", "submitted_at": 0, "owner": "dead"})
+    q._set("gone-running", {"status": "running", "started_at": 0, "owner": "dead"})
+    q._set("legacy", {"status": "queued", "priority": "normal", "submitted_at": 0})
+    for job_id in ("gone-queued", "gone-running", "legacy"):
+        record = q.status(job_id)
+        assert record["status"] == "error" and "restart" in record["error"]
+        assert q._status.get(job_id)["status"] == "error"   # persisted, not just reported
+
+
+def test_job_owned_by_live_sibling_stays_pending():
+    q = jobs.JobQueue(workers=1)
+    sibling = "sibling-worker"
+    q._status.set(f"owner:{sibling}", time.time(), 60)   # another process, heartbeat fresh
+    q._set("theirs", {"status": "running", "started_at": 0, "owner": sibling})
+    assert q.status("theirs")["status"] == "running"
+
+
+def test_high_priority_comes_from_configuration(monkeypatch):
+    monkeypatch.setattr(jobs, "JOB_HIGH_PRIORITY_CLIENTS", frozenset({"10.0.0.5"}))
+    assert jobs.job_priority("10.0.0.9", "high") == "normal"   # asking is not enough
+    assert jobs.job_priority("10.0.0.9", "low") == "low"
+    assert jobs.job_priority("10.0.0.9") == "normal"
+    assert jobs.job_priority("10.0.0.5") == "high"
+    with pytest.raises(ValueError):
+        jobs.job_priority("10.0.0.9", "urgent")
+
+
+def test_rotating_client_id_header_does_not_bypass_the_cap(monkeypatch):
+    import threading
+    import app as app_module
+
+    gate = threading.Event()
+    monkeypatch.setattr(app_module, "_itinerary_pipeline", lambda data, trip_id: gate.wait(5))
+    monkeypatch.setattr(app_module, "JOBS", jobs.JobQueue(workers=1, max_pending_per_client=2))
+    client = app_module.app.test_client()
+    codes = [client.post("/api/itinerary?async=1&priority=high", json={}, headers={"X-Client-Id": f"c{n}"}).status_code
+             for n in range(3)]
+    gate.set()
+    assert codes == [202, 202, 429]
@@ -0,0 +1,121 @@
+import json
+
+from event_planner import _optimizer_request
+
+TRIP = {"startLocation": "A St, New York, NY", "transportMode": ["subways", "walk"],
+        "startTime": "2025-10-04T09:00", "tripDuration": "6"}
+RAIN = {"condition": "light rain", "icon": "10d"}
+
+
+def _plan(legs):
+    return json.dumps({"summary": "test", "assumptions": [], "legs": legs})
+
+
+# Listed out of order: the 09:00 walk is sequence 2, so the schedule repair renumbers it to 1
+LEGS = [
+    {"sequence": 1, "mode": "activity", "departTime": "10:00", "arriveTime": "11:00",
+     "fromLocation": "Met Museum", "toLocation": "Met Museum"},
+    {"sequence": 2, "mode": "walk", "departTime": "09:00", "arriveTime": "09:30",
+     "fromLocation": "A St, New York, NY", "toLocation": "Met Museum"},
+]
+
+
+def test_weather_risks_follow_legs_through_schedule_repair():
+    overlay = {"legWeather": [
+        {"sequence": 1, "fromLocation": "Met Museum", "toLocation": "Met Museum"},
+        {"sequence": 2, "fromLocation": "A St, New York, NY", "toLocation": "Met Museum",
+         "departWeather": RAIN, "arriveWeather": RAIN},
+    ]}
+    _, result, messages = _optimizer_request(json.dumps(TRIP), _plan(LEGS), json.dumps({"weather": overlay}))
+    assert messages is None
+    walk = result.optimized.legs[0]
+    assert (walk.sequence, walk.fromLocation, walk.mode) == (1, "A St, New York, NY", "subway")
+    assert result.optimized.legs[1].mode == "activity"
+
+
+def test_unparseable_budget_is_parsed_or_omitted():
+    _, result, _ = _optimizer_request(json.dumps(TRIP), _plan(LEGS), json.dumps({"tripBudgetUSD": "$1,500"}))
+    assert result.budget_summary == "Estimated total $0.00, within $1500.00."
+    _, result, _ = _optimizer_request(json.dumps(TRIP), _plan(LEGS), json.dumps({"tripBudgetUSD": "flexible"}))
+    assert result.budget_summary is None
+
+
+PRICED = [dict(leg, costEstimateUSD=30.0) for leg in LEGS]
+
+
+def test_budget_preferences_only_count_currency_amounts():
+    # "$100 for 2 people" is a $100 cap, not $2; the $60 plan fits
+    trip = dict(TRIP, budgetPreferences="$100 for 2 people")
+    _, result, messages = _optimizer_request(json.dumps(trip), _plan(PRICED), json.dumps({"tripBudgetUSD": ""}))
+    assert messages is None and result.budget_summary is None
+    assert not [n for n in result.notes if "$" in n]
+
+
+def test_over_budget_replan_carries_the_cap():
+    trip = dict(TRIP, budgetPreferences="under $40 please")
+    _, result, messages = _optimizer_request(json.dumps(trip), _plan(PRICED), json.dumps({"tripBudgetUSD": ""}))
+    assert result is None
+    prompt = messages[-1]["content"]
+    assert "budgetUSD=40.0" in prompt and "|usd" in prompt
+
+
+def _dry_between(monkeypatch, lo, hi):
+    """Forecast stub: dry from lo to hi (HH:MM), raining otherwise."""
+    import event_planner as ep
+    monkeypatch.setattr(ep, "_forecast_series_by_place", lambda place: "series")
+    monkeypatch.setattr(ep, "_pick_closest", lambda series, when, interpolate=False: when)
+    is_bad = ep._is_bad_weather   # still used on the overlay's condition dicts
+    monkeypatch.setattr(ep, "_is_bad_weather", lambda when: is_bad(when) if isinstance(when, (dict, type(None)))
+                        else not (lo <= when.strftime("%H:%M") <= hi))
+
+
+def _walk_in_rain(prev_arrive):
+    trip = dict(TRIP, transportMode=["walk"])
+    legs = [
+        {"sequence": 1, "mode": "activity", "departTime": "09:00", "arriveTime": prev_arrive,
+         "fromLocation": "Met Museum", "toLocation": "Met Museum"},
+        {"sequence": 2, "mode": "walk", "departTime": "10:40", "arriveTime": "11:00", "estDurationMin": 20,
+         "fromLocation": "Met Museum", "toLocation": "Central Park"},
+    ]
+    overlay = {"legWeather": [
+        {"sequence": 1, "fromLocation": "Met Museum", "toLocation": "Met Museum"},
+        {"sequence": 2, "fromLocation": "Met Museum", "toLocation": "Central Park",
+         "departWeather": RAIN, "arriveWeather": RAIN},
+    ]}
+    return _optimizer_request(json.dumps(trip), _plan(legs), json.dumps({"weather": overlay}))
+
+
+def test_dry_shift_that_fits_between_neighbours_is_kept(monkeypatch):
+    _dry_between(monkeypatch, "10:05", "10:35")
+    _, result, messages = _walk_in_rain(prev_arrive="10:00")
+    assert messages is None
+    walk = result.optimized.legs[1]
+    assert (walk.departTime, walk.arriveTime) == ("10:10", "10:30")
+
+
+def test_dry_shift_into_previous_leg_goes_to_llm(monkeypatch):
+    # -30 min would overlap the 10:25 arrival, and repair would push the walk back into the rain
+    _dry_between(monkeypatch, "10:05", "10:35")
+    _, result, messages = _walk_in_rain(prev_arrive="10:25")
+    assert result is None and messages
+
+
+def test_async_optimizer_keeps_weather_rules_off_the_event_loop(monkeypatch):
+    import asyncio, threading
+    import event_planner as ep
+
+    threads = []
+    def series(place):   # a cold forecast would be a blocking OWM call here
+        threads.append(threading.current_thread())
+    monkeypatch.setattr(ep, "_forecast_series_by_place", series)
+
+    walk = [dict(LEGS[1], sequence=1, estDurationMin=30)]
+    overlay = {"legWeather": [{"sequence": 1, "fromLocation": "A St, New York, NY", "toLocation": "Met Museum",
+                               "departWeather": RAIN, "arriveWeather": RAIN}]}
+    trip = dict(TRIP, transportMode=["walk"])
+    monkeypatch.setattr(ep, "_llm_clients", lambda: (None, None, None))
+    try:
+        asyncio.run(ep.aoptimize_itinerary(json.dumps(trip), _plan(walk), json.dumps({"weather": overlay})))
+    except AttributeError:
+        pass  # no LLM in tests; the rule tier already ran
+    assert threads and threading.main_thread() not in threads
@@ -0,0 +1,31 @@
+import json
+
+import prompt_codec
+from event_planner import _optimizer_request
+
+TRIP = {"startLocation": "A St, New York, NY", "transportMode": ["subways", "walk"],
+        "startTime": "2025-10-04T09:00", "tripDuration": "6"}
+PLAN = {"summary": "test", "assumptions": [], "legs": [
+    {"sequence": 1, "mode": "walk", "departTime": "09:00", "arriveTime": "09:30",
+     "fromLocation": "A St, New York, NY", "toLocation": "Met Museum"}]}
+
+
+def _notes_line(body):
+    return next(line for line in body.splitlines() if line.startswith("notes="))
+
+
+def test_string_user_notes_stay_one_note():
+    # TransitAndMapView.js sends the preferences text as a plain string
+    _, result, messages = _optimizer_request(json.dumps(TRIP), json.dumps(PLAN),
+                                             json.dumps({"user_notes": "vegetarian"}))
+    assert result is None
+    assert _notes_line(messages[-1]["content"]) == "notes=vegetarian"
+    body = prompt_codec.encode_optimizer_context(
+        window=("09:00", "15:00"), modes=["walk"], wheelchair=False, notes="vegetarian",
+        budget_usd=None, weather_risks=[], legs=[])
+    assert _notes_line(body) == "notes=vegetarian"
+
+
+def test_non_list_user_notes_are_dropped():
+    _, result, messages = _optimizer_request(json.dumps(TRIP), json.dumps(PLAN), json.dumps({"user_notes": {"x": 1}}))
+    assert messages is None and result is not None
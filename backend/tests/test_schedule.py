@@ -0,0 +1,74 @@
+from event_planner import Itinerary, Leg, TripRequest, check_schedule, repair_schedule, _finalize_plan
+
+TRIP = TripRequest(startLocation="Times Square, New York, NY", transportMode=["subways", "walk"],
+                   startTime="2025-10-04T09:00", tripDuration="6")
+
+
+def _leg(seq, dep, arr, src="A", dst="B", mode="activity", est=None):
+    return Leg(sequence=seq, mode=mode, departTime=dep, arriveTime=arr,
+               fromLocation=src, toLocation=dst, estDurationMin=est)
+
+
+def _itin(*legs):
+    return Itinerary(summary="test", assumptions=[], legs=list(legs))
+
+
+def _times(itin):
+    return [(leg.departTime, leg.arriveTime) for leg in itin.legs]
+
+
+def test_consistent_schedule_is_unchanged():
+    itin = _itin(_leg(1, "09:00", "09:15", "A", "B", "walk", est=15),
+                 _leg(2, "09:20", "11:20", "B", "B", est=15),   # estimate disagrees with a valid span
+                 _leg(3, "11:30", "11:50", "B", "C", "subway", est=20))
+    fixed, changes, _ = repair_schedule(TRIP, itin)
+    assert changes == []
+    assert fixed == itin
+    assert _finalize_plan(TRIP, itin) is itin
+
+
+def test_overlap_is_pushed_after_previous_arrival():
+    itin = _itin(_leg(1, "09:00", "10:00", "A", "B"),
+                 _leg(2, "09:45", "10:15", "B", "C", "walk", est=30))
+    assert any(v["kind"] == "overlap" for v in check_schedule(TRIP, itin))
+    fixed, changes, residual = repair_schedule(TRIP, itin)
+    assert _times(fixed) == [("09:00", "10:00"), ("10:00", "10:30")]
+    assert [c.target_sequence for c in changes] == [2]
+    assert not any(v["kind"] == "overlap" for v in residual)
+
+
+def test_missing_times_are_filled_from_estimates():
+    itin = _itin(_leg(1, "09:00", "09:30", "A", "B", "walk"),
+                 _leg(2, None, None, "B", "B", est=60),
+                 _leg(3, None, "11:00", "B", "C", "subway", est=20))
+    fixed, changes, residual = repair_schedule(TRIP, itin)
+    assert _times(fixed) == [("09:00", "09:30"), ("09:30", "10:30"), ("10:30", "10:50")]
+    assert {c.target_sequence for c in changes} == {2, 3}
+    assert not any(v["kind"] == "missing_time" for v in residual)
+
+
+def test_tz_aware_leg_times_are_read_as_trip_local():
+    # 13:00Z and 14:30Z are 09:00 and 10:30 in New York (EDT)
+    itin = _itin(_leg(1, "2025-10-04T09:00:00-04:00", "2025-10-04T10:00:00-04:00", "A", "B"),
+                 _leg(2, "2025-10-04T13:50:00Z", "2025-10-04T14:30:00Z", "B", "C", "walk"))
+    assert check_schedule(TRIP, itin) == [{"sequence": 2, "kind": "overlap",
+                                           "detail": "departs 09:50 before previous arrival 10:00"}]
+    fixed, changes, _ = repair_schedule(TRIP, itin)
+    assert fixed.legs[1].departTime == "2025-10-04T10:00"
+    assert [c.target_sequence for c in changes] == [2]
+
+
+def test_tz_aware_trip_start():
+    trip = TripRequest(startLocation="Times Square, New York, NY", transportMode=["walk"],
+                       startTime="2025-10-04T13:00:00+00:00", tripDuration="2")
+    itin = _itin(_leg(1, "09:00", "10:00", "A", "B"), _leg(2, "10:00", "10:30", "B", "C", "walk"))
+    assert check_schedule(trip, itin) == []
+    assert _finalize_plan(trip, itin) is itin
+
+
+def test_leg_outside_window_is_fitted():
+    itin = _itin(_leg(1, "09:00", "12:00", "A", "B"),
+                 _leg(2, "12:00", "16:00", "B", "C", est=120))   # window ends 15:00
+    fixed, changes, residual = repair_schedule(TRIP, itin)
+    assert _times(fixed)[1] == ("12:00", "14:00")
+    assert not any(v["kind"] == "outside_window" for v in residual)
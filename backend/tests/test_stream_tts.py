@@ -0,0 +1,23 @@
+import asyncio, threading
+
+import stream_tts
+
+
+def test_aread_segment_matches_read_segment_off_the_loop(tmp_path, monkeypatch):
+    path = tmp_path / "seg.mp3"
+    path.write_bytes(b"ID3\x03\x00\x00\x00\x00\x00\x04tag!" + b"frame" * 10)
+    monkeypatch.setattr(stream_tts, "TTS_CHUNK_BYTES", 8)
+
+    readers = []
+    real_open = open
+    def tracking_open(*args, **kwargs):
+        readers.append(threading.current_thread())
+        return real_open(*args, **kwargs)
+    monkeypatch.setattr("builtins.open", tracking_open)
+
+    async def collect():
+        return [chunk async for chunk in stream_tts.aread_segment(str(path), strip_tag=True)]
+    chunks = asyncio.run(collect())
+    assert b"".join(chunks) == b"frame" * 10
+    assert readers and threading.main_thread() not in readers
+    assert b"".join(stream_tts.read_segment(str(path), strip_tag=True)) == b"frame" * 10
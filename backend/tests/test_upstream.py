@@ -0,0 +1,45 @@
+import asyncio
+
+import pytest
+
+from upstream import CircuitBreaker, Upstream
+
+
+def _half_open():
+    u = Upstream("test", "http://upstream.invalid")
+    u.breaker = CircuitBreaker(failures=1, reset_s=0)
+    u.breaker.record(False)
+    assert u.breaker.state == "half-open"
+    return u
+
+
+class _HangingClient:
+    def build_request(self, method, url, **kwargs):
+        return (method, url)
+
+    async def send(self, request, stream=False):
+        await asyncio.sleep(3600)
+
+
+def test_cancelled_trial_call_frees_the_half_open_slot():
+    u = _half_open()
+    u.aclient = lambda: _HangingClient()
+
+    async def disconnect():
+        call = asyncio.ensure_future(u.arequest("GET", "x"))
+        await asyncio.sleep(0.01)
+        call.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await call
+    asyncio.run(disconnect())
+    assert u.breaker.allow()   # another call may probe; the breaker can still close
+
+
+def test_unexpected_error_in_trial_call_frees_the_half_open_slot(monkeypatch):
+    u = _half_open()
+    def boom(*args, **kwargs):
+        raise ValueError("bad header")
+    monkeypatch.setattr(u.session, "request", boom)
+    with pytest.raises(ValueError):
+        u.get("x")
+    assert u.breaker.allow()
@@ -0,0 +1,48 @@
+# trip_store.py
+"""
+Trips keyed by id: the validated trip request plus the latest plan and overlays.
+
+/api/itinerary creates a trip and returns its `trip_id`; /api/replan loads it back
+by id and stores the optimized plan. Backed by a TTLCache: an LRU memory tier for
+O(1) lookups and, only if TRIP_STORE_DB_PATH is set, a SQLite file so trips survive
+restarts and are visible to every worker process. Memory-only by default: every put
+would otherwise be a disk commit on the request path.
+"""
+import os, uuid
+from typing import Optional
+
+from cache_store import TTLCache, MISS
+
+TRIP_TTL_S          = float(os.getenv("TRIP_TTL_S", str(7 * 24 * 3600)))
+TRIP_STORE_SIZE     = int(os.getenv("TRIP_STORE_SIZE", "2048"))
+TRIP_STORE_DB_PATH  = os.getenv("TRIP_STORE_DB_PATH", "")   # e.g. the CACHE_DB_PATH file; empty = memory only
+
+
+class TripStore:
+    def __init__(self, max_items: int = TRIP_STORE_SIZE, db_path: Optional[str] = TRIP_STORE_DB_PATH,
+                 ttl_s: float = TRIP_TTL_S):
+        self.ttl_s = ttl_s
+        self._cache = TTLCache("trips", max_items=max_items, db_path=db_path)
+
+    @staticmethod
+    def new_id() -> str:
+        return uuid.uuid4().hex
+
+    def put(self, trip_id: str, trip: dict, **fields) -> None:
+        """Store (or replace) a trip: the request body plus base_plan / weather_overlay / crime_overlay."""
+        self._cache.set(trip_id, {"trip": trip, **fields}, self.ttl_s)
+
+    def get(self, trip_id: Optional[str]) -> Optional[dict]:
+        if not trip_id:
+            return None
+        record = self._cache.get(trip_id)
+        return None if record is MISS else record
+
+    def update(self, trip_id: str, **fields) -> Optional[dict]:
+        """Merge fields into a stored trip (refreshing its TTL); None if the trip is unknown."""
+        record = self.get(trip_id)
+        if record is None:
+            return None
+        record = {**record, **fields}
+        self._cache.set(trip_id, record, self.ttl_s)
+        return record
@@ -0,0 +1,262 @@
+# upstream.py
+"""
+Shared HTTP client for every third-party API the backend talks to.
+
+Each upstream (OWM, Nominatim, NYC SODA, ElevenLabs) gets:
+- a pooled keep-alive `requests.Session`, so repeat calls skip the TCP+TLS handshake;
+- urllib3 retries with jittered exponential backoff (idempotent GETs only; POSTs
+  retry only when the connection never opened);
+- a per-host concurrency limit, so one slow provider cannot tie up every worker thread;
+- a circuit breaker: after N consecutive failures calls fail fast for a cool-down,
+  then a single trial call decides whether to close it again.
+
+The ASGI app (asgi_app.py) uses `arequest`, an httpx.AsyncClient per upstream with
+the same base URL, headers, connection cap and breaker (HTTP/2 when `h2` is installed).
+
+Base URLs come from the environment (OWM_BASE_URL, NOMINATIM_BASE_URL,
+NYC_CRIME_BASE, ELEVENLABS_BASE_URL) so tests can point them at local stubs.
+"""
+import os, time, asyncio, threading, importlib.util
+from typing import Optional
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+import metrics
+
+UPSTREAM_RETRIES          = int(os.getenv("UPSTREAM_RETRIES", "2"))
+UPSTREAM_BACKOFF_S        = float(os.getenv("UPSTREAM_BACKOFF_S", "0.3"))
+UPSTREAM_BACKOFF_JITTER_S = float(os.getenv("UPSTREAM_BACKOFF_JITTER_S", "0.3"))
+UPSTREAM_BREAKER_FAILURES = int(os.getenv("UPSTREAM_BREAKER_FAILURES", "5"))
+UPSTREAM_BREAKER_RESET_S  = float(os.getenv("UPSTREAM_BREAKER_RESET_S", "30"))
+# How long a call may wait for a free per-host slot before giving up
+UPSTREAM_QUEUE_TIMEOUT_S  = float(os.getenv("UPSTREAM_QUEUE_TIMEOUT_S", "10"))
+
+_RETRY_STATUSES = (429, 500, 502, 503, 504)
+_HTTP2 = importlib.util.find_spec("h2") is not None
+
+
+class UpstreamUnavailable(requests.ConnectionError):
+    """Raised without touching the network: breaker open or no free slot.
+    Subclasses ConnectionError so existing `except requests.RequestException` paths handle it."""
+
+
+class CircuitBreaker:
+    """closed -> open after `failures` consecutive failures; open -> half-open after `reset_s`."""
+
+    def __init__(self, failures: int = UPSTREAM_BREAKER_FAILURES, reset_s: float = UPSTREAM_BREAKER_RESET_S):
+        self.failures = failures
+        self.reset_s = reset_s
+        self._lock = threading.Lock()
+        self._consecutive = 0
+        self._opened_at: Optional[float] = None
+        self._trial = False
+        self.trips = 0
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            if self._opened_at is None:
+                return "closed"
+            return "half-open" if time.monotonic() - self._opened_at >= self.reset_s else "open"
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self._opened_at is None:
+                return True
+            if time.monotonic() - self._opened_at < self.reset_s or self._trial:
+                return False
+            self._trial = True  # let exactly one call probe the provider
+            return True
+
+    def cancel(self) -> None:
+        """An allowed call never went out (e.g. no free slot); let another call probe."""
+        with self._lock:
+            self._trial = False
+
+    def record(self, ok: bool) -> None:
+        with self._lock:
+            self._trial = False
+            if ok:
+                self._consecutive = 0
+                self._opened_at = None
+                return
+            self._consecutive += 1
+            if self._opened_at is not None or self._consecutive >= self.failures:
+                if self._opened_at is None:
+                    self.trips += 1
+                self._opened_at = time.monotonic()
+
+
+class Upstream:
+    def __init__(self, name: str, base_url: str, *, max_concurrency: int = 8,
+                 timeout=(3.05, 10), headers: Optional[dict] = None):
+        self.name = name
+        self.base_url = base_url.rstrip("/")
+        self.timeout = timeout
+        self.breaker = CircuitBreaker()
+        self._slots = threading.BoundedSemaphore(max_concurrency)
+        self.max_concurrency = max_concurrency
+        self.headers = dict(headers or {})
+        self.session = requests.Session()
+        self.session.headers.update(self.headers)
+        self._aclient = None
+        self._aclient_loop = None
+        retry = Retry(
+            total=UPSTREAM_RETRIES,
+            read=UPSTREAM_RETRIES,
+            connect=UPSTREAM_RETRIES,
+            status=UPSTREAM_RETRIES,
+            backoff_factor=UPSTREAM_BACKOFF_S,
+            backoff_jitter=UPSTREAM_BACKOFF_JITTER_S,
+            status_forcelist=_RETRY_STATUSES,
+            allowed_methods=frozenset({"GET", "HEAD"}),
+            respect_retry_after_header=True,
+            raise_on_status=False,
+        )
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max_concurrency, max_retries=retry)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self.calls = 0
+        self.failures = 0
+        self.rejected = 0
+
+    def url(self, path: str) -> str:
+        return path if path.startswith(("http://", "https://")) else f"{self.base_url}/{path.lstrip('/')}"
+
+    def request(self, method: str, path: str, **kwargs) -> requests.Response:
+        """
+        Send through the pooled session. 5xx/429 replies and network errors count
+        against the breaker; other replies are returned as-is for the caller to check.
+        With stream=True the slot is released once headers arrive, not when the body ends.
+        """
+        if not self.breaker.allow():
+            self.rejected += 1
+            raise UpstreamUnavailable(f"{self.name}: circuit open")
+        recorded = False
+        try:
+            if not self._slots.acquire(timeout=UPSTREAM_QUEUE_TIMEOUT_S):
+                self.rejected += 1
+                raise UpstreamUnavailable(f"{self.name}: too many concurrent requests")
+            if kwargs.get("timeout") is None:
+                kwargs["timeout"] = self.timeout
+            self.calls += 1
+            try:
+                with metrics.span(f"upstream.{self.name}"):
+                    response = self.session.request(method, self.url(path), **kwargs)
+            except requests.RequestException:
+                self.failures += 1
+                self.breaker.record(False)
+                recorded = True
+                raise
+            finally:
+                self._slots.release()
+            ok = response.status_code not in _RETRY_STATUSES
+            if not ok:
+                self.failures += 1
+            self.breaker.record(ok)
+            recorded = True
+            return response
+        finally:
+            if not recorded:
+                self.breaker.cancel()  # never went out, or died mid-call: free the half-open trial
+
+    def get(self, path: str, **kwargs) -> requests.Response:
+        return self.request("GET", path, **kwargs)
+
+    def post(self, path: str, **kwargs) -> requests.Response:
+        return self.request("POST", path, **kwargs)
+
+    def aclient(self):
+        """httpx.AsyncClient bound to the running event loop (created on first use)."""
+        import httpx  # only the ASGI app needs it
+        loop = asyncio.get_running_loop()
+        if self._aclient is None or self._aclient_loop is not loop:
+            connect, read = self.timeout if isinstance(self.timeout, tuple) else (self.timeout, self.timeout)
+            limits = httpx.Limits(max_connections=self.max_concurrency,
+                                  max_keepalive_connections=self.max_concurrency)
+            self._aclient = httpx.AsyncClient(
+                base_url=self.base_url,
+                headers=self.headers,
+                timeout=httpx.Timeout(read, connect=connect, pool=UPSTREAM_QUEUE_TIMEOUT_S),
+                transport=httpx.AsyncHTTPTransport(retries=UPSTREAM_RETRIES, limits=limits, http2=_HTTP2),
+            )
+            self._aclient_loop = loop
+        return self._aclient
+
+    async def arequest(self, method: str, path: str, *, stream: bool = False, **kwargs):
+        """
+        Async counterpart of `request` (httpx). Transport retries cover connection
+        failures only. With stream=True the caller must `await response.aclose()`.
+        """
+        import httpx
+        if not self.breaker.allow():
+            self.rejected += 1
+            raise UpstreamUnavailable(f"{self.name}: circuit open")
+        recorded = False
+        try:
+            client = self.aclient()
+            self.calls += 1
+            try:
+                with metrics.span(f"upstream.{self.name}"):
+                    response = await client.send(client.build_request(method, self.url(path), **kwargs), stream=stream)
+            except httpx.PoolTimeout:
+                self.rejected += 1
+                raise UpstreamUnavailable(f"{self.name}: too many concurrent requests")
+            except httpx.HTTPError:
+                self.failures += 1
+                self.breaker.record(False)
+                recorded = True
+                raise
+            ok = response.status_code not in _RETRY_STATUSES
+            if not ok:
+                self.failures += 1
+            self.breaker.record(ok)
+            recorded = True
+            return response
+        finally:
+            if not recorded:
+                self.breaker.cancel()  # pool timeout, client disconnect (CancelledError), anything else
+
+    async def aclose(self) -> None:
+        if self._aclient is not None:
+            await self._aclient.aclose()
+            self._aclient = None
+
+    def stats(self) -> dict:
+        return {"calls": self.calls, "failures": self.failures, "rejected": self.rejected,
+                "breaker": self.breaker.state, "breaker_trips": self.breaker.trips}
+
+
+_NYC_APP_TOKEN = os.getenv("NYC_APP_TOKEN")
+
+OWM = Upstream(
+    "owm", os.getenv("OWM_BASE_URL", "https://api.openweathermap.org"),
+    max_concurrency=int(os.getenv("OWM_MAX_CONCURRENCY", "8")),
+)
+# Nominatim's policy allows one request at a time; the token bucket in event_planner paces it
+NOMINATIM = Upstream(
+    "nominatim", os.getenv("NOMINATIM_BASE_URL", "https://nominatim.openstreetmap.org"),
+    max_concurrency=int(os.getenv("NOMINATIM_MAX_CONCURRENCY", "1")),
+)
+SODA = Upstream(
+    "soda", os.getenv("NYC_CRIME_BASE", "https://data.cityofnewyork.us/resource"),
+    max_concurrency=int(os.getenv("SODA_MAX_CONCURRENCY", "6")),
+    timeout=(3.05, 20),
+    headers={"X-App-Token": _NYC_APP_TOKEN} if _NYC_APP_TOKEN else None,
+)
+ELEVENLABS = Upstream(
+    "elevenlabs", os.getenv("ELEVENLABS_BASE_URL", "https://api.elevenlabs.io"),
+    max_concurrency=int(os.getenv("ELEVENLABS_MAX_CONCURRENCY", "4")),
+    timeout=(5, 60),
+)
+
+UPSTREAMS = {u.name: u for u in (OWM, NOMINATIM, SODA, ELEVENLABS)}
+
+def upstream_stats() -> dict:
+    return {name: u.stats() for name, u in UPSTREAMS.items()}
+
+metrics.register_collector("upstream", lambda: {
+    name: dict(stats, breaker_open=stats["breaker"] != "closed") for name, stats in upstream_stats().items()
+})
@@ -40,7 +40,9 @@ const InputPage = ({ onPlanItinerary }) => {
         };
 
         try {
-            const response = await fetch('http://127.0.0.1:5000/api/itinerary', {
+            // Streamed plan: render the map as soon as the base plan arrives,
+            // then fill in weather/crime overlays leg by leg.
+            const response = await fetch('http://127.0.0.1:5000/api/itinerary/stream', {
                 method: 'POST',
                 headers: {
                     'Content-Type': 'application/json',
@@ -48,14 +50,49 @@ const InputPage = ({ onPlanItinerary }) => {
                 body: JSON.stringify(data),
             });
 
-            if (response.ok) {
-                const result = await response.json();
-                setLoading(false);
-                if (onPlanItinerary) onPlanItinerary('map', result); // Pass result to next step
-            } else {
+            if (!response.ok || !response.body) {
                 setLoading(false);
                 console.error('Error:', response.statusText);
+                return;
+            }
+
+            let result = null;
+            const applyEvent = (ev) => {
+                if (ev.event === 'plan') {
+                    result = {
+                        trip_id: ev.trip_id,
+                        base_plan: ev.base_plan,
+                        weather_overlay: { legWeather: [] },
+                        crime_overlay: { legCrime: [] },
+                    };
+                    setLoading(false);
+                } else if (ev.event === 'legWeather' || ev.event === 'legCrime') {
+                    const key = ev.event === 'legWeather' ? 'weather_overlay' : 'crime_overlay';
+                    const legs = [...result[key][ev.event]];
+                    legs[ev.index] = ev.record;
+                    result = { ...result, [key]: { ...result[key], [ev.event]: legs } };
+                } else if (ev.event === 'summary') {
+                    result = { ...result, weather_overlay: ev.weather_overlay, crime_overlay: ev.crime_overlay };
+                } else if (ev.event === 'error') {
+                    setLoading(false);
+                    console.error('Error:', ev.error);
+                    return;
+                }
+                if (result && onPlanItinerary) onPlanItinerary('map', result);
+            };
+
+            const reader = response.body.getReader();
+            const decoder = new TextDecoder();
+            let buffered = '';
+            for (;;) {
+                const { value, done } = await reader.read();
+                if (done) break;
+                buffered += decoder.decode(value, { stream: true });
+                const lines = buffered.split('\n');
+                buffered = lines.pop();
+                lines.filter(Boolean).forEach((line) => applyEvent(JSON.parse(line)));
             }
+            if (buffered.trim()) applyEvent(JSON.parse(buffered));
         } catch (err) {
             setLoading(false);
             console.error('Network error:', err);